@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Benchmarks of xnuplot's hot paths: raw commands, plot refreshes, multiplot
+# refreshes, encoding of numpy data, and session save/load, over a range of
+# data sizes and item counts.
+#
+# By default, Gnuplot is replaced by bench/fakegnuplot, so that the numbers
+# measure xnuplot (and the transport) rather than Gnuplot's drawing. Use
+# --gnuplot to run against a real Gnuplot (with a terminal that draws
+# nothing, e.g. --term=unknown).
+#
+# Run from the top of the source tree:
+#   python bench/run.py [options] [benchmark ...]
+
+import optparse
+import os
+import sys
+import tempfile
+import time
+
+_bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_bench_dir))
+
+import xnuplot
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def measure(func, repeat, number=1):
+    # Return the best and median time (per call) of func(), over repeat
+    # rounds of number calls each.
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(number):
+            func()
+        times.append((time.time() - start) / number)
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+def report(name, params, best, median, nbytes=None):
+    line = "{0:<24} {1:<24} {2:>12.6f} {3:>12.6f}".format(name, params,
+                                                         best * 1000,
+                                                         median * 1000)
+    if nbytes:
+        line += " {0:>10.1f}".format(nbytes / best / 1048576)
+    print line
+    sys.stdout.flush()
+
+def header():
+    print "{0:<24} {1:<24} {2:>12} {3:>12} {4:>10}".format("benchmark",
+                                                         "parameters",
+                                                         "best ms",
+                                                         "median ms",
+                                                         "MB/s")
+
+
+def points(n):
+    x = numpy.linspace(0.0, 1.0, n)
+    return numpy.column_stack((x, x * x))
+
+def text_points(n):
+    return "".join("{0:g} {1:g}\n".format(i, i * i) for i in xrange(n))
+
+def sizes(options, values):
+    return values[:2] if options.quick else values
+
+
+def bench_command(options):
+    "RawGnuplot.__call__ with small commands"
+    gp = xnuplot.Gnuplot(**options.gnuplot_kwargs)
+    try:
+        for command in ("set xrange [0:1]", "print 1"):
+            best, median = measure(lambda: gp(command), options.repeat, 20)
+            report("command", command, best, median)
+        # Output redirected by `set print' must not upset the framing of the
+        # output (which would end in a timeout here).
+        gp("set print '{0}'".format(os.devnull))
+        best, median = measure(lambda: gp("print 1"), options.repeat, 20)
+        report("command", "print 1 (set print)", best, median)
+        gp("unset print")
+        lines = "\n".join("set xrange [0:{0:d}]".format(i)
+                          for i in xrange(1, 51))
+        best, median = measure(lambda: gp.call_lines(lines), options.repeat)
+        report("command", "call_lines x50", best, median)
+    finally:
+        gp.close()
+
+def bench_data(options):
+    "RawGnuplot.__call__ with a data placeholder"
+    gp = xnuplot.Gnuplot(**options.gnuplot_kwargs)
+    try:
+        for mode in ("pipe", "file"):
+            for n in sizes(options, [100, 10000, 1000000]):
+                data = text_points(n)
+                command = "plot {{{{{0}:data}}}}".format(mode)
+                func = lambda: gp(command, data=data)
+                best, median = measure(func, options.repeat)
+                report("data", "{0} n={1:d}".format(mode, n), best, median,
+                       len(data))
+    finally:
+        gp.close()
+
+def bench_refresh(options):
+    "Plot.refresh with text and binary items"
+    plot = xnuplot.Plot(autorefresh=False, **options.gnuplot_kwargs)
+    try:
+        cases = [("text", n, k) for n in sizes(options, [100, 10000, 100000])
+                 for k in (1, 8)]
+        if numpy is not None:
+            cases += [("array", n, k)
+                      for n in sizes(options, [100, 10000, 1000000])
+                      for k in (1, 8)]
+        for kind, n, k in cases:
+            if kind == "text":
+                item = xnuplot.PlotData(text_points(n), "notitle")
+            else:
+                item = xnuplot.array(points(n), "notitle")
+            plot[:] = [item] * k
+            best, median = measure(plot.refresh, options.repeat)
+            report("refresh", "{0} n={1:d} k={2:d}".format(kind, n, k),
+                   best, median)
+    finally:
+        plot.close()
+
+def bench_multiplot(options):
+    "Multiplot._perform_refresh with several subplots"
+    multiplot = xnuplot.Multiplot(autorefresh=False,
+                                  **options.gnuplot_kwargs)
+    try:
+        for count in sizes(options, [1, 4, 16]):
+            subplots = []
+            for i in xrange(count):
+                subplot = xnuplot.Plot(autorefresh=False,
+                                       **options.gnuplot_kwargs)
+                subplot("set title 'panel {0:d}'".format(i))
+                subplot.append(xnuplot.PlotData(text_points(1000), "notitle"))
+                subplots.append(subplot)
+            multiplot[:] = subplots
+            best, median = measure(multiplot._perform_refresh, options.repeat)
+            report("multiplot", "subplots={0:d}".format(count), best, median)
+            multiplot[:] = []
+            for subplot in subplots:
+                subplot.close()
+    finally:
+        multiplot.close()
+
+def bench_encode(options):
+    "encoding of numpy data by xnuplot.numplot (no Gnuplot involved)"
+    if numpy is None:
+        print "encode: skipped (numpy not available)"
+        return
+    for n in sizes(options, [1000, 100000, 1000000]):
+        a = points(n)
+        strided = numpy.column_stack((a, a))[:, ::2]
+        ints = (a * 1000).astype(numpy.int32)
+        records = numpy.zeros((n, 3), dtype=numpy.float32)
+        for name, func, nbytes in [
+                ("array", lambda: xnuplot.array(a), a.nbytes),
+                ("array strided", lambda: xnuplot.array(strided),
+                 a.nbytes),
+                ("array int32", lambda: xnuplot.array(ints),
+                 ints.nbytes),
+                ("record", lambda: xnuplot.record(records),
+                 records.nbytes)]:
+            best, median = measure(func, options.repeat, 10)
+            report("encode", "{0} n={1:d}".format(name, n), best, median,
+                   nbytes)
+    for side in sizes(options, [32, 256, 1024]):
+        m = numpy.zeros((side, side))
+        x = numpy.arange(side, dtype=float)
+        func = lambda: xnuplot.matrix(m, x, x)
+        best, median = measure(func, options.repeat, 10)
+        report("encode", "matrix {0:d}x{0:d}".format(side), best, median,
+               m.nbytes)
+
+def bench_session(options):
+    "Plot.save and xnuplot.load"
+    plot = xnuplot.Plot(autorefresh=False, **options.gnuplot_kwargs)
+    fd, path = tempfile.mkstemp(prefix="xnuplot-bench.")
+    os.close(fd)
+    try:
+        for n, k in [(n, k) for n in sizes(options, [100, 10000, 100000])
+                     for k in (1, 8)]:
+            plot[:] = [xnuplot.PlotData(text_points(n), "notitle")] * k
+            best, median = measure(lambda: plot.save(path), options.repeat)
+            params = "n={0:d} k={1:d}".format(n, k)
+            report("save", params, best, median)
+            def load():
+                xnuplot.load(path, autorefresh=False).close()
+            best, median = measure(load, options.repeat)
+            report("load", params, best, median)
+    finally:
+        plot.close()
+        os.unlink(path)
+
+benchmarks = [("command", bench_command),
+              ("data", bench_data),
+              ("refresh", bench_refresh),
+              ("multiplot", bench_multiplot),
+              ("encode", bench_encode),
+              ("session", bench_session)]
+
+
+def main():
+    names = [name for name, func in benchmarks]
+    parser = optparse.OptionParser(usage="usage: %prog [options] "
+                                   "[benchmark ...]",
+                                   description="Benchmarks: " +
+                                   ", ".join(names) + " (default: all).")
+    parser.add_option("--gnuplot", metavar="COMMAND",
+                      help="run against a real Gnuplot, invoked as COMMAND")
+    parser.add_option("--term", default="unknown",
+                      help="terminal for a real Gnuplot (default: %default)")
+    parser.add_option("--transport", default="pty", choices=["pty", "pipe"],
+                      help="xnuplot transport (default: %default)")
+    parser.add_option("--echo", default="exact",
+                      choices=["exact", "gnu", "bsd", "tty"],
+                      help="echo style of the fake Gnuplot (default: "
+                      "%default)")
+    parser.add_option("--plot-delay", type="float", default=0.0,
+                      metavar="SECS",
+                      help="drawing time of each plot by the fake Gnuplot")
+    parser.add_option("--pipeline", action="store_true",
+                      help="use pipelined commands")
+    parser.add_option("-r", "--repeat", type="int", default=5,
+                      help="rounds per measurement (default: %default)")
+    parser.add_option("-q", "--quick", action="store_true",
+                      help="only the smaller sizes")
+    options, args = parser.parse_args()
+    for name in args:
+        if name not in names:
+            parser.error("unknown benchmark: " + name)
+
+    if options.gnuplot:
+        # Draw nothing, so that the numbers are not dominated by rendering
+        # (the trailing `-' keeps Gnuplot reading commands after -e).
+        command = "{0} -e 'set terminal {1}' -".format(options.gnuplot,
+                                                        options.term)
+    else:
+        command = "{0} {1} --echo={2} --plot-delay={3:g}".format(
+            sys.executable, os.path.join(_bench_dir, "fakegnuplot"),
+            options.echo, options.plot_delay)
+    # Also picked up by xnuplot.load(), which takes no command.
+    os.environ["XNUPLOT_GNUPLOT"] = command
+    options.gnuplot_kwargs = dict(transport=options.transport,
+                                  pipeline=bool(options.pipeline))
+    print "# gnuplot: {0}".format(command)
+    print "# transport: {0}, pipeline: {1}".format(options.transport,
+                                                   bool(options.pipeline))
+    header()
+    for name, func in benchmarks:
+        if not args or name in args:
+            func(options)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Shared setup of the tests: xnuplot is imported from this source tree, and
+# Gnuplot is replaced by bench/fakegnuplot (also for xnuplot.load(), which
+# takes no command), so that the tests need no Gnuplot installation.
+#
+# Run from the top of the source tree:
+#   python -m unittest discover -s test
+
+import os
+import sys
+
+_test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_test_dir))
+
+gnuplot_command = "{0} {1}".format(
+        sys.executable,
+        os.path.join(os.path.dirname(_test_dir), "bench", "fakegnuplot"))
+os.environ["XNUPLOT_GNUPLOT"] = gnuplot_command
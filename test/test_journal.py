@@ -0,0 +1,123 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Journals: what load() replays from a journal file, before and after the
+# file is compacted.
+
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from support import gnuplot_command
+import xnuplot
+from xnuplot import PlotData
+
+
+def _contents(plot):
+    # The items of a plot, with the data of PlotData items as strings.
+    return [item if isinstance(item, basestring) else
+            (str(item.data), item.options, item.mode) for item in plot]
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="xnuplot-test.")
+        self.plots = []
+
+    def tearDown(self):
+        for plot in self.plots:
+            plot.close()
+        shutil.rmtree(self.dir)
+
+    def new_plot(self):
+        plot = xnuplot.Plot(command=gnuplot_command, autorefresh=False)
+        self.plots.append(plot)
+        return plot
+
+    def load(self, filename):
+        plot = xnuplot.load(filename, autorefresh=False)
+        self.plots.append(plot)
+        return plot
+
+    def edit(self, plot, rounds):
+        # Changes whose records outgrow the state they lead to.
+        plot.append("sin(x)")
+        plot.append(PlotData("1 2\n3 4\n", "with lines"))
+        plot("set xrange [0:5]")
+        for i in range(rounds):
+            plot.append(PlotData("{0:d} {0:d}\n".format(i) * 50, "with points"))
+            del plot[-1]
+        plot.size = (0.5, 0.5)
+        plot.insert(0, "cos(x)")
+        plot.reverse()
+
+    def test_round_trip(self):
+        plot = self.new_plot()
+        plot.append("tan(x)")
+        filename = os.path.join(self.dir, "plot.journal")
+        with xnuplot.Journal(plot, filename, compact_bytes=None):
+            self.edit(plot, 3)
+        loaded = self.load(filename)
+        self.assertEqual(_contents(loaded), _contents(plot))
+        self.assertEqual(loaded.size, (0.5, 0.5))
+        self.assertIn("set xrange [0:5]", loaded.environment_script())
+
+    def test_round_trip_after_compaction(self):
+        plot = self.new_plot()
+        uncompacted = os.path.join(self.dir, "uncompacted.journal")
+        with xnuplot.Journal(plot, uncompacted, compact_bytes=None):
+            self.edit(plot, 40)
+
+        plot = self.new_plot()
+        filename = os.path.join(self.dir, "plot.journal")
+        with xnuplot.Journal(plot, filename, compact_bytes=2048) as journal:
+            self.edit(plot, 40)
+            # Also a change made while the compaction runs.
+            journal.compact()
+            plot.append("x")
+        self.assertLess(os.path.getsize(filename),
+                        os.path.getsize(uncompacted))
+        self.assertFalse(os.path.exists(filename + ".compacting"))
+        loaded = self.load(filename)
+        self.assertEqual(_contents(loaded), _contents(plot))
+        self.assertEqual(loaded.size, (0.5, 0.5))
+        self.assertIn("set xrange [0:5]", loaded.environment_script())
+
+    def test_torn_record_ignored(self):
+        plot = self.new_plot()
+        filename = os.path.join(self.dir, "plot.journal")
+        with xnuplot.Journal(plot, filename, compact_bytes=None):
+            plot.append("sin(x)")
+            plot.append("cos(x)")
+        with open(filename, "rb") as file:
+            contents = file.read()
+        with open(filename, "wb") as file:
+            file.write(contents[:-5])
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            loaded = self.load(filename)
+        self.assertEqual(_contents(loaded), ["sin(x)"])
+
+
+if __name__ == "__main__":
+    unittest.main()
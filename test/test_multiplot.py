@@ -0,0 +1,85 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# The multiplot script: only the settings that change between panels are
+# sent, except the size and origin overrides, which the layout resets after
+# each panel.
+
+import unittest
+
+from support import gnuplot_command
+import xnuplot
+
+
+class MultiplotScriptTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.multiplot = xnuplot.GridMultiplot(1, 3, command=gnuplot_command,
+                                               autorefresh=False)
+        for i in range(3):
+            plot = xnuplot.Plot(command=gnuplot_command, autorefresh=False)
+            plot.append("sin(x)")
+            plot("set grid")
+            plot.size = (0.3, 0.4)
+            plot.origin = (0.1, 0.2)
+            self.multiplot.append(plot)
+        self.multiplot("set size 0.9,0.9")
+
+    def tearDown(self):
+        for plot in self.multiplot:
+            plot.close()
+        self.multiplot.close()
+
+    def panels(self):
+        # The lines sent before each panel's plot command.
+        script, data = self.multiplot._multiplot_script(
+                self.multiplot.environment_script())
+        lines = script.split("\n")
+        self.assertEqual(lines[0], "set multiplot layout 1, 3 rowsfirst "
+                                   "downwards")
+        panels = [[]]
+        for line in lines[1:lines.index("unset multiplot")]:
+            if line.startswith("plot "):
+                panels.append([])
+            else:
+                panels[-1].append(line)
+        return panels[:-1]
+
+    def test_overrides_resent_for_every_panel(self):
+        panels = self.panels()
+        self.assertEqual(len(panels), 3)
+        for panel in panels:
+            self.assertIn("set size 3.000000e-01, 4.000000e-01", panel)
+            self.assertIn("set origin 1.000000e-01, 2.000000e-01", panel)
+
+    def test_unchanged_settings_sent_once(self):
+        panels = self.panels()
+        self.assertIn("set grid", panels[0])
+        self.assertNotIn("set grid", panels[1])
+        self.assertNotIn("set grid", panels[2])
+
+    def test_settings_restored_after_refresh(self):
+        self.multiplot.refresh()
+        self.assertIn("size is scaled by 0.9,0.9",
+                      self.multiplot("show size"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Statements spanning several lines (datablock definitions, continued lines,
+# and bracketed blocks), as sent by call_lines() on each execution path.
+
+import unittest
+
+from support import gnuplot_command
+import xnuplot
+from xnuplot._gnuplot import _statements
+
+_script = "\n".join([
+        "$data << EOD",
+        "1 2",
+        "EOD",
+        "print 1 + \\",
+        "  2",
+        "if (1) {",
+        "  print 3",
+        "}",
+        "print 4",
+        ])
+
+# The output of each line: a statement's output goes with its first line.
+_results = ["", "", "", "1+2\n", "", "3\n", "", "", "4\n"]
+
+
+class StatementsTestCase(unittest.TestCase):
+
+    def test_grouping(self):
+        self.assertEqual(_statements(_script.split("\n")),
+                         [["$data << EOD", "1 2", "EOD"],
+                          ["print 1 + \\", "  2"],
+                          ["if (1) {", "  print 3", "}"],
+                          ["print 4"]])
+
+    def test_nested_blocks(self):
+        lines = ["do for [i=1:2] {", "  if (i) {", "    print i", "  }", "}",
+                 "print '}'"]
+        self.assertEqual(_statements(lines), [lines[:5], lines[5:]])
+
+    def test_datablock_delimiter_prefix(self):
+        # Gnuplot ends a datablock at the first line starting with the
+        # delimiter.
+        lines = ["$data << EOD", "1 2", "EOD trailing", "print 1"]
+        self.assertEqual(_statements(lines), [lines[:3], lines[3:]])
+
+
+class CallLinesTestCase(unittest.TestCase):
+    # call_lines() on a blocking Gnuplot; subclasses choose the transport.
+
+    transport = "pty"
+    pipeline = False
+
+    def setUp(self):
+        self.gp = xnuplot.Gnuplot(command=gnuplot_command,
+                                  transport=self.transport,
+                                  pipeline=self.pipeline)
+
+    def tearDown(self):
+        self.gp.close()
+
+    def call_lines(self, command):
+        return self.gp.call_lines(command)
+
+    def test_statements(self):
+        self.assertEqual(self.call_lines(_script), _results)
+
+    def test_datablock_is_defined(self):
+        self.call_lines(_script)
+        self.assertEqual(self.call_lines("plot $data"), [""])
+
+    def test_error_in_later_line(self):
+        results = self.call_lines("print 1\nfoo\nprint 2")
+        self.assertEqual(results[0], "1\n")
+        self.assertIn("invalid command", results[1])
+
+
+class PipeCallLinesTestCase(CallLinesTestCase):
+    transport = "pipe"
+
+
+class PipelinedPtyCallLinesTestCase(CallLinesTestCase):
+    pipeline = True
+
+
+class PipelinedPipeCallLinesTestCase(CallLinesTestCase):
+    transport = "pipe"
+    pipeline = True
+
+
+class AsyncCallLinesTestCase(CallLinesTestCase):
+
+    def setUp(self):
+        self.gp = xnuplot.AsyncGnuplot(command=gnuplot_command)
+
+    def call_lines(self, command):
+        return self.gp.call_lines(command).result(timeout=10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,11 +22,77 @@ from ._gnuplot import RawGnuplot, Gnuplot, PlotData, closeall
 from ._gnuplot import CommunicationError, GnuplotError
 from ._plot import Plot, SPlot, Multiplot, GridMultiplot, load
 from ._plot import FileFormatError
+from ._probe import probe, Capabilities
+from ._stats import Stats, CommandRecord
+
+import imp as _imp
+import importlib as _importlib
+import sys as _sys
+import types as _types
+
+# Attributes whose modules are imported when the attribute is first used, so
+# that `import xnuplot' imports only what every user needs: name -> module.
+_lazy_attributes = {
+    "Journal": "._journal",
+    "GnuplotPool": "._pool",
+    "render_many": "._batch",
+    "render_grid": "._batch",
+    "AsyncGnuplot": "._async",
+    "AsyncPlot": "._async",
+    "AsyncSPlot": "._async",
+    "EventLoop": "._async",
+    "Future": "._async",
+    "get_event_loop": "._async",
+}
+
+class _Package(_types.ModuleType):
+    # This package, as a module whose lazy attributes are looked up in their
+    # modules (and then kept) when first used. (Python 2 modules cannot
+    # define __getattr__().)
+
+    def __getattr__(self, name):
+        if name not in _lazy_attributes:
+            raise AttributeError("'module' object has no attribute "
+                                 "'{0}'".format(name))
+        module = _importlib.import_module(_lazy_attributes[name], __name__)
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_lazy_attributes))
+
 
 try:
-    import numpy as _numpy
+    # NumPy takes long to import, so it (along with _numplot) is imported
+    # when one of these functions is first called.
+    _imp.find_module("numpy")
 except ImportError, e:
     pass
 else:
-    from ._numplot import array, record, matrix
+    def array(arr, options=None, coord_options=None, using=None):
+        """Return a binary array plot data item for a NumPy array."""
+        from ._numplot import array
+        return array(arr, options, coord_options, using)
+
+    def record(arr, options=None, using=None):
+        """Return a binary record plot data item for a NumPy array."""
+        from ._numplot import record
+        return record(arr, options, using)
+
+    def matrix(arr, xcoords, ycoords, options=None):
+        """Return a binary matrix plot data item for a NumPy array."""
+        from ._numplot import matrix
+        return matrix(arr, xcoords, ycoords, options)
+
+    def table(gp, *items, **kwargs):
+        """Return the points that gp.plot() would draw, as NumPy arrays."""
+        from ._numplot import table
+        return table(gp, *items, **kwargs)
 
+_package = _Package(__name__, __doc__)
+_package.__dict__.update(_sys.modules[__name__].__dict__)
+# (Keeping the original module, so that Python does not clear its globals,
+# which the functions defined here use.)
+_package._module = _sys.modules[__name__]
+_sys.modules[__name__] = _package
@@ -0,0 +1,731 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Non-blocking front end: Gnuplot instances whose commands return futures,
+# driven by a select()-based event loop that multiplexes any number of
+# Gnuplot processes (and the named pipes carrying their data) in one thread.
+
+from ._gnuplot import (Gnuplot, CommunicationError, GnuplotError,
+                       _statements, _line_results)
+from ._plot import Plot, SPlot, _ObservedList
+from ._outbound import _OutboundNamedPipe
+from ._stats import _Measurement
+from ._transport import _TransportEOF
+import collections
+import errno
+import functools
+import heapq
+import itertools
+import os
+import select
+import sys
+import time
+import traceback
+import warnings
+
+class Future(object):
+    """The eventual result of an asynchronous operation.
+
+    Methods:
+    done() - whether the result (or exception) is available
+    result() - return the result, running the event loop until it is ready
+    exception() - return the exception, if any
+    add_done_callback() - arrange for a function to be called when done
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop or get_event_loop()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def __repr__(self):
+        state = "pending"
+        if self._done:
+            state = "failed" if self._exc_info else "done"
+        return "<Future {0}>".format(state)
+
+    def done(self):
+        "Return True if the result or exception is available."
+        return self._done
+
+    def result(self, timeout=None):
+        """Return the result, running the event loop until it is ready.
+
+        If the operation failed, its exception is raised. If timeout is
+        given and the result is not ready by then, CommunicationError is
+        raised.
+        """
+        self.loop._wait(self, timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        "Return the exception raised by the operation, or None."
+        self.loop._wait(self, timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, callback):
+        """Arrange for callback(future) to be called when done.
+
+        The callback is called from the event loop (soon, if the future is
+        already done).
+        """
+        if self._done:
+            self.loop.call_soon(callback, self)
+        else:
+            self._callbacks.append(callback)
+
+    def set_result(self, result):
+        self._result = result
+        self._set_done()
+
+    def set_exception(self, exception):
+        # exception can be an exception instance or a sys.exc_info() tuple.
+        if isinstance(exception, BaseException):
+            exception = (type(exception), exception, None)
+        self._exc_info = exception
+        self._set_done()
+
+    def _set_done(self):
+        if self._done:
+            raise RuntimeError("future is already done")
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self.loop.call_soon(callback, self)
+
+def _completed(loop, result=None):
+    future = Future(loop)
+    future.set_result(result)
+    return future
+
+
+class _Return(Exception):
+    # Raised by a coroutine to return a value (generators cannot).
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+def _coroutine(method):
+    # Turn a generator method, which yields futures and receives their
+    # results, into a method returning a future. The generator runs on
+    # self.loop.
+    @functools.wraps(method)
+    def start(self, *args, **kwargs):
+        return _Task(method(self, *args, **kwargs), self.loop)
+    return start
+
+class _Task(Future):
+    def __init__(self, generator, loop):
+        Future.__init__(self, loop)
+        self._generator = generator
+        self._step(None, None)
+
+    def _step(self, value, exc_info):
+        try:
+            if exc_info:
+                future = self._generator.throw(*exc_info)
+            else:
+                future = self._generator.send(value)
+        except StopIteration:
+            self.set_result(None)
+        except _Return, e:
+            self.set_result(e.value)
+        except Exception:
+            self.set_exception(sys.exc_info())
+        else:
+            future.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        self._step(future._result, future._exc_info)
+
+
+class _Timer(object):
+    __slots__ = ("when", "callback", "args", "cancelled")
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class EventLoop(object):
+    """A select()-based event loop for AsyncGnuplot instances.
+
+    An event loop must only be used from one thread. Each AsyncGnuplot uses
+    the loop given to its constructor, or the default loop (see
+    get_event_loop()).
+
+    Methods:
+    run_until_complete() - run the loop until a future is done
+    run_forever() - run the loop until stop() is called
+    stop() - make run_forever() return
+    run_once() - wait for, and handle, events once
+    call_soon() - call a function from the loop
+    call_later() - call a function from the loop after a delay
+    add_reader(), remove_reader(), add_writer(), remove_writer() - watch
+        file descriptors
+    """
+
+    def __init__(self):
+        self._ready = collections.deque()
+        self._timers = [] # Heap of (when, sequence number, _Timer).
+        self._sequence = itertools.count()
+        self._readers = {}
+        self._writers = {}
+        self._stopping = False
+
+    def call_soon(self, callback, *args):
+        "Arrange for callback(*args) to be called from the loop."
+        self._ready.append((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        """Arrange for callback(*args) to be called after delay seconds.
+
+        Returns an object whose cancel() method cancels the call.
+        """
+        timer = _Timer(time.time() + delay, callback, args)
+        heapq.heappush(self._timers,
+                       (timer.when, next(self._sequence), timer))
+        return timer
+
+    def add_reader(self, fd, callback, *args):
+        "Call callback(*args) whenever fd is readable."
+        self._readers[fd] = (callback, args)
+
+    def remove_reader(self, fd):
+        self._readers.pop(fd, None)
+
+    def add_writer(self, fd, callback, *args):
+        "Call callback(*args) whenever fd is writable."
+        self._writers[fd] = (callback, args)
+
+    def remove_writer(self, fd):
+        self._writers.pop(fd, None)
+
+    def run_until_complete(self, future, timeout=None):
+        """Run the loop until future is done, and return its result.
+
+        If timeout is given and the future is not done by then,
+        CommunicationError is raised (the operation continues).
+        """
+        self._wait(future, timeout)
+        return future.result()
+
+    def _wait(self, future, timeout=None):
+        deadline = (time.time() + timeout if timeout is not None else None)
+        while not future.done():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise CommunicationError("timeout")
+            self.run_once(remaining)
+
+    def run_forever(self):
+        "Run the loop until stop() is called."
+        self._stopping = False
+        while not self._stopping:
+            self.run_once()
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+
+    def run_once(self, timeout=None):
+        """Wait (for at most timeout seconds) for events, and handle them.
+
+        Does not wait if any callbacks are ready to be called.
+        """
+        if self._ready:
+            timeout = 0
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if self._timers:
+            until_timer = max(0, self._timers[0][0] - time.time())
+            if timeout is None or until_timer < timeout:
+                timeout = until_timer
+        if self._readers or self._writers:
+            try:
+                readable, writable, _ = select.select(list(self._readers),
+                                                      list(self._writers), [],
+                                                      timeout)
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                readable, writable = [], []
+            for fd in readable:
+                if fd in self._readers:
+                    self._ready.append(self._readers[fd])
+            for fd in writable:
+                if fd in self._writers:
+                    self._ready.append(self._writers[fd])
+        elif timeout:
+            time.sleep(timeout)
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)[2]
+            if not timer.cancelled:
+                self._ready.append((timer.callback, timer.args))
+        # Callbacks added while these run wait for the next iteration.
+        for i in xrange(len(self._ready)):
+            if not self._ready:
+                break # Run by a nested call (see Future.result()).
+            callback, args = self._ready.popleft()
+            try:
+                callback(*args)
+            except Exception:
+                traceback.print_exc()
+
+_default_loop = None
+
+def get_event_loop():
+    """Return the default event loop, creating it if necessary."""
+    global _default_loop
+    if _default_loop is None:
+        _default_loop = EventLoop()
+    return _default_loop
+
+
+class _LoopOutboundNamedPipe(_OutboundNamedPipe):
+    # Named pipe written from the event loop, rather than by the writer pool.
+
+    max_poll_interval = 0.002
+
+    def __init__(self, data, fifos, loop, deadline=None, debug=False):
+        self._loop = loop
+        self._fd = None
+        self._poll_interval = 0.0001
+        _OutboundNamedPipe.__init__(self, data, fifos, deadline, debug)
+
+    def _start(self):
+        self._loop.call_soon(self._try_open)
+
+    def cancel(self):
+        _OutboundNamedPipe.cancel(self)
+        if self._fd is not None:
+            self._loop.call_soon(self._on_writable)
+
+    def _try_open(self):
+        if self._finished:
+            return
+        try:
+            self._fd = self._open()
+        except:
+            self._finish()
+            raise
+        if self._fd is not None:
+            self._loop.add_writer(self._fd, self._on_writable)
+        elif not self._finished:
+            # Gnuplot has not opened the pipe yet.
+            self._loop.call_later(self._poll_interval, self._try_open)
+            self._poll_interval = min(self._poll_interval * 2,
+                                      self.max_poll_interval)
+
+    def _on_writable(self):
+        if self._fd is None:
+            return
+        try:
+            done = self._write_some(self._fd)
+        except:
+            done = True
+            raise
+        finally:
+            if done:
+                self._loop.remove_writer(self._fd)
+                os.close(self._fd)
+                self._fd = None
+                self._finish()
+
+
+class _Job(object):
+    # A command sent to Gnuplot, whose output is still being received. Each
+    # statement (see _statements()) is sent with its own sentinel, and has
+    # one output.
+    def __init__(self, command, statements, future, context, measurement):
+        self.command = command
+        self.statements = statements
+        self.outputs = []
+        self.future = future
+        self.context = context # Placeholder substitution to exit when done.
+        self.measurement = measurement
+
+class AsyncGnuplot(Gnuplot):
+    """Gnuplot instance with non-blocking commands.
+
+    AsyncGnuplot is like Gnuplot, except that __call__(), call_lines(),
+    plot(), splot(), replot(), and fit() return a Future instead of waiting
+    for Gnuplot to finish. The Gnuplot process is driven by an EventLoop,
+    together with any other AsyncGnuplot instances using the same loop, and
+    data placeholders are written to their named pipes from the loop rather
+    than by threads.
+
+    Commands are sent to Gnuplot right away, in the order in which they are
+    issued; their outputs are received in the same order. The `pipe'
+    transport is always used.
+
+    Example:
+    loop = xnuplot.get_event_loop()
+    plots = [xnuplot.AsyncGnuplot() for i in range(10)]
+    futures = [gp.plot("sin({0} * x)".format(i))
+               for i, gp in enumerate(plots)]
+    for future in futures:
+        future.result() # Runs the loop until the plot is done.
+
+    Attributes:
+    loop - the EventLoop driving this instance
+    """
+
+    def __init__(self, loop=None, **kwargs):
+        """Return a new AsyncGnuplot object.
+
+        Accepts the same keyword arguments as Gnuplot.__init__() (except
+        that transport, if given, must be "pipe", and lazy is not
+        supported), plus:
+        loop - The EventLoop to use. Defaults to get_event_loop().
+
+        Starting Gnuplot blocks until it is ready.
+        """
+        self._setup_loop(loop, kwargs)
+        Gnuplot.__init__(self, **kwargs)
+        self._start_loop()
+
+    def _setup_loop(self, loop, kwargs):
+        if kwargs.setdefault("transport", "pipe") != "pipe":
+            raise ValueError("AsyncGnuplot requires the pipe transport")
+        if kwargs.get("lazy"):
+            raise ValueError("AsyncGnuplot does not support lazy")
+        self.loop = loop or get_event_loop()
+        self._jobs = collections.deque() # In the order they were sent.
+        self._consumers = collections.deque() # Job for each reply, or None.
+
+    def _start_loop(self):
+        self.loop.add_reader(self.transport.read_fd, self._on_readable)
+        # Find out now, so that _can_inline() never needs to block.
+        self._supports_datablocks()
+
+    def terminate(self):
+        """Force-quit the Gnuplot subprocess and remove all temporary files."""
+        self._abort(CommunicationError("Gnuplot died"))
+
+    def _abort(self, exception):
+        # Terminate, failing all commands in progress with exception.
+        transport = getattr(self, "_transport", None)
+        if transport is not None:
+            self.loop.remove_reader(transport.read_fd)
+            self.loop.remove_writer(transport.write_fd)
+        Gnuplot.terminate(self)
+        self._consumers.clear()
+        while self._jobs:
+            self._finish_job(self._jobs[0], (type(exception), exception, None))
+
+    def __call__(self, command, **data):
+        """Send a command (or commands) to Gnuplot; return a Future.
+
+        The result of the future is the output, as returned by
+        Gnuplot.__call__().
+        """
+        return self._chain(self._call_lines_async(command, **data),
+                           lambda results: "\n".join(r for r in results if r))
+
+    def call_lines(self, command, **data):
+        """Send command(s) to Gnuplot; return a Future.
+
+        The result of the future is the list of outputs of each line, as
+        returned by Gnuplot.call_lines(). All lines are sent at once.
+        """
+        return self._call_lines_async(command, **data)
+
+    def _call_lines(self, command, **data):
+        # Used by the blocking methods inherited from RawGnuplot.
+        return self._call_lines_async(command, **data).result()
+
+    def _call_lines_async(self, command, **data):
+        future = Future(self.loop)
+        if not self.isalive():
+            future.set_exception(
+                    CommunicationError("Gnuplot process has exited."))
+            return future
+        self._command_issued(command)
+        measurement = _Measurement()
+        self._measurement = measurement
+        try:
+            context = self._placeholders_substituted(command, **data)
+            try:
+                substituted = context.__enter__()
+            except:
+                future.set_exception(sys.exc_info())
+                return future
+            job = _Job(command, _statements(substituted.split("\n")), future,
+                       context, measurement)
+            self._jobs.append(job)
+            for statement in job.statements:
+                self._send("\n".join(statement), job)
+        finally:
+            self._measurement = None
+            measurement.send = time.time() - measurement.start
+        if self.timeout is not None:
+            self.loop.call_later(self.timeout, self._check_timeout, job)
+        return future
+
+    def _send(self, line, consumer):
+        # consumer is the job receiving the reply, or None to discard it.
+        if self.transport is None:
+            return
+        self.transport.enqueue(line)
+        self._consumers.append(consumer)
+        self.loop.add_writer(self.transport.write_fd, self._on_writable)
+
+    def _define_datablocks(self, blocks):
+        self._send(self._datablock_definitions(blocks), None)
+
+    def _undefine_datablock(self, name):
+        self._send("undefine " + name, None)
+
+    def _outbound_pipe(self, data):
+        return _LoopOutboundNamedPipe(data, self._fifos, self.loop,
+                                      deadline=self._write_deadline(),
+                                      debug=self.debug)
+
+    def _on_writable(self):
+        try:
+            self.transport.writable()
+        except _TransportEOF:
+            self._on_eof()
+            return
+        if not self.transport.wants_write():
+            self.loop.remove_writer(self.transport.write_fd)
+
+    def _on_readable(self):
+        try:
+            self.transport.readable()
+        except _TransportEOF:
+            self._on_eof()
+            return
+        while self._consumers:
+            output = self.transport.poll_receive()
+            if output is None:
+                break
+            job = self._consumers.popleft()
+            if job is not None:
+                job.outputs.append(output)
+                if len(job.outputs) == len(job.statements):
+                    self._finish_job(job)
+
+    def _finish_job(self, job, exc_info=None):
+        self._jobs.remove(job)
+        try:
+            job.context.__exit__(*(exc_info or (None, None, None)))
+        except Exception:
+            if not exc_info:
+                exc_info = sys.exc_info()
+        measurement = job.measurement
+        measurement.wait = time.time() - measurement.start - measurement.send
+        self._record(measurement.record("command", job.command))
+        if exc_info:
+            job.future.set_exception(exc_info)
+        else:
+            # (Cut short, if Gnuplot exited, before the statement that made
+            # it exit.)
+            statements = job.statements[:len(job.outputs)]
+            job.future.set_result(_line_results(statements, job.outputs))
+
+    def _on_eof(self):
+        # Gnuplot exited. If the current line was `quit' or `exit', the
+        # command it belongs to ends there.
+        job = self._jobs[0] if self._jobs else None
+        if job and self._exit_pattern.match(
+                job.statements[len(job.outputs)][0]):
+            self._finish_job(job)
+        self.terminate()
+
+    def _check_timeout(self, job):
+        if job in self._jobs:
+            self._abort(CommunicationError("timeout"))
+
+    def _chain(self, future, func):
+        # Return a future for func(result of future).
+        chained = Future(self.loop)
+        def done(future):
+            try:
+                chained.set_result(func(future.result()))
+            except Exception:
+                chained.set_exception(sys.exc_info())
+        future.add_done_callback(done)
+        return chained
+
+    def _release_cache_when_done(self, future):
+        # Cached data may only be evicted when no command can be using it.
+        def done(future):
+            if self._cache is not None and not self._jobs:
+                self._cache.release(self)
+        future.add_done_callback(done)
+        return future
+
+    def _plot(self, cmd, *items):
+        if not items:
+            return _completed(self.loop)
+        try:
+            command, data_dict = self._plot_command(cmd, *items)
+        except:
+            future = Future(self.loop)
+            future.set_exception(sys.exc_info())
+            return self._release_cache_when_done(future)
+        future = self(command, **data_dict)
+        self._release_cache_when_done(future)
+        return self._chain(future,
+                           lambda result: self._check_plot_result(cmd, result))
+
+    def fit(self, data, expr, via, ranges=None):
+        """Issue a `fit' command; return a Future for its output.
+
+        See Gnuplot.fit().
+        """
+        try:
+            cmd, fitdata = self._fit_command(data, expr, via, ranges)
+        except:
+            future = Future(self.loop)
+            future.set_exception(sys.exc_info())
+            return self._release_cache_when_done(future)
+        return self._release_cache_when_done(self(cmd, fitdata=fitdata))
+
+
+class AsyncPlot(AsyncGnuplot, Plot):
+    """A self-refreshing, editable, 2D plot with non-blocking commands.
+
+    AsyncPlot is to Plot what AsyncGnuplot is to Gnuplot: __call__(),
+    plot(), splot(), replot(), fit(), and refresh() return Futures.
+    Modifying the list sends the `plot' command without waiting for it to
+    complete; errors from such automatic refreshes are reported as warnings.
+    Other methods, such as environment_script() and save(), block until
+    Gnuplot has replied. An AsyncPlot cannot be part of a Multiplot.
+    Refreshes deferred by refresh_interval are sent by the loop.
+    """
+
+    def __init__(self, autorefresh=True, description=None, loop=None,
+                 **kwargs):
+        self._setup_loop(loop, kwargs)
+        Plot.__init__(self, autorefresh, description, **kwargs)
+        self._start_loop()
+
+    __call__ = _ObservedList._with_autorefresh(AsyncGnuplot.__call__)
+    call_lines = _ObservedList._with_autorefresh(AsyncGnuplot.call_lines)
+
+    def refresh(self):
+        """Send the `plot' command; return a Future."""
+        if self._block_refresh or not self.isalive():
+            return _completed(self.loop)
+        self._refresh_pending = False
+        self._last_refresh = time.time()
+        measurement = _Measurement()
+        try:
+            self._block_refresh = True
+            if len(self):
+                future = self._plotmethod(*self)
+            else:
+                future = self("clear")
+        finally:
+            self._block_refresh = False
+        future.add_done_callback(lambda future: self._record(
+                measurement.record("refresh", self.description)))
+        return future
+
+    def _perform_autorefresh(self):
+        if self._block_refresh or not self.autorefresh:
+            return
+        if self._refresh_deferred():
+            return
+        self.refresh().add_done_callback(_warn_on_error)
+
+    def _call_later(self, delay, callback):
+        # Deferred refreshes are done by the loop, not by a timer thread.
+        self.loop.call_later(delay, callback)
+
+    @_coroutine
+    def fit(self, data, expr, via, ranges=None,
+            limit=None, maxiter=None, start_lambda=None, lambda_factor=None):
+        """Perform a fit; return a Future for (params, errors, log).
+
+        See Plot.fit().
+        """
+        blocking_refresh = self._block_refresh
+        self._block_refresh = True
+        try:
+            if isinstance(via, collections.Mapping):
+                for var in via:
+                    result = yield self("{0} = {1}".format(var, via[var]))
+                    if len(result):
+                        raise GnuplotError("cannot set Gnuplot variable "
+                                           "`{0}' to `{1}'".
+                                           format(var, via[var]))
+                vars = sorted(via.keys())
+            else:
+                vars = tuple(via)
+            via = ", ".join(vars)
+
+            self("FIT_LIMIT = {0:e}".format(limit if limit is not None
+                                            else 1e-5))
+            self("FIT_MAXITER = {0:d}".format(maxiter or 0))
+            self("FIT_START_LAMBDA = {0:e}".format(start_lambda or 0.0))
+            self("FIT_LAMBDA_FACTOR = {0:e}".format(lambda_factor or 0.0))
+            self("set fit logfile '/dev/null' errorvariables")
+            log = yield AsyncGnuplot.fit(self, data, expr, via, ranges)
+            self("unset fit")
+
+            values = {}
+            for var in vars:
+                for name in (var, var + "_err"):
+                    values[name] = self("print {0}".format(name))
+            params = dict()
+            errors = dict()
+            for var in vars:
+                params[var] = _float_or_none((yield values[var]))
+                errors[var] = _float_or_none((yield values[var + "_err"]))
+        finally:
+            self._block_refresh = blocking_refresh
+        self._perform_autorefresh()
+        raise _Return((params, errors, log.strip() + "\n"))
+
+
+class AsyncSPlot(AsyncPlot):
+    """A self-refreshing, editable, 3D plot with non-blocking commands.
+
+    See AsyncPlot and SPlot.
+    """
+
+    _plotmethod = SPlot._plotmethod
+    _plotcmd = SPlot._plotcmd
+
+
+def _float_or_none(value):
+    try:
+        return float(value.strip())
+    except ValueError:
+        return None
+
+def _warn_on_error(future):
+    exception = future.exception()
+    if exception is not None:
+        warnings.warn("automatic refresh failed: {0}".format(exception))
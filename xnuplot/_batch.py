@@ -0,0 +1,204 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from ._plot import Plot, SPlot, Multiplot, GridMultiplot
+from ._pool import GnuplotPool
+import Queue
+import threading
+
+# The classes of the pooled instances; a plot is drawn by an instance of the
+# first of these that it is an instance of.
+_render_classes = (GridMultiplot, Multiplot, SPlot, Plot)
+
+def render_many(plots, outputs=None, workers=None, terminal=None, size=None,
+                options=None, as_array=False, **kwargs):
+    """Render many plots in parallel, and return the images in order.
+
+    Each plot is copied (settings and plot items, as by clone()) into one of
+    a set of Gnuplot processes, which draws it (see Plot.render()); the
+    processes are reused from plot to plot, and the plots themselves are
+    left untouched. Plots created with lazy=True whose Gnuplot has not been
+    started (because they have only been given plot items, with
+    autorefresh=False) never start it.
+
+    Returns a list with, for each plot, the image (a string of bytes, or an
+    array if as_array), or the name of the file it was written to (if
+    outputs is given). If a plot cannot be rendered, the exception is put in
+    its place, and the remaining plots are still rendered.
+
+    Keyword Arguments:
+    plots - A sequence of Plot, SPlot, Multiplot, or GridMultiplot objects.
+    outputs - A sequence of filenames, one for each plot, to which the images
+              are written (instead of being returned).
+    workers - The number of Gnuplot processes (default: the number of CPUs).
+    terminal, size, options, as_array - As for Plot.render().
+    kwargs - Arguments used to construct the Gnuplot instances (such as
+             command, or transport, which defaults to "auto" since the
+             instances are never interacted with).
+    """
+    plots = list(plots)
+    if outputs is not None:
+        outputs = list(outputs)
+        if len(outputs) != len(plots):
+            raise ValueError("need one output for each plot")
+        if as_array:
+            raise ValueError("as_array cannot be used with outputs")
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(plots)))
+    kwargs["autorefresh"] = False
+    kwargs.setdefault("transport", "auto")
+
+    # A plot (or a subplot of a multiplot) talks to its own Gnuplot while
+    # being copied, so it must not be copied by two workers at once.
+    locks = {}
+    for plot in plots:
+        locks.setdefault(id(plot), threading.Lock())
+        if isinstance(plot, Multiplot):
+            for subplot in plot:
+                locks.setdefault(id(subplot), threading.Lock())
+
+    pools = {}
+    for class_ in _render_classes:
+        class_kwargs = dict(kwargs)
+        if class_ is GridMultiplot:
+            # Overwritten by _take_contents().
+            class_kwargs.update(rows=1, cols=1)
+        pools[class_] = GnuplotPool(min_size=0, max_size=workers,
+                                    class_=class_, **class_kwargs)
+
+    results = [None] * len(plots)
+    jobs = Queue.Queue()
+    for index in xrange(len(plots)):
+        jobs.put(index)
+
+    def render(index):
+        plot = plots[index]
+        class_ = (c for c in _render_classes if isinstance(plot, c)).next()
+        ids = set([id(plot)])
+        if isinstance(plot, Multiplot):
+            ids.update(id(subplot) for subplot in plot)
+        # (In a fixed order, so that workers cannot deadlock.)
+        held = [locks[i] for i in sorted(ids)]
+        for lock in held:
+            lock.acquire()
+        try:
+            # (Returning the instance to the pool detaches it from the
+            # subplots, so that too is done with the locks held.)
+            with pools[class_].gnuplot() as gp:
+                gp._take_contents(plot)
+                image = gp.render(terminal, size, options, as_array)
+        finally:
+            for lock in reversed(held):
+                lock.release()
+        if outputs is None:
+            return image
+        with open(outputs[index], "wb") as f:
+            f.write(image)
+        return outputs[index]
+
+    def work():
+        while True:
+            try:
+                index = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = render(index)
+            except Exception, e:
+                results[index] = e
+
+    threads = [threading.Thread(target=work, name="xnuplot renderer")
+               for i in xrange(workers)]
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            # (With a timeout, so that KeyboardInterrupt is not blocked.)
+            while thread.is_alive():
+                thread.join(0.1)
+    finally:
+        # Let the workers finish early if we were interrupted.
+        while not jobs.empty():
+            try:
+                jobs.get_nowait()
+            except Queue.Empty:
+                break
+        for pool in pools.values():
+            pool.close()
+    return results
+
+def render_grid(multiplot, terminal=None, size=None, options=None,
+                as_array=False, workers=None, **kwargs):
+    """Render a GridMultiplot, drawing its subplots in parallel.
+
+    Each (nonempty) subplot is drawn by one of a set of Gnuplot processes,
+    as by render_many(), into an image the size of its grid cell (with the
+    `pbm color' terminal). The images are then placed in the grid by the
+    multiplot's Gnuplot (`with rgbimage'), which draws the final image as
+    render() would, so that the layout (rows, cols, rowsfirst, upwards,
+    scale, offset, and title) is preserved. This pays off when the subplots
+    take long to draw (e.g. large images or pm3d surfaces).
+
+    Note that the subplots are drawn as pixels, even if the terminal is not
+    a raster one, and without the antialiasing of terminals such as
+    pngcairo.
+
+    Keyword Arguments:
+    multiplot - A GridMultiplot.
+    terminal, options, as_array - As for Plot.render().
+    size - The size of the image, in pixels: a (width, height) tuple or a
+           string (default: 640,480).
+    workers - The number of Gnuplot processes (default: the number of CPUs).
+    kwargs - Arguments used to construct the Gnuplot instances (such as
+             command, or transport, which defaults to "auto" since the
+             instances are never interacted with).
+    """
+    if size is None:
+        size = (640, 480)
+    if isinstance(size, basestring):
+        try:
+            size = tuple(int(s) for s in size.split(","))
+        except ValueError:
+            raise ValueError("size must be given in pixels")
+    width, height = size
+    xscale, yscale = _pair(multiplot.scale, 1.0)
+    cell = (max(1, int(round(width * xscale / multiplot.cols))),
+            max(1, int(round(height * yscale / multiplot.rows))))
+
+    subplots = [plot for plot in multiplot if len(plot)]
+    if not subplots:
+        return multiplot.render(terminal, size, options, as_array)
+    images = render_many(subplots, workers=workers, terminal="pbm color",
+                         size=cell, as_array=True, **kwargs)
+    for image in images:
+        if isinstance(image, Exception):
+            raise image
+    return multiplot._render(lambda plot: plot._draw_images(images),
+                             terminal, size, options, as_array)
+
+def _pair(values, default):
+    # The (x, y) of `scale' or `offset', where y defaults to x.
+    if not values:
+        return (default, default)
+    values = tuple(values)
+    return values if len(values) > 1 else values * 2
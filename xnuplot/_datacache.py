@@ -0,0 +1,109 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from ._filestore import _digest, _file_store
+from ._outbound import _nbytes
+import collections
+
+# ref - what to put in the Gnuplot command (datablock name or quoted path)
+# block - the datablock name, or None
+# path - the file name, or None
+_CacheEntry = collections.namedtuple("_CacheEntry", "ref nbytes block path")
+
+class _DataCache(object):
+    # Data items kept resident in a Gnuplot process, keyed by content hash,
+    # so that unchanged data is sent only once. Small text data is kept in
+    # datablocks; everything else in files in the shared file store.
+    # The least recently used entries are discarded when the total size
+    # exceeds max_bytes, except for those in use by the current command (or,
+    # if keep_last, by the last command, so that with max_bytes 0 just the
+    # data of the last command is kept).
+
+    def __init__(self, max_bytes, keep_last=False):
+        self.max_bytes = max_bytes
+        self.keep_last = keep_last
+        self.nbytes = 0
+        self._entries = collections.OrderedDict() # Least recently used first.
+        self._pinned = set()
+        self._digests = {} # id(data) -> (data, digest), for strings.
+
+    def reference(self, gp, data, inline):
+        # Return the reference to data, storing it first if necessary. If
+        # inline is true, a datablock is used.
+        # Strings cannot change, so a string that is already cached need not
+        # be hashed again.
+        memo = self._digests.get(id(data))
+        if memo is not None and memo[0] is data:
+            digest = memo[1]
+        else:
+            digest = _digest(data)
+            if isinstance(data, basestring):
+                self._digests[id(data)] = (data, digest)
+        key = ("block:" if inline else "file:") + digest
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            if inline:
+                name = "$xnuplot_cache_" + digest[:20]
+                gp._define_datablocks([(name, data)])
+                entry = _CacheEntry(name, _nbytes(data), name, None)
+            else:
+                path = _file_store.acquire(data, digest)
+                entry = _CacheEntry(gp.quote(path), _nbytes(data), None, path)
+            self.nbytes += entry.nbytes
+        self._entries[key] = entry
+        self._pinned.add(key)
+        return entry.ref
+
+    def release(self, gp):
+        # Called when the current command has finished.
+        if self.keep_last:
+            self.evict(gp)
+            self._pinned.clear()
+        else:
+            self._pinned.clear()
+            self.evict(gp)
+        if len(self._digests) > len(self._entries):
+            self._digests = dict((i, memo) for i, memo in
+                                 self._digests.iteritems()
+                                 if "block:" + memo[1] in self._entries or
+                                 "file:" + memo[1] in self._entries)
+
+    def evict(self, gp):
+        for key in list(self._entries):
+            if self.nbytes <= self.max_bytes:
+                break
+            if key not in self._pinned:
+                self._discard(gp, key)
+
+    def clear(self, gp=None):
+        # Discard all entries. If gp is None, assume that Gnuplot has already
+        # forgotten the datablocks.
+        for key in list(self._entries):
+            self._discard(gp, key)
+        self._pinned.clear()
+        self._digests.clear()
+
+    def _discard(self, gp, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+        if entry.block and gp is not None and gp.isalive():
+            gp._undefine_datablock(entry.block)
+        if entry.path:
+            _file_store.release(entry.path)
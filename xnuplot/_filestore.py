@@ -0,0 +1,174 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Files through which data is passed to Gnuplot (for `{{file:...}}'
+# placeholders and the data cache), shared by all Gnuplot instances in the
+# process.
+
+from ._outbound import (_debug_dump, _debug_hexdump, _file_source, _nbytes,
+                        _segments, _write_data, _os_function)
+import atexit
+import errno
+import os
+import shutil
+import tempfile
+import threading
+
+def _digest(data):
+    import hashlib
+    sha1 = hashlib.sha1()
+    for segment in _segments(data):
+        sha1.update(segment)
+    return sha1.hexdigest()
+
+def _write_allocated(fd, data):
+    # Write data to the empty file fd. The file is first allocated, so that
+    # running out of space raises an error before anything is written. The
+    # data is written straight from its buffers (with writev() where there
+    # are several), so it is copied only once, by the kernel.
+    nbytes = _nbytes(data)
+    posix_fallocate = _os_function("posix_fallocate") if nbytes else None
+    if posix_fallocate is not None and _file_source(data) is None:
+        posix_fallocate(fd, 0, nbytes)
+    _write_data(fd, data)
+
+
+class _SharedFileStore(object):
+    # Files named by a hash of their content, so that identical data (from
+    # any Gnuplot instance) is written only once. The files are reference
+    # counted, and removed when the last reference is released.
+    #
+    # The files are kept in shared memory (/dev/shm) where available, so that
+    # they never reach the disk; if that runs out of space, the usual
+    # temporary directory is used.
+
+    shared_memory_dirs = ["/dev/shm"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {} # digest -> [path, refcount, written Event]
+        self._dirs = None
+        self._pid = None
+
+    def acquire(self, data, digest=None):
+        # Return the path of a file containing data, writing it if necessary.
+        # The file must be released with release().
+        if digest is None:
+            digest = _digest(data)
+        with self._lock:
+            dirs = self._directories()
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry[1] += 1
+                writer = False
+            else:
+                entry = [None, 1, threading.Event()]
+                self._entries[digest] = entry
+                writer = True
+        if not writer:
+            entry[2].wait()
+            if entry[0] is None:
+                # The thread writing the file failed; try again.
+                return self.acquire(data, digest)
+            return entry[0]
+        try:
+            entry[0] = self._write(digest, data, dirs)
+        except:
+            with self._lock:
+                del self._entries[digest]
+            raise
+        finally:
+            entry[2].set()
+        return entry[0]
+
+    def release(self, path):
+        digest = os.path.basename(path)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[0] != path:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._entries[digest]
+            # (With the lock held, so that the file cannot be written again,
+            # by acquire(), before it has been removed.)
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _directories(self):
+        # Directories are created on first use (and again in a forked child,
+        # which must not share them with its parent).
+        if self._dirs is None or self._pid != os.getpid():
+            dirs = []
+            for parent in self.shared_memory_dirs + [None]:
+                if parent is not None and not (os.path.isdir(parent) and
+                                               os.access(parent, os.W_OK)):
+                    continue
+                dirs.append(tempfile.mkdtemp(prefix="xnuplot.", dir=parent))
+            self._dirs = dirs
+            self._pid = os.getpid()
+            self._entries = {}
+            atexit.register(_remove_dirs, dirs, self._pid)
+        return self._dirs
+
+    def _write(self, digest, data, dirs):
+        for dir in dirs:
+            fd, temppath = tempfile.mkstemp(prefix="tmp.", dir=dir)
+            try:
+                _write_allocated(fd, data)
+            except EnvironmentError, e:
+                os.close(fd)
+                os.unlink(temppath)
+                if e.errno == errno.ENOSPC and dir != dirs[-1]:
+                    continue
+                raise
+            os.close(fd)
+            # The rename makes the complete file appear at once.
+            path = os.path.join(dir, digest)
+            os.rename(temppath, path)
+            return path
+
+def _remove_dirs(dirs, pid):
+    if os.getpid() == pid:
+        for dir in dirs:
+            shutil.rmtree(dir, ignore_errors=True)
+
+_file_store = _SharedFileStore()
+
+
+class _OutboundStoredFile(object):
+    # A file in the shared store, with the same interface as
+    # _OutboundTempFile. The file stays until cleanup() is called, which may
+    # be after the command has finished (so that `replot' can reread it).
+    def __init__(self, data, debug=False):
+        self.path = _file_store.acquire(data)
+        if debug:
+            _debug_dump(data, "file", self.path)
+        if debug >= 2:
+            _debug_hexdump(data)
+
+    def cancel(self):
+        pass
+
+    def cleanup(self):
+        if self.path:
+            _file_store.release(self.path)
+            self.path = None
@@ -19,17 +19,25 @@
 # IN THE SOFTWARE.
 
 import contextlib
+import itertools
 import os
-import pexpect
 import re
-import shlex
 import shutil
-import subprocess
+import stat
 import sys
 import tempfile
 import threading
+import time
 import warnings
 import weakref
+from ._transport import _transports, _TransportEOF, _TransportTimeout
+from ._probe import probe
+from ._outbound import (_FifoRecycler, _OutboundNamedPipe, _OutboundTempFile,
+                        _file_source, _nbytes)
+from ._datacache import _DataCache
+from ._filestore import _OutboundStoredFile
+from ._inbound import _InboundNamedPipe
+from ._stats import Stats, _Measurement
 
 # A list of weakrefs to all plots ever created.
 _allplots = []
@@ -40,11 +48,89 @@ class CommunicationError(RuntimeError):
 class GnuplotError(RuntimeError):
     """Raised when Gnuplot (is known to have) responded with an error."""
 
+_heredoc_pattern = re.compile(r"\s*\$\w+\s*<<\s*(\w+)\s*$")
+
+def _brace_depth_change(line):
+    # The number of `{' less the number of `}' in the line, outside of
+    # strings and comments.
+    change = 0
+    quote = None
+    escaped = False
+    for char in line:
+        if quote is not None:
+            if escaped:
+                escaped = False
+            elif char == "\\" and quote == '"':
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "#":
+            break
+        elif char == "{":
+            change += 1
+        elif char == "}":
+            change -= 1
+    return change
+
+def _statements(lines):
+    # Group the lines into the statements that Gnuplot reads as a whole:
+    # a datablock definition (up to its delimiter), lines continued with a
+    # trailing backslash, or a bracketed block (of `if', `do', or `while').
+    # Returns a list of lists of lines.
+    statements = []
+    statement = []
+    delimiter = None # Of the datablock being defined.
+    depth = 0 # Of brackets.
+    for line in lines:
+        statement.append(line)
+        if delimiter is not None:
+            if line.startswith(delimiter):
+                delimiter = None
+        else:
+            match = _heredoc_pattern.match(line)
+            if match:
+                delimiter = match.group(1)
+            else:
+                depth = max(0, depth + _brace_depth_change(line))
+        if delimiter is None and not depth and not line.endswith("\\"):
+            statements.append(statement)
+            statement = []
+    if statement:
+        statements.append(statement)
+    return statements
+
+def _line_results(statements, outputs):
+    # Return the output of each line, given that of each statement (which
+    # is given to the statement's first line). outputs is shorter than
+    # statements if Gnuplot stopped at an error, in which case so is the
+    # result.
+    results = []
+    for statement, output in zip(statements, outputs):
+        results.append(output)
+        results.extend([""] * (len(statement) - 1))
+    if len(outputs) < len(statements):
+        del results[len(results) - len(statements[len(outputs) - 1]) + 1:]
+    return results
+
+def _without_continuation_echo(statement, output):
+    # On a terminal, Gnuplot echoes each continuation line of a statement
+    # (after its "> " prompt) ahead of the statement's output.
+    for line in statement[1:]:
+        echo = "> " + line + "\n"
+        if not output.startswith(echo):
+            break
+        output = output[len(echo):]
+    return output
+
 class RawGnuplot(object):
     """Low-level manager for communication with a Gnuplot subprocess.
     
     A RawGnuplot instance encapsulates a dedicated Gnuplot process and the
-    means for communication with it through a pseudoterminal. It can pass data
+    means for communication with it through a pseudoterminal (or, optionally,
+    a pair of plain pipes; see the transport argument to __init__()). It can
+    pass data
     to Gnuplot using a temporary file or pipe, but is agnostic of the format of
     commands and data (see __call__()).
 
@@ -52,22 +138,32 @@ class RawGnuplot(object):
     __init__() - constructor
     __call__() - send command(s), optionally passing data, and receive output
     interact() - allow user to interact directly with Gnuplot
+    call_lines() - send command(s) and receive the output of each line
     close() - close the Gnuplot process (called automatically on destruction)
     terminate() - terminate the Gnuplot process
     isalive() - check whether the Gnuplot process is alive
+    prewarm() - start the Gnuplot process in the background (if lazy)
     pause() - send a `pause' command to Gnuplot (disregarding timeout)
+    writes_in_flight() - number of data pipes not yet completely written
     quote() (static method) - quote a filename for use in a Gnuplot command
 
     Attributes:
-    timeout - timeout for pty i/o (in seconds)
+    timeout - timeout for pty (or pipe) i/o (in seconds)
     debug - if true, echo commands sent and output received
+    pipeline - if true, send multi-line commands in a single round trip
+    stats - a Stats object, with timings and data sizes of all commands
+    stats_hook - if not None, called as stats_hook(self, record) after each
+                 command (and plot refresh), with a CommandRecord
+    capabilities - the Capabilities of the Gnuplot binary, if they were
+                   needed (for transport="auto" or testecho); otherwise None
     """
 
     gp_prompt = "gnuplot> "
     send_chunk_length = 512
 
     def __init__(self, command=None, persist=False, tempdir=None,
-                 testecho=False):
+                 testecho=False, pipeline=False, transport="pty",
+                 lazy=False):
         """Return a new Gnuplot object.
 
         Keyword Arguments:
@@ -82,10 +178,45 @@ class RawGnuplot(object):
         testecho - Check to see if the assumptions we make about how Gnuplot
                    echoes commands are correct. Try setting this to True if
                    you suspect xnuplot is not properly communicating with
-                   Gnuplot.
+                   Gnuplot. The check is done once per Gnuplot binary (see
+                   probe()).
+        pipeline - Send multi-line commands to Gnuplot all at once, waiting
+                   for the prompt only after the last line (see
+                   call_lines()). Can be changed later through the pipeline
+                   attribute.
+        transport - How to communicate with Gnuplot: "pty" (the default) uses
+                    a pseudoterminal, through which the user can interact()
+                    with Gnuplot. "pipe" uses plain pipes: there is no
+                    readline echo to skip, commands of any length can be sent
+                    at full speed, and pipelined commands are written
+                    directly to Gnuplot, but interact() is not available;
+                    it requires the stdbuf command (of GNU coreutils).
+                    "auto" chooses "pipe" if the Gnuplot binary works with
+                    it, and "pty" otherwise (see probe()).
+        lazy - Do not start Gnuplot until it is first needed (usually by the
+               first command), so that creating the object is cheap. Errors
+               in starting Gnuplot are then raised by that first use. See
+               also prewarm().
         """
         self._debug = False
+        self.stats = Stats()
+        self.stats_hook = None
+        self._measurement = None # Of the command in progress.
+        self.pipeline = pipeline
+        self._sync_ids = itertools.count(1)
+        self.transport = None
+        self._spawn_lock = threading.RLock()
+        self._spawn_args = None # Until started (or terminated).
+        self._spawn_error = None # From a failed prewarm().
+        self._timeout = None
+        self.capabilities = None
+        self.tempdir = None
+        self._active_pipes = []
+        self._retained_files = [] # Data files that `replot' may reread.
+        if transport not in _transports and transport != "auto":
+            raise ValueError("unknown transport: {0}".format(transport))
         self.tempdir = tempfile.mkdtemp(prefix="xnuplot.", dir=tempdir)
+        self._fifos = _FifoRecycler(self.tempdir)
 
         if not command:
             if "XNUPLOT_GNUPLOT" in os.environ:
@@ -95,27 +226,9 @@ class RawGnuplot(object):
 
         if persist:
             command += " -persist"
-        try:
-            self.gp_proc = pexpect.spawn(command)
-            self.gp_proc.delaybeforesend = 0
-        except:
-            os.rmdir(self.tempdir)
-            raise
-
-        ok = False
-        try:
-            self.gp_proc.expect_exact(self.gp_prompt)
-            ok = True
-        except pexpect.EOF:
-            raise CommunicationError("Gnuplot died before showing prompt")
-        except pexpect.TIMEOUT:
-            raise CommunicationError("timeout")
-        finally:
-            if not ok:
-                self.terminate()
-
-        if testecho:
-            self._test_readline_echo()
+        self._spawn_args = (transport, command, testecho)
+        if not lazy:
+            self._spawn()
 
         global _allplots
         _allplots.append(weakref.ref(self))
@@ -125,7 +238,90 @@ class RawGnuplot(object):
     def __exit__(self, type, value, traceback):
         self.close()
     def __del__(self):
-        self.close()
+        # There is nothing to clean up if __init__() failed early on.
+        if hasattr(self, "_spawn_lock"):
+            self.close()
+
+    @property
+    def transport(self):
+        # The transport is created when first needed (see lazy).
+        if self._spawn_args is not None or self._spawn_error is not None:
+            self._spawn()
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    def _spawn(self, defer_errors=False):
+        # Start Gnuplot, unless it has already been started. Errors are
+        # raised, or, if defer_errors, raised by the next call.
+        with self._spawn_lock:
+            if self._spawn_error is not None:
+                error, self._spawn_error = self._spawn_error, None
+                raise error[0], error[1], error[2]
+            if self._spawn_args is None:
+                return
+            transport, command, testecho = self._spawn_args
+            try:
+                self._start_transport(transport, command, testecho)
+            except:
+                if not defer_errors:
+                    raise
+                self._spawn_error = sys.exc_info()
+            finally:
+                self._spawn_args = None
+
+    def _start_transport(self, transport, command, testecho):
+        if transport == "auto" or testecho:
+            try:
+                self.capabilities = probe(command)
+            except EnvironmentError, e:
+                self.terminate()
+                raise CommunicationError("cannot probe Gnuplot: "
+                                         "{0}".format(e))
+        if transport == "auto":
+            transport = ("pipe" if self.capabilities.pipe else "pty")
+
+        chunk_length = self.send_chunk_length
+        if self.capabilities is not None:
+            # Lines as long as the probe wrote at once need not be split.
+            chunk_length = max(chunk_length,
+                               self.capabilities.max_line_length)
+        try:
+            self._transport = _transports[transport](command, self.gp_prompt,
+                                                     chunk_length)
+        except _TransportEOF:
+            raise CommunicationError("Gnuplot died before showing prompt")
+        except _TransportTimeout:
+            raise CommunicationError("timeout")
+        finally:
+            if self._transport is None:
+                self.terminate()
+
+        if self._timeout is not None:
+            self._transport.timeout = self._timeout
+        if self._debug:
+            self._transport.logfile = sys.stderr
+
+        if testecho and self._transport.name == "pty":
+            msg = self.capabilities.echo_error
+            if msg:
+                raise CommunicationError(msg)
+
+    def prewarm(self):
+        """Start the Gnuplot process in a background thread.
+
+        Only useful if the object was created with lazy=True and Gnuplot has
+        not been started yet; the first command then waits only for whatever
+        remains of the startup. Returns immediately.
+        """
+        if self._spawn_args is None:
+            return
+        thread = threading.Thread(target=self._spawn, args=(True,),
+                                  name="xnuplot prewarm")
+        thread.daemon = True
+        thread.start()
 
     def close(self):
         """Close the Gnuplot subprocess and remove all temporary files."""
@@ -134,15 +330,57 @@ class RawGnuplot(object):
 
     def terminate(self):
         """Force-quit the Gnuplot subprocess and remove all temporary files."""
-        if self.gp_proc is not None:
-            self.gp_proc.close(force=True)
-            self.gp_proc = None
+        with self._spawn_lock:
+            # Gnuplot, if not started yet, won't be.
+            self._spawn_args = None
+            transport, self._transport = self._transport, None
+        if transport is not None:
+            transport.close()
+        for pipe in self._active_pipes:
+            pipe.cancel()
+        self._active_pipes = []
+        self._release_files()
         if self.tempdir:
             shutil.rmtree(self.tempdir)
             self.tempdir = None
 
     def isalive(self):
-        return self.gp_proc is not None and self.gp_proc.isalive()
+        # Gnuplot that is yet to be started (see lazy) counts as alive.
+        if self._spawn_args is not None or self._spawn_error is not None:
+            return True
+        return self._transport is not None and self._transport.isalive()
+
+    _supports_reset_session = None
+    def _reset_session(self):
+        # Return Gnuplot to its freshly started state, as far as possible, so
+        # that this instance can be reused (see GnuplotPool). The terminal is
+        # left alone.
+        if not self.isalive():
+            raise CommunicationError("Gnuplot process has exited.")
+        RawGnuplot.__call__(self, "unset multiplot")
+        RawGnuplot.__call__(self, "set output")
+        # Gnuplot 5 can also forget user-defined variables and functions.
+        if self._supports_reset_session is not False:
+            result = RawGnuplot.__call__(self, "reset session")
+            self._supports_reset_session = not result.strip()
+        if not self._supports_reset_session:
+            result = RawGnuplot.__call__(self, "reset")
+            if result.strip():
+                raise GnuplotError("`reset' returned error", result.strip())
+        self._release_files()
+        for name in os.listdir(self.tempdir):
+            path = os.path.join(self.tempdir, name)
+            mode = os.lstat(path).st_mode
+            if stat.S_ISDIR(mode):
+                shutil.rmtree(path)
+            elif not stat.S_ISFIFO(mode):
+                # Named pipes are kept for reuse.
+                os.unlink(path)
+
+    @property
+    def gp_proc(self):
+        "The object representing the Gnuplot process (None if closed)."
+        return self.transport.proc if self.transport is not None else None
 
     def __call__(self, command, **data):
         """Send a command (or commands) to Gnuplot.
@@ -170,91 +408,422 @@ class RawGnuplot(object):
         pipes fail (one example of this is the `binary matrix' data format). To
         handle such cases, use of a temporary file can be forced by the syntax
         `{{file:foo}}'. The default syntax (`{{foo}}') is equivalent to
-        `{{pipe:foo}}'.
+        `{{pipe:foo}}'. Files are named by a hash of their content and shared
+        by all instances (in shared memory, where available), so identical
+        data is written only once. A file given to `plot', `splot', or
+        `replot' is kept until the next `plot' or `splot' command, so that
+        `replot' (and zooming with the mouse) can reread it; files given to
+        other commands are removed when the command finishes.
+
+        Text data can also be sent inline, as a Gnuplot (5.0 or later)
+        datablock, with the syntax `{{block:foo}}'. The datablock is defined
+        just before the command is sent, and the placeholder is replaced with
+        the datablock name ($xnuplot_foo). This avoids creating a pipe and a
+        thread, and is the fastest way to send small amounts of data.
         """
+        results = [result for result in self._call_lines(command, **data)
+                   if result]
+        return "\n".join(results)
+
+    def call_lines(self, command, **data):
+        """Send command(s) to Gnuplot and return the output of each line.
+
+        The command and data are interpreted in the same way as by __call__(),
+        but a list is returned, containing the (possibly empty) output of each
+        line of command, so that errors can be attributed to the line that
+        caused them. If Gnuplot exits (by `quit' or `exit'), the list is
+        truncated before the line that caused the exit. A statement spanning
+        several lines (a datablock definition, a line continued with a
+        trailing backslash, or a bracketed block of `if', `do', or `while')
+        is executed as a whole, and its output is given for its first line
+        (with empty strings for the rest).
+
+        If the pipeline attribute is true, all lines are sent to Gnuplot at
+        once (by way of a `load' command reading from a named pipe), and the
+        output is collected after a single synchronization, rather than
+        waiting for the prompt after each line. As with `load', Gnuplot stops
+        executing the lines after an error; in that case the returned list
+        ends with the output of the failing statement.
+        """
+        return self._call_lines(command, **data)
+
+    def _call_lines(self, command, **data):
         if not self.isalive():
             raise CommunicationError("Gnuplot process has exited.")
+        self._command_issued(command)
+        with self._measured(command):
+            return self._call_lines_measured(command, **data)
+
+    def _call_lines_measured(self, command, **data):
+        lines = command.split("\n")
+        if not self.pipeline or len(lines) < 2:
+            return self._send_serially(lines, **data)
+
+        # Gnuplot cannot exit from within a `load', so send any statement
+        # that causes an exit (and the lines following it) one at a time.
+        i = 0
+        for statement in _statements(lines):
+            if self._exit_pattern.match(statement[0]):
+                pipelined, serial = lines[:i], lines[i:]
+                break
+            i += len(statement)
+        else:
+            pipelined, serial = lines, []
         results = []
-        for cmd in command.split("\n"):
-            result = self._send_one_command(cmd, **data)
-            if result is None:
+        if len(pipelined) > 1:
+            results = self._send_pipelined(pipelined, **data)
+            if len(results) < len(pipelined):
+                # Gnuplot stopped at an error.
+                return results
+        else:
+            serial = pipelined + serial
+        return results + self._send_serially(serial, **data)
+
+    def _command_issued(self, command):
+        # Called with every command (from __call__() or call_lines()) before
+        # it is sent.
+        pass
+
+    @contextlib.contextmanager
+    def _measured(self, command):
+        # Record the statistics of the command (unless nested in another).
+        if self._measurement is not None:
+            yield
+            return
+        self._measurement = _Measurement()
+        try:
+            yield
+        finally:
+            measurement, self._measurement = self._measurement, None
+            self._record(measurement.record("command", command))
+
+    def _record(self, record):
+        self.stats.add(record)
+        if self.stats_hook is not None:
+            self.stats_hook(self, record)
+
+    def _timed_send(self, line, extra_newline=False):
+        start = time.time()
+        self.transport.send(line, extra_newline=extra_newline)
+        if self._measurement is not None:
+            echo = self.transport.last_echo_time
+            self._measurement.send += time.time() - start - echo
+            self._measurement.echo += echo
+
+    def _timed_receive(self):
+        start = time.time()
+        try:
+            return self.transport.receive(self.gp_prompt)
+        finally:
+            if self._measurement is not None:
+                self._measurement.wait += time.time() - start
+
+    def _send_serially(self, lines, **data):
+        # A statement spanning several lines is sent as one, since Gnuplot
+        # gives no prompt (and the transport no frame) until it is complete.
+        statements = _statements(lines)
+        outputs = []
+        for statement in statements:
+            output = self._send_one_command("\n".join(statement), **data)
+            if output is None:
                 # None is returned when Gnuplot exited normally.
                 break
-            if result:
-                results.append(result)
-        return "\n".join(results)
+            if not self.transport.typeahead:
+                output = _without_continuation_echo(statement, output)
+            outputs.append(output)
+        results = []
+        for statement, output in zip(statements, outputs):
+            results.append(output)
+            results.extend([""] * (len(statement) - 1))
+        return results
+
+    def _send_pipelined(self, lines, **data):
+        if self.transport.typeahead:
+            return self._send_typeahead(lines, **data)
+        # Writing the lines directly to the pty, ahead of Gnuplot reading
+        # them, does not work, because the tty echoes whatever arrives while
+        # Gnuplot (or libreadline) has echo turned on, and the echoes get
+        # interleaved with the output. Instead, we feed the lines through a
+        # named pipe to a single `load' command, following each statement
+        # with a marker that we can use to split the output.
+        sync_id = next(self._sync_ids)
+        marker = "XNUPLOT_SYNC_{0}_".format(sync_id)
+        print_command = self._print_command()
+        statements = _statements(lines)
+        script = []
+        for i, statement in enumerate(statements):
+            script.extend(statement)
+            script.append('{0} "{1}{2:d}"'.format(print_command, marker, i))
+        with self._placeholders_substituted("\n".join(script) + "\n",
+                                            **data) as script:
+            output = self._send_one_command("load {{script}}", script=script)
+        if output is None:
+            return []
+
+        outputs = []
+        start = 0
+        marker_pattern = re.compile(re.escape(marker) + r"\d+\n")
+        for match in marker_pattern.finditer(output):
+            outputs.append(output[start:match.start()])
+            start = match.end()
+        if len(outputs) < len(statements):
+            # Any output following the last marker came from the statement
+            # that stopped the `load'.
+            outputs.append(output[start:])
+        return _line_results(statements, outputs)
+
+    def _print_command(self):
+        # Return the command with which to print markers: `printerr', which
+        # (unlike `print') is not redirected by `set print', unless Gnuplot
+        # is too old to have it.
+        transport = self.transport
+        if transport.print_command is None:
+            output = self._send_one_command('printerr "XNUPLOT_PRINTERR"')
+            if output is not None and output.strip() == "XNUPLOT_PRINTERR":
+                transport.print_command = "printerr"
+            else:
+                transport.print_command = "print"
+        return transport.print_command
+
+    def _load_script(self, script, **data):
+        # Send script as a single `load', serving the data for the
+        # placeholders in it while Gnuplot reads it. Return the output and
+        # whether the script ran to the end (Gnuplot stops a `load' at the
+        # first error).
+        if not self.isalive():
+            raise CommunicationError("Gnuplot process has exited.")
+        marker = "XNUPLOT_SYNC_{0}_END\n".format(next(self._sync_ids))
+        script = '{0}\n{1} "{2}"\n'.format(script, self._print_command(),
+                                          marker[:-1])
+        with self._measured("load {{script}}"):
+            with self._placeholders_substituted(script, _blocks_in_script=True,
+                                                **data) as script:
+                output = self._send_one_command("load {{script}}",
+                                                script=script)
+        output, found, rest = output.partition(marker)
+        return output + rest, bool(found)
+
+    def _send_typeahead(self, lines, **data):
+        # Without a tty, the lines can simply be written ahead of Gnuplot
+        # reading them; the transport frames the output of each statement.
+        with self._placeholders_substituted("\n".join(lines),
+                                            **data) as script:
+            statements = _statements(script.split("\n"))
+            try:
+                for statement in statements:
+                    self._timed_send("\n".join(statement))
+            except KeyboardInterrupt, e:
+                self.terminate()
+                raise CommunicationError("killed by user")
+            outputs = [self._receive() for statement in statements]
+            return _line_results(statements, outputs)
+
+    def _receive(self):
+        try:
+            return self._timed_receive()
+        except _TransportEOF:
+            self.terminate()
+            raise CommunicationError("Gnuplot died")
+        except _TransportTimeout:
+            self.terminate()
+            raise CommunicationError("timeout")
 
+    _exit_pattern = re.compile(r"\s*(quit|exit)(\W|$)")
+    _new_plot_pattern = re.compile(r"^\s*s?plot\b", re.MULTILINE)
+    _replot_pattern = re.compile(r"^\s*rep(l(ot?)?)?\b", re.MULTILINE)
     _placeholder_pattern = re.compile(
-            r"\{\{((?P<mode>file|pipe):)?(?P<name>[a-zA-Z_][a-zA-Z0-9_]*)\}\}")
+            r"\{\{((?P<mode>file|pipe|block):)?"
+            r"(?P<name>[a-zA-Z_][a-zA-Z0-9_]*)\}\}")
     @contextlib.contextmanager
-    def _placeholders_substituted(self, command, **data):
+    def _placeholders_substituted(self, command, _blocks_in_script=False,
+                                  **data):
+        # If _blocks_in_script, command is a script to be loaded, and the
+        # datablocks are defined at the top of it rather than beforehand.
         substituted_command = ""
         start_of_next_chunk = 0 # Position after current placeholder.
         pipes = []
+        files = []
+        blocks = []
+        named_pipes = []
+        measurement = self._measurement
         for placeholder in self._placeholder_pattern.finditer(command):
             name = placeholder.group("name")
             mode = placeholder.group("mode")
-            pipeclass = (_OutboundTempFile if mode == "file"
-                         else _OutboundNamedPipe)
-            pipe = pipeclass(data[name], dir=self.tempdir)
-            pipe.debug = self.debug
-            pipes.append(pipe)
+            if measurement is not None:
+                measurement.data_bytes[name] = _nbytes(data[name])
             span_start, span_stop = placeholder.span(0)
             substituted_command += command[start_of_next_chunk:span_start]
-            substituted_command += Gnuplot.quote(pipe.path)
             start_of_next_chunk = span_stop
+            if mode == "block":
+                block_name = "$xnuplot_" + name
+                blocks.append((block_name, data[name]))
+                substituted_command += block_name
+                continue
+            if mode == "file":
+                if _file_source(data[name]) is not None:
+                    pipe = _OutboundTempFile(data[name], dir=self.tempdir,
+                                             debug=self.debug)
+                else:
+                    pipe = _OutboundStoredFile(data[name], debug=self.debug)
+                files.append(pipe)
+            else:
+                pipe = self._outbound_pipe(data[name])
+                self._active_pipes.append(pipe)
+                pipes.append(pipe)
+                named_pipes.append((name, pipe))
+            substituted_command += Gnuplot.quote(pipe.path)
         substituted_command += command[start_of_next_chunk:]
-        yield substituted_command
-        for pipe in pipes:
-            pipe.cleanup()
-
-    def _sendline(self, line):
-        # The os.write() call used by pexpect seems to hang when the string
-        # sent is too long, at least on Mac OS X and Gnuplot built with GNU
-        # readline. Merely sending the line in small chunks does not prevent
-        # the hangs; it is necessary to read the echo after each chunk is sent.
-        # (Thus, it appears that Gnuplot or libreadline blocks on the echo
-        # write.) To work around this issue, we send the line in small chunks
-        # and make pexpect read and buffer the echo after each send.
-        chunk_length = self.send_chunk_length
-        n_nonend_chunks = len(line) // chunk_length
-        for i in xrange(n_nonend_chunks):
-            start = i * chunk_length
-            stop = start + chunk_length
-            self.gp_proc.send(line[start:stop])
-            # Cause pexpect to read in the echo.
-            self.gp_proc.expect(pexpect.TIMEOUT, timeout=0)
-        start = n_nonend_chunks * chunk_length
-        self.gp_proc.sendline(line[start:])
-        # Skip over the echoed command (see _test_readline_echo()).
-        self.gp_proc.expect_exact("\r\n")
+        try:
+            if blocks and _blocks_in_script:
+                substituted_command = "\n".join(
+                        (self._datablock_definitions(blocks),
+                         substituted_command))
+            elif blocks:
+                self._define_datablocks(blocks)
+            yield substituted_command
+        finally:
+            # Whether the command succeeded or failed, Gnuplot has finished
+            # with it, so any pipes it did not open are abandoned.
+            for pipe in pipes:
+                pipe.cleanup()
+            if measurement is not None:
+                for name, pipe in named_pipes:
+                    if pipe.open_wait is not None:
+                        measurement.fifo_waits[name] = pipe.open_wait
+            self._active_pipes = [pipe for pipe in self._active_pipes
+                                  if not pipe.done.is_set()]
+            # Files, on the other hand, are kept until the next `plot' or
+            # `splot', so that `replot' (including that done by Gnuplot when
+            # the plot is zoomed with the mouse) can reread them. Only the
+            # files of the current plot (including those added by `replot')
+            # are kept; those of other commands (such as `fit') are removed
+            # now, as are files already kept for the same data.
+            if self._new_plot_pattern.search(command):
+                self._release_files()
+                plotted = True
+            else:
+                plotted = bool(self._replot_pattern.search(command))
+            retained_paths = set(file.path for file in self._retained_files)
+            for file in files:
+                if plotted and file.path not in retained_paths:
+                    self._retained_files.append(file)
+                    retained_paths.add(file.path)
+                else:
+                    file.cleanup()
+            if self._transport is None:
+                # Gnuplot was terminated during the command.
+                self._release_files()
+
+    def _outbound_pipe(self, data):
+        return _OutboundNamedPipe(data, self._fifos,
+                                  deadline=self._write_deadline(),
+                                  debug=self.debug)
+
+    def _release_files(self):
+        for file in self._retained_files:
+            file.cleanup()
+        self._retained_files = []
+
+    def _write_deadline(self):
+        # Writers give up on a pipe that Gnuplot does not read in time.
+        if self.isalive() and self.timeout is not None:
+            return time.time() + self.timeout
+        return None
+
+    def writes_in_flight(self):
+        """Return the number of data pipes not yet completely written."""
+        return len([pipe for pipe in self._active_pipes
+                    if not pipe.done.is_set()])
+
+    datablock_delimiter = "XNUPLOT_EOD"
+    def _define_datablocks(self, blocks):
+        # Send the datablock definitions as a single "command"; the echo of
+        # the data lines (if any) is discarded together with the output.
+        # Gnuplot shows a prompt after each definition, so with a prompt-
+        # based transport each definition must be a command of its own.
+        if not self.transport.typeahead and len(blocks) > 1:
+            for block in blocks:
+                self._define_datablocks([block])
+            return
+        try:
+            self._timed_send(self._datablock_definitions(blocks))
+        except KeyboardInterrupt, e:
+            self.terminate()
+            raise CommunicationError("killed by user")
+        except _TransportEOF:
+            self.terminate()
+            raise CommunicationError("Gnuplot died")
+        except _TransportTimeout:
+            self.terminate()
+            raise CommunicationError("timeout")
+        self._receive()
+
+    def _datablock_definitions(self, blocks):
+        definitions = []
+        for name, text in blocks:
+            text = str(text)
+            if not text.endswith("\n"):
+                text += "\n"
+            definitions.append("{0} << {1}\n{2}{1}".format(
+                    name, self._datablock_delimiter(text), text))
+        return "\n".join(definitions)
+
+    def _datablock_delimiter(self, text):
+        # Gnuplot ends a datablock at the first line that starts with the
+        # delimiter, so use one that no line of the text starts with.
+        base = self.datablock_delimiter
+        clashes = [line for line in text.split("\n") if line.startswith(base)]
+        delimiter = base
+        suffixes = itertools.count(1)
+        while any(line.startswith(delimiter) for line in clashes):
+            delimiter = "{0}{1:d}".format(base, next(suffixes))
+        return delimiter
+
+    def _undefine_datablock(self, name):
+        RawGnuplot.__call__(self, "undefine " + name)
+
+    _datablock_support = None
+    def _supports_datablocks(self):
+        # Datablocks were introduced in Gnuplot 5.0.
+        if self._datablock_support is None and self.capabilities is not None:
+            self._datablock_support = self.capabilities.datablocks
+        if self._datablock_support is None:
+            version = RawGnuplot.__call__(self, "print GPVAL_VERSION").strip()
+            try:
+                self._datablock_support = float(version) >= 5.0
+            except ValueError:
+                self._datablock_support = False
+        return self._datablock_support
 
     def _send_one_command(self, command, _extra_newline=False, **data):
         # Do the acutal work for __call__().
         with self._placeholders_substituted(command, **data) as command:
             try:
-                self._sendline(command)
+                self._timed_send(command, extra_newline=_extra_newline)
             except KeyboardInterrupt, e:
                 # Kill Gnuplot if it hangs and the user terminates the
                 # command.
                 self.terminate()
                 raise CommunicationError("killed by user")
-            if _extra_newline:
-                self.gp_proc.sendline("")
+            except _TransportEOF:
+                self.terminate()
+                raise CommunicationError("Gnuplot died")
+            except _TransportTimeout:
+                self.terminate()
+                raise CommunicationError("timeout")
 
             try:
-                self.gp_proc.expect_exact(self.gp_prompt)
-                result = self.gp_proc.before
+                result = self._timed_receive()
                 if _extra_newline:
-                    self.gp_proc.expect_exact(self.gp_prompt)
-                return result.replace("\r\n", "\n")
-            except pexpect.EOF:
+                    self._timed_receive()
+                return result
+            except _TransportEOF:
                 self.terminate()
-                if re.match(r"\s*(quit|exit)(\W|$)", command):
+                if self._exit_pattern.match(command):
                     return None
                 else:
                     raise CommunicationError("Gnuplot died")
-            except pexpect.TIMEOUT:
+            except _TransportTimeout:
                 self.terminate()
                 raise CommunicationError("timeout")
 
@@ -277,68 +846,17 @@ class RawGnuplot(object):
             if self.isalive():
                 self.timeout = save_timeout
 
-    def _test_readline_echo(self):
-        # Determine how Gnuplot echoes the command. If Gnuplot is built without
-        # readline support, it will simply let the tty do the echo. However, if
-        # built with readline support (builtin, GNU readline, or BSD libedit),
-        # then it will turn off the tty echo and echo each input character on
-        # its own. Thus, we expect to receive an echo regardless of what
-        # gp_proc.getecho() reports.
-        #
-        # To further complicate matters, GNU readline and BSD libedit insert
-        # control characters into the echoed text, in an attempt to move the
-        # cursor to the beginning of the next line whenever a character is
-        # entered in what would be the rightmost column of a real terminal.
-        # This causes us to see the sequence " \r" (GNU) or " \b" (BSD) every
-        # 80 characters (or whatever the width of the tty), at least with the
-        # versions I've tested (Gnuplot's builtin readline does not insert any
-        # extra characters). The exact behavior may also depend on the
-        # particular terminal in use.
-        #
-        # Fortunately, we can still just skip over to the first "\r\n" in
-        # all of the known cases. We just make sure here that these assumptions
-        # hold.
-
-        unknown_behavior_msg = ("Gnuplot is echoing commands in an unexpected "
-                                "fashion. Xnuplot does not (yet) know how to "
-                                "handle this. Please file a bug report. ")
-        # First, test a single-character command line.
-        self.gp_proc.sendline("#")
-        self.gp_proc.expect_exact(self.gp_prompt)
-        echo = self.gp_proc.before
-        if echo != "#\r\n":
-            raise CommunicationError(unknown_behavior_msg +
-                                     "(\"#\" -> \"{0}\")".format(repr(echo)))
-        # Second, test a command line long enough to be wrapped.
-        rows, cols = self.gp_proc.getwinsize()
-        test_cmd = "#" * (cols * 3)
-        self.gp_proc.sendline(test_cmd)
-        self.gp_proc.expect_exact(self.gp_prompt)
-        echo = self.gp_proc.before[:-2] # Remove trailing "\r\n".
-        if echo == test_cmd:
-            # Okay: exact echo.
-            return
-        breaks = filter(None, echo.split("#"))
-        for b in breaks[1:]:
-            if b != breaks[0]:
-                raise CommunicationError(unknown_behavior_msg +
-                                         "(nonuniform linebreaks)")
-        if "\r\n" in breaks[0]:
-            raise CommunicationError(unknown_behavior_msg +
-                                     "(extra CRLFs inserted)")
-        else:
-            # Okay: whatever is inserted into the echo, it does not contain
-            # the "\r\n" sequence.
-            return
-
     def interact(self):
         """Interact directly with the Gnuplot subprocess.
 
         Handles control of the subprocess to the user.
         The interactive session can be terminated by typing CTRL-].
+        Only available with the "pty" transport.
         """
         if not self.isalive():
             raise CommunicationError("Gnuplot process has exited.")
+        if self.transport.name != "pty":
+            raise CommunicationError("interact() requires the pty transport")
         # TODO Should probably check that (Python's) stdin is a terminal.
         # Debug mode (echoing) is a mere annoyance when in interactive mode.
         @contextlib.contextmanager
@@ -349,12 +867,10 @@ class RawGnuplot(object):
             self.debug = save_debug
         with debug_turned_off():
             print >>sys.stderr, "escape character is `^]'"
-            # Send a black command so that the prompt is printed.
-            self.gp_proc.sendline("")
-            self.gp_proc.interact()
+            self.transport.interact()
 
         # The user could have quit Gnuplot.
-        if not self.gp_proc.isalive():
+        if not self.transport.isalive():
             self.terminate()
 
     @property
@@ -362,13 +878,17 @@ class RawGnuplot(object):
         "Timeout (in seconds) for replies from Gnuplot."
         if not self.isalive():
             raise CommunicationError("Gnuplot process has exited.")
-        return self.gp_proc.timeout
+        if self._transport is None: # Not started yet.
+            return self._timeout if self._timeout is not None else 30
+        return self._transport.timeout
 
     @timeout.setter
     def timeout(self, seconds):
         if not self.isalive():
             raise CommunicationError("Gnuplot process has exited.")
-        self.gp_proc.timeout = seconds
+        self._timeout = seconds
+        if self._transport is not None:
+            self._transport.timeout = seconds
 
     @property
     def debug(self):
@@ -378,8 +898,8 @@ class RawGnuplot(object):
     @debug.setter
     def debug(self, debug):
         self._debug = debug
-        if self.isalive():
-            self.gp_proc.logfile_read = (sys.stderr if debug else None)
+        if self._transport is not None and self._transport.isalive():
+            self._transport.logfile = (sys.stderr if debug else None)
 
     @staticmethod
     def quote(filename):
@@ -391,37 +911,174 @@ class Gnuplot(RawGnuplot):
     """Manager for communication with a Gnuplot subprocess.
     
     The Gnuplot class inherits from RawGnuplot and adds methods (plot(),
-    splot(), replot(), fit(), script()) that simplify the passing of data when
-    issuing commands that require data to be read from files.
+    splot(), replot(), fit(), script(), tabulate()) that simplify the passing
+    of data when issuing commands that require data to be read from files.
+
+    Attributes:
+    datablock_threshold - text data items (in "auto" mode) smaller than this
+                          many bytes are sent inline as datablocks
+    cache_bytes - size limit of the data cache (see __init__())
+    incremental - whether the data of the last plot is kept (see __init__())
     """
+
+    datablock_threshold = 4096
+
+    def __init__(self, *args, **kwargs):
+        """Return a new Gnuplot object.
+
+        Accepts the same arguments as RawGnuplot.__init__(), plus:
+        cache_bytes - If nonzero, the data of plot items (in "auto" or "file"
+                      mode) is kept resident in Gnuplot, keyed by a hash of
+                      its content, so that unchanged data is sent only once.
+                      Small text data is kept in datablocks, and other data
+                      in temporary files. The least recently used data is
+                      discarded when the total exceeds cache_bytes.
+        incremental - Keep the data of the items of the last plot (or other
+                      command with data) resident in Gnuplot, as with
+                      cache_bytes, so that when the plot is redrawn (e.g. by
+                      a Plot refresh) only new or changed data is sent.
+                      Can be combined with cache_bytes, in which case the
+                      data of the last plot is kept even if it exceeds
+                      cache_bytes.
+        """
+        cache_bytes = kwargs.pop("cache_bytes", 0)
+        self._incremental = bool(kwargs.pop("incremental", False))
+        self._cache = (_DataCache(cache_bytes, self._incremental)
+                       if cache_bytes or self._incremental else None)
+        RawGnuplot.__init__(self, *args, **kwargs)
+
+    @property
+    def cache_bytes(self):
+        "Size limit of the data cache (0 if the cache is disabled)."
+        return self._cache.max_bytes if self._cache is not None else 0
+
+    @cache_bytes.setter
+    def cache_bytes(self, max_bytes):
+        if not max_bytes:
+            if self._incremental:
+                self._cache.max_bytes = 0
+                self._cache.evict(self)
+                return
+            self.clear_cache()
+            self._cache = None
+        elif self._cache is None:
+            self._cache = _DataCache(max_bytes)
+        else:
+            self._cache.max_bytes = max_bytes
+            self._cache.evict(self)
+
+    @property
+    def incremental(self):
+        "Whether the data of the last plot is kept in Gnuplot."
+        return self._incremental
+
+    @incremental.setter
+    def incremental(self, incremental):
+        self._incremental = bool(incremental)
+        if self._cache is None:
+            if incremental:
+                self._cache = _DataCache(0, True)
+        elif incremental or self._cache.max_bytes:
+            self._cache.keep_last = self._incremental
+            self._cache.evict(self)
+        else:
+            self.clear_cache()
+            self._cache = None
+
+    def clear_cache(self):
+        """Discard all data kept in the data cache."""
+        if self._cache is not None:
+            self._cache.clear(self)
+
+    def terminate(self):
+        """Force-quit the Gnuplot subprocess and remove all temporary files."""
+        RawGnuplot.terminate(self)
+        if self._cache is not None:
+            # Release the cached data files.
+            self._cache.clear()
+
+    def _reset_session(self):
+        if self._cache is not None:
+            # Gnuplot's `reset session' forgets the datablocks.
+            self._cache.clear()
+        RawGnuplot._reset_session(self)
+
+    @contextlib.contextmanager
+    def _cache_in_use(self):
+        # Cached data referenced by a command must not be evicted until the
+        # command has finished.
+        try:
+            yield
+        finally:
+            if self._cache is not None:
+                self._cache.release(self)
+
     def _datafilespec(self, data, name):
         if not isinstance(data, PlotData):
             data = PlotData(*data)
         double_brace = lambda s: "{{" + s + "}}"
+        binary = bool(data.options) and "binary" in data.options.split()
+        if (binary and self.capabilities is not None and
+            not self.capabilities.binary):
+            raise GnuplotError("Gnuplot was built without binary data file "
+                               "support", data.options)
+        if (self._cache is not None and data.mode in ("auto", "file") and
+            _file_source(data.data) is None):
+            # Cached data stays available, so no need for `volatile'.
+            inline = data.mode == "auto" and self._can_inline(data)
+            spec = self._cache.reference(self, data.data, inline)
+            if data.options:
+                spec = " ".join((spec, data.options))
+            return spec, None
         if data.mode == "file":
+            # The file is kept until the next plot, so no need for `volatile'.
             spec = double_brace("file:{0}".format(name))
+        elif data.mode == "block" or (data.mode == "auto" and
+                                      self._can_inline(data)):
+            # The datablock stays defined, so no need for `volatile'.
+            spec = double_brace("block:{0}".format(name))
         else:
-            spec = double_brace("pipe:{0}".format(name))
-        spec += " volatile"
+            spec = double_brace("pipe:{0}".format(name)) + " volatile"
         if data.options:
             spec = " ".join((spec, data.options))
         return spec, data.data
 
+    def _can_inline(self, data):
+        # Whether data is small enough text to be sent as a datablock.
+        if not isinstance(data.data, basestring):
+            return False
+        if len(data.data) >= self.datablock_threshold:
+            return False
+        if data.options and "binary" in data.options.split():
+            return False
+        return self._supports_datablocks()
+
     def _plot(self, cmd, *items):
         if not items:
             return
         # Common implementation for plot() and splot().
+        with self._cache_in_use():
+            command, data_dict = self._plot_command(cmd, *items)
+            result = self(command, **data_dict)
+        self._check_plot_result(cmd, result)
+
+    def _plot_command(self, cmd, *items, **kwargs):
+        # Return the command and the data for its placeholders (named with
+        # the given prefix, so that several commands can share one dict).
+        prefix = kwargs.get("prefix", "item")
         item_strings = []
         data_dict = {}
         for i, item in enumerate(items):
             if isinstance(item, basestring):
                 item_strings.append(item)
             else:
-                placeholder = "item{0:03d}".format(i)
+                placeholder = "{0}{1:03d}".format(prefix, i)
                 spec, data = self._datafilespec(item, placeholder)
                 item_strings.append(spec)
                 data_dict[placeholder] = data
-        result = self(cmd + " " + ", ".join(item_strings), **data_dict)
+        return cmd + " " + ", ".join(item_strings), data_dict
+
+    def _check_plot_result(self, cmd, result):
         # Result should be the empty string if successful.
         if len(result):
             # Remove Gnuplot's syntax error pointer.
@@ -436,6 +1093,74 @@ class Gnuplot(RawGnuplot):
             if not warnings_only:
                 raise GnuplotError("`{0}' returned error".format(cmd), msg)
 
+    # Informational output of `set terminal' (in interactive mode).
+    _terminal_info_pattern = re.compile(r"^\s*(Terminal type |Options are )")
+
+    def _terminal_and_output(self):
+        # Return the current terminal (the arguments to `set terminal') and
+        # output (the empty string if none has been set).
+        saved = RawGnuplot.__call__(self, 'print GPVAL_TERM . "\\n" . '
+                                    '(exists("GPVAL_TERMOPTIONS") ? '
+                                    'GPVAL_TERMOPTIONS : "") . "\\n" . '
+                                    'GPVAL_OUTPUT').split("\n")
+        if len(saved) < 3:
+            raise GnuplotError("cannot get the current terminal", saved[0])
+        return " ".join(filter(None, saved[:2])), saved[2]
+
+    @contextlib.contextmanager
+    def _output_captured(self, terminal, saved=None):
+        # Within the block, plots are drawn with the given terminal (the
+        # arguments to `set terminal') to a named pipe, yielded as an
+        # _InboundNamedPipe. The terminal and output (saved, if given, as
+        # returned by _terminal_and_output()) are restored afterwards
+        # (without using `set terminal push', which a GnuplotPool relies on).
+        call = lambda command: RawGnuplot.__call__(self, command)
+        if saved is None:
+            saved = self._terminal_and_output()
+        saved_terminal, saved_output = saved
+
+        result = call("set terminal " + terminal)
+        errors = [line for line in result.splitlines() if line.strip() and
+                  not self._terminal_info_pattern.match(line)]
+        if errors:
+            call("set terminal " + saved_terminal)
+            raise GnuplotError("`set terminal' returned error",
+                               "\n".join(errors).strip())
+        pipe = _InboundNamedPipe(self._fifos)
+        try:
+            result = call("set output " + self.quote(pipe.path))
+            if result.strip():
+                raise GnuplotError("`set output' returned error",
+                                   result.strip())
+            yield pipe
+        finally:
+            if self.isalive():
+                # Closing the output ends the data in the pipe.
+                call("set output")
+                call("set terminal " + saved_terminal)
+                if saved_output:
+                    # Note that this truncates the file.
+                    call("set output " + self.quote(saved_output))
+            pipe.cleanup()
+
+    @contextlib.contextmanager
+    def _table_captured(self):
+        # Within the block, plots are written as tables (`set table') to a
+        # named pipe, yielded as an _InboundNamedPipe.
+        call = lambda command: RawGnuplot.__call__(self, command)
+        pipe = _InboundNamedPipe(self._fifos)
+        try:
+            result = call("set table " + self.quote(pipe.path))
+            if result.strip():
+                raise GnuplotError("`set table' returned error",
+                                   result.strip())
+            yield pipe
+        finally:
+            if self.isalive():
+                # Closing the table ends the data in the pipe.
+                call("unset table")
+            pipe.cleanup()
+
     def plot(self, *items):
         """Issue a `plot' command with the given items.
 
@@ -448,14 +1173,14 @@ class Gnuplot(RawGnuplot):
         Gnuplot().plot("sin(x) notitle", "'some_file.dat' with lp",
                        (some_data, "binary array=(512,512) with image"))
         """
-        self._plot("plot", *items)
+        return self._plot("plot", *items)
 
     def splot(self, *items):
         """Issue an `splot' command with the given items.
 
         See the documentation for plot().
         """
-        self._plot("splot", *items)
+        return self._plot("splot", *items)
 
     def replot(self, *items):
         """Issue a `replot' command with the given items.
@@ -463,9 +1188,38 @@ class Gnuplot(RawGnuplot):
         See the documentation for plot().
 
         Note that `replot' does not work when the previous plot was made by
-        passing data to Gnuplot, unless temporary files were used explicitly.
+        passing data to Gnuplot through pipes. Data sent as datablocks or
+        files (see PlotData) can be replotted.
         """
-        self._plot("replot", *items)
+        return self._plot("replot", *items)
+
+    def tabulate(self, *items, **kwargs):
+        """Return the table of the points that plot() would draw.
+
+        The items are as for plot(). Gnuplot writes the table (`set table')
+        to a named pipe, from which it is read; nothing is drawn. The table
+        has a block of lines for each item, as described in the Gnuplot
+        documentation for `set table'; see xnuplot.table() for a parser.
+
+        Keyword Arguments:
+        splot - Use `splot' instead of `plot' (e.g. to obtain contour lines).
+
+        Example:
+        Gnuplot().tabulate(("1\\n2\\n2\\n3\\n",
+                            "using 1:(1) smooth kdensity"))
+        """
+        cmd = ("splot" if kwargs.pop("splot", False) else "plot")
+        if kwargs:
+            raise TypeError("unexpected keyword argument: " + kwargs.keys()[0])
+        if not items:
+            return ""
+        # (Not self(), so that plots do not autorefresh into the table.)
+        with self._table_captured() as table:
+            with self._cache_in_use():
+                command, data_dict = self._plot_command(cmd, *items)
+                result = RawGnuplot.__call__(self, command, **data_dict)
+            self._check_plot_result(cmd, result)
+        return table.result(self.timeout) or ""
 
     def fit(self, data, expr, via, ranges=None):
         """Issue a `fit' command.
@@ -475,9 +1229,14 @@ class Gnuplot(RawGnuplot):
         string.
         The other arguments (expr, via, and ranges) must be strings.
         """
+        with self._cache_in_use():
+            cmd, fitdata = self._fit_command(data, expr, via, ranges)
+            return self(cmd, fitdata=fitdata)
+
+    def _fit_command(self, data, expr, via, ranges):
         spec, fitdata = self._datafilespec(data, "fitdata")
         cmd = " ".join(filter(None, ("fit", ranges, expr, spec, "via", via)))
-        return self(cmd, fitdata=fitdata)
+        return cmd, fitdata
 
     def source(self, script):
         """Issue a `load' command, piping the given script as input."""
@@ -493,94 +1252,40 @@ class PlotData(object):
         """Initialize a PlotData object.
 
         Arguments:
-        data    - The data to be sent to Gnuplot.
+        data    - The data to be sent to Gnuplot: a string or any object
+                  supporting the buffer protocol (such as a NumPy array),
+                  which is written without being copied; a list of these,
+                  which are sent one after the other; or an open file, whose
+                  contents (from the current position) are sent.
         options - Datafile modifiers and plot options for the command line (a
                   string, such as "using 2:1 with linespoints").
-        mode    - One of "pipe" or "file". If "file", a temporary file will be
-                  used to pass the data to Gnuplot. This can be useful if you
-                  want to send `binary matrix' data, which doesn't work with
-                  named pipes. By default ("pipe"), a named pipe is used.
+        mode    - One of "auto", "pipe", "file", or "block". If "file", a
+                  temporary file will be used to pass the data to Gnuplot.
+                  This can be useful if you want to send `binary matrix' data,
+                  which doesn't work with named pipes. If "pipe", a named pipe
+                  is used. If "block", the data (which must be text) is sent
+                  inline as a datablock (requires Gnuplot 5.0 or later). By
+                  default ("auto"), text data smaller than
+                  Gnuplot.datablock_threshold is sent as a datablock if
+                  Gnuplot supports it, and a named pipe is used otherwise.
+                  Binary data (with the `binary' option) is refused if
+                  probe() found that Gnuplot cannot read it.
         """
         self.data = data
         self.options = options
         if mode is None:
-            mode = "pipe"
-        if mode not in ("pipe", "file"):
-            raise ValueError('PlotData mode must be either "pipe" or "file"')
+            mode = "auto"
+        if mode not in ("auto", "pipe", "file", "block"):
+            raise ValueError('PlotData mode must be one of "auto", "pipe", '
+                             '"file", or "block"')
         self.mode = mode
 
     def __repr__(self):
         data_str = " source=" + type(self.data).__name__
         options_str = " options=" + repr(self.options) if self.options else ""
-        mode_str = " mode=file" if self.mode == "file" else " mode=pipe"
+        mode_str = " mode=" + self.mode
         return "<PlotData{0}{1}{2}>".format(data_str, options_str, mode_str)
 
-class _OutboundNamedPipe(threading.Thread):
-    # Asynchronous manager for named pipe for sending data.
-    # Once constructed, takes responsibility for cleanup after data is sent.
-    def __init__(self, data, dir=None):
-        self.data = data
-        self.debug = False
-        if dir:
-            self.dir = dir
-            self.made_dir = False
-        else:
-            self.dir = tempfile.mkdtemp()
-            self.made_dir = True
-        self.path = tempfile.mktemp(prefix="fifo.", dir=self.dir)
-        super(_OutboundNamedPipe, self).__init__(name=self.path)
-        # Make the named pipe synchronously, so that it's guaranteed to be
-        # ready for immediate use by the reader.
-        os.mkfifo(self.path)
-        self.start()
-
-    def cleanup(self):
-        # Cleanup is done in run() to avoid race conditions.
-        pass
-
-    def run(self):
-        try:
-            with open(self.path, "wb") as pipe:
-                pipe.write(self.data)
-            if self.debug:
-                msg = "<<wrote {0} bytes to pipe {1}>>".format(len(self.data),
-                                                               self.path)
-                print >>sys.stderr, msg
-            if self.debug >= 2:
-                dump = subprocess.Popen(shlex.split("od -A x -t x2"),
-                                        stdin=subprocess.PIPE,
-                                        stdout=sys.stderr,
-                                        stderr=sys.stderr)
-                dump.communicate(input=self.data)
-        finally:
-            os.unlink(self.path)
-            if self.made_dir:
-                os.rmdir(self.dir)
-
-class _OutboundTempFile(object):
-    # Temporary file with same interface as _OutboundNamedPipe.
-    def __init__(self, data, dir=None):
-        self.data = data
-        self.debug = False
-        fd, self.path = tempfile.mkstemp(prefix="file.", dir=dir)
-        os.write(fd, self.data)
-        os.close(fd)
-        if self.debug:
-            msg = "<<wrote {0} bytes to tempfile {1}>>".format(len(self.data),
-                                                               self.path)
-            print >>sys.stderr, msg
-        if self.debug >= 2:
-            dump = subprocess.Popen(shlex.split("od -A x -t x2"),
-                                    stdin=subprocess.PIPE,
-                                    stdout=sys.stderr,
-                                    stderr=sys.stderr)
-            dump.communicate(input=self.data)
-
-    def cleanup(self):
-        if self.path:
-            os.unlink(self.path)
-            self.path = None
-
 def closeall():
     """Close all currently open RawGnuplot instances."""
     global _allplots
@@ -0,0 +1,104 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Inbound data: named pipes through which Gnuplot writes to us (e.g. as the
+# target of `set output' or `set table'), so that the output never touches
+# the filesystem.
+
+import errno
+import os
+import threading
+import time
+
+class _InboundNamedPipe(object):
+    # A named pipe read to the end by a thread of its own. Gnuplot must not
+    # be kept waiting on a full pipe, so the reading starts before Gnuplot
+    # opens the pipe, and continues while commands are being sent.
+
+    read_length = 65536
+
+    def __init__(self, fifos):
+        self.path = fifos.acquire()
+        self._fifos = fifos
+        self._chunks = []
+        self._error = None
+        self._opened = threading.Event()
+        self._cancelled = False
+        self.done = threading.Event()
+        thread = threading.Thread(target=self._read, name="xnuplot reader")
+        thread.daemon = True
+        thread.start()
+
+    def _read(self):
+        try:
+            # Blocks until Gnuplot (or cancel()) opens the pipe for writing.
+            fd = os.open(self.path, os.O_RDONLY)
+            self._opened.set()
+            try:
+                while True:
+                    chunk = os.read(fd, self.read_length)
+                    if not chunk:
+                        break
+                    self._chunks.append(chunk)
+            finally:
+                os.close(fd)
+        except EnvironmentError, e:
+            self._error = e
+        finally:
+            self.done.set()
+
+    def cancel(self):
+        # Stop waiting for Gnuplot to open the pipe (if it has not), by
+        # opening it ourselves, so that the reader sees an empty pipe.
+        self._cancelled = True
+        deadline = time.time() + 1.0
+        while not self._opened.is_set() and not self.done.is_set():
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError, e:
+                if e.errno == errno.ENOENT: # Removed with the tempdir.
+                    return
+                if e.errno != errno.ENXIO:
+                    raise
+                # The reader thread has yet to open the pipe.
+                if time.time() > deadline:
+                    return
+                time.sleep(0.001)
+                continue
+            os.close(fd)
+            return
+
+    def result(self, timeout=None):
+        # Wait for Gnuplot to close the pipe, and return what it wrote (None
+        # if the pipe was cancelled before Gnuplot opened it).
+        if not self.done.wait(timeout):
+            raise EnvironmentError(errno.ETIMEDOUT,
+                                   "Gnuplot did not close its output")
+        if self._error is not None:
+            raise self._error
+        if self._cancelled and not self._chunks:
+            return None
+        return "".join(self._chunks)
+
+    def cleanup(self):
+        # Called when the commands using the pipe have finished.
+        self.cancel()
+        if self.done.wait(1.0):
+            self._fifos.release(self.path)
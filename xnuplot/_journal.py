@@ -0,0 +1,450 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# The journal file format (see Journal and load()).
+#
+# The file starts with _JOURNAL_MAGIC, followed by pickled records, each a
+# tuple starting with its kind:
+#
+# ("base", session, numbers) - The state when the journal was started (or
+#     last compacted): a session dict (see _data_dict()), and for multiplots,
+#     the number of each subplot (subplots are numbered from 1; the plot
+#     itself is number 0). Always the first record.
+# ("blob", digest, bytes) - Data referred to (by _Blob) in later records.
+#     Each is written once, the first time it is referred to.
+# ("op", number, name, args, kwargs) - A call of the named method of the
+#     (sub)plot, such as append() or __call__().
+# ("set", number, name, value) - The setting of a property, such as size.
+#
+# Plot data, in the session dicts and in the arguments, is replaced with
+# _Blob references (unless it is a short string), plot items with _Item, and
+# subplots with _Subplot. Records are only appended, so a journal cut short
+# (e.g. by a crash) is still readable, up to its last complete record.
+
+from ._gnuplot import PlotData
+from ._filestore import _digest
+from ._outbound import _file_source, _segments
+from ._plot import (_BasePlot, _ObservedList, Multiplot, FileFormatError,
+                    _changes_environment, _load_plot, _load_multiplot)
+from ._session import (_JOURNAL_MAGIC, _map_data, _is_array, _is_bulk,
+                       _INLINE_LIMIT)
+import collections
+import contextlib
+import cPickle as pickle
+import os
+import threading
+import warnings
+
+_Blob = collections.namedtuple("_Blob", "digest dtype shape")
+_Item = collections.namedtuple("_Item", "data options mode")
+_Subplot = collections.namedtuple("_Subplot", "number session")
+
+def _blob(data, blobs):
+    # Return the _Blob reference to data, adding the bytes to the dict blobs
+    # (digest -> bytes).
+    dtype = shape = None
+    if _is_array(data):
+        dtype, shape = data.dtype.str, data.shape
+    fd = _file_source(data)
+    if fd is not None:
+        saved_position = data.tell()
+        try:
+            contents = data.read()
+        finally:
+            data.seek(saved_position)
+    elif isinstance(data, str):
+        contents = data
+    else:
+        contents = "".join(segment.tobytes() for segment in _segments(data))
+    digest = _digest(contents)
+    blobs[digest] = contents
+    return _Blob(digest, dtype, shape)
+
+def _encoded_data(data, blobs):
+    if isinstance(data, (list, tuple)):
+        return type(data)(_encoded_data(segment, blobs) for segment in data)
+    if isinstance(data, str):
+        if len(data) < _INLINE_LIMIT:
+            return data
+    elif not _is_bulk(data):
+        return data # Left to pickle.
+    return _blob(data, blobs)
+
+def _decoded_data(data, blobs):
+    if isinstance(data, _Blob):
+        contents = blobs[data.digest]
+        if data.dtype is None:
+            return contents
+        import numpy
+        return numpy.frombuffer(contents, data.dtype).reshape(data.shape)
+    if isinstance(data, (list, tuple)):
+        return type(data)(_decoded_data(segment, blobs) for segment in data)
+    return data
+
+def _encoded_session(session, blobs):
+    return _map_data(session, lambda data: _encoded_data(data, blobs))
+
+def _decoded_session(session, blobs):
+    return _map_data(session, lambda data: _decoded_data(data, blobs))
+
+class _Writer(object):
+    # Appends records to a journal file, writing each blob once.
+
+    def __init__(self, filename, sync):
+        self._file = open(filename, "wb")
+        self._sync = sync
+        self._written = set() # Digests of the blobs written.
+        self._file.write(_JOURNAL_MAGIC)
+
+    def write(self, entry):
+        # entry is a (record, blobs) pair.
+        record, blobs = entry
+        for digest, contents in blobs.iteritems():
+            if digest not in self._written:
+                pickle.dump(("blob", digest, contents), self._file,
+                            pickle.HIGHEST_PROTOCOL)
+                self._written.add(digest)
+        pickle.dump(record, self._file, pickle.HIGHEST_PROTOCOL)
+        self._file.flush()
+        if self._sync:
+            os.fsync(self._file.fileno())
+
+    def size(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+class Journal(object):
+    """An append-only record of the changes made to a plot.
+
+    A Journal autosaves a Plot, SPlot, Multiplot, or GridMultiplot
+    incrementally: the file starts with the state of the plot when the
+    journal is attached (as save() would write it), and each subsequent
+    change is appended as it is made. Only what changes is written: each
+    modification of the list of plot items (or subplots), each setting of a
+    property such as size, and each command (sent through __call__() or
+    call_lines()) that could change Gnuplot's settings. Plot data is written
+    once per file, however many times it is used, and is recognized by its
+    content (SHA-1 digest).
+
+    A journal file is read with load(), which replays the changes, returning
+    the plot as it was when the last change was recorded. If the file was
+    cut short (e.g. by a crash), the incomplete last record is ignored (with
+    a warning).
+
+    When the file has grown larger than compact_bytes (and twice its size
+    when last compacted), it is compacted: a new file, starting with the
+    current state, is written by a background thread, and replaces the old
+    one (which is appended to in the meantime, so that nothing is lost if
+    the compaction is interrupted).
+
+    Changes made other than through the plot (e.g. in interact(), or to the
+    contents of the data arrays) are not recorded until the next compaction.
+    Data that is not a string or an array (e.g. a buffer or a file) is
+    replayed as a string.
+
+    Example:
+    plot = Plot()
+    journal = Journal(plot, "session.journal")
+    plot.append("sin(x)")
+    plot("set grid")
+    ...
+    plot = load("session.journal")
+
+    Methods:
+    __init__() - constructor
+    compact() - start compaction now
+    close() - stop recording changes
+
+    Attributes:
+    filename - the name of the journal file
+    compact_bytes - the size above which the file is compacted (None to
+                    compact only when compact() is called)
+    sync - whether each record is flushed to disk (by fsync()) when written
+    """
+
+    def __init__(self, plot, filename, compact_bytes=16777216, sync=False):
+        """Start recording the changes made to plot in the named file.
+
+        The file is overwritten. The journal stays attached to the plot until
+        it is closed.
+
+        Keyword Arguments:
+        plot - A Plot, SPlot, Multiplot, or GridMultiplot.
+        filename - The name of the journal file.
+        compact_bytes - The size (in bytes) above which the file is
+                        compacted, or None.
+        sync - If true, each record is written to disk (by fsync()) before
+               the change it records returns. This is slow, but protects
+               against loss of power (rather than just a crash).
+        """
+        if not isinstance(plot, _BasePlot):
+            raise TypeError("only a Plot, SPlot, Multiplot, or GridMultiplot "
+                            "can be journaled")
+        self.filename = filename
+        self.compact_bytes = compact_bytes
+        self.sync = sync
+        self._plot = plot
+        self._lock = threading.RLock()
+        self._numbers = {} # id(subplot) -> number
+        self._subplots = {} # number -> subplot
+        self._compaction = None # The compaction thread.
+        # Entries recorded during compaction, to be written to the new file.
+        self._pending = None
+        with plot._refresh_lock:
+            with self._lock:
+                self._writer = _Writer(filename, sync)
+                self._writer.write(self._encoded_base(self._snapshot()))
+                self._base_size = self._writer.size()
+                plot._journals += (self,)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop recording, after waiting for any compaction to finish."""
+        with self._lock:
+            compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+        with self._lock:
+            if self._writer is None:
+                return
+            for plot in [self._plot] + self._subplots.values():
+                plot._journals = tuple(journal for journal in plot._journals
+                                       if journal is not self)
+            self._writer.close()
+            self._writer = None
+
+    def compact(self):
+        """Start compacting the file, unless already being compacted.
+
+        The compaction is done by a background thread; close() waits for it
+        to finish.
+        """
+        # The state is captured now, so that the changes recorded from now
+        # on can be appended to it.
+        with self._plot._refresh_lock:
+            with self._lock:
+                if self._writer is None or self._compaction is not None:
+                    return
+                self._pending = []
+                self._compaction = threading.Thread(
+                        target=self._write_compacted,
+                        args=(self._snapshot(),),
+                        name="xnuplot journal compaction")
+                self._compaction.daemon = True
+                self._compaction.start()
+
+    def _write_compacted(self, snapshot):
+        # Write the new file and replace the old one with it (in the
+        # compaction thread).
+        temporary = self.filename + ".compacting"
+        try:
+            writer = _Writer(temporary, self.sync)
+            try:
+                writer.write(self._encoded_base(snapshot))
+                base_size = writer.size()
+                while True:
+                    with self._lock:
+                        entries, self._pending = self._pending, []
+                        if not entries:
+                            os.rename(temporary, self.filename)
+                            writer, self._writer = self._writer, writer
+                            self._base_size = base_size
+                            self._pending = None
+                            break
+                    for entry in entries:
+                        writer.write(entry)
+            finally:
+                # (The old file, if the new one has replaced it.)
+                writer.close()
+        except Exception, e:
+            warnings.warn("journal compaction failed: {0}".format(e))
+            with self._lock:
+                self._pending = None
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        finally:
+            with self._lock:
+                self._compaction = None
+
+    def _snapshot(self):
+        # Return the current state (with the plot and self locked).
+        session = self._plot._data_dict()
+        numbers = None
+        if isinstance(self._plot, Multiplot):
+            numbers = [self._number(subplot) for subplot in self._plot]
+        return session, numbers
+
+    def _encoded_base(self, snapshot):
+        session, numbers = snapshot
+        blobs = {}
+        return ("base", _encoded_session(session, blobs), numbers), blobs
+
+    def _number(self, subplot):
+        # Return the number of the subplot, first attaching the journal to it
+        # if it is new.
+        if subplot is self._plot:
+            return 0
+        number = self._numbers.get(id(subplot))
+        if number is None:
+            number = len(self._subplots) + 1
+            self._numbers[id(subplot)] = number
+            self._subplots[number] = subplot
+            subplot._journals += (self,)
+        return number
+
+    def _encoded(self, value, blobs):
+        # Encode a method argument.
+        if isinstance(value, _BasePlot):
+            return _Subplot(self._number(value),
+                            _encoded_session(value._data_dict(), blobs))
+        if isinstance(value, list):
+            return [self._encoded(item, blobs) for item in value]
+        if isinstance(value, tuple):
+            value = PlotData(*value)
+        if isinstance(value, PlotData):
+            return _Item(_encoded_data(value.data, blobs), value.options,
+                         value.mode)
+        return _encoded_data(value, blobs)
+
+    @contextlib.contextmanager
+    def _recording(self, plot, name, args, kwargs):
+        # Record the call plot.name(*args, **kwargs), made within the block
+        # (see _ObservedList._with_autorefresh()), if it succeeds. The lock
+        # is held throughout, so that the records are in the order of the
+        # changes.
+        with self._lock:
+            if name == "remove":
+                # Recorded by position, since the replayed items are copies.
+                try:
+                    index = plot.index(args[0])
+                except ValueError:
+                    pass # remove() fails.
+            yield
+            if self._writer is None:
+                return
+            blobs = {}
+            number = self._number(plot)
+            if name in ("__call__", "call_lines"):
+                if not _changes_environment(args[0]):
+                    return
+                data = dict((key, _encoded_data(value, blobs))
+                            for key, value in kwargs.iteritems())
+                record = ("op", number, name, args, data)
+            elif name == "remove":
+                record = ("op", number, "__delitem__", (index,), {})
+            elif name == "sort":
+                # The order may depend on a key function, so the result is
+                # recorded.
+                items = self._encoded(list(plot), blobs)
+                record = ("op", number, "__setitem__", (slice(None), items),
+                          {})
+            elif name in _ObservedList._modifying_methods:
+                args = tuple(self._encoded(arg, blobs) for arg in args)
+                record = ("op", number, name, args, {})
+            else:
+                record = ("set", number, name, _encoded_data(args[0], blobs))
+            self._append((record, blobs))
+        self._compact_if_due()
+
+    def _append(self, entry):
+        self._writer.write(entry)
+        if self._pending is not None:
+            self._pending.append(entry)
+
+    def _compact_if_due(self):
+        with self._lock:
+            due = (self.compact_bytes is not None and
+                   self._writer is not None and self._compaction is None and
+                   self._writer.size() > max(self.compact_bytes,
+                                             2 * self._base_size))
+        if due:
+            self.compact()
+
+def _replay(file, persist=False, class_=None):
+    # Return the plot recorded in a journal file (whose magic has been read).
+    blobs = {}
+    plot = None
+    subplots = {} # number -> subplot
+
+    def decoded(value):
+        if isinstance(value, list):
+            return [decoded(item) for item in value]
+        if isinstance(value, _Subplot):
+            if value.number not in subplots:
+                session = _decoded_session(value.session, blobs)
+                subplots[value.number] = _load_plot(session, persist)
+            return subplots[value.number]
+        if isinstance(value, _Item):
+            return PlotData(_decoded_data(value.data, blobs), value.options,
+                            value.mode)
+        return _decoded_data(value, blobs)
+
+    while True:
+        position = file.tell()
+        if not file.read(1):
+            break
+        file.seek(position)
+        try:
+            record = pickle.load(file)
+        except Exception:
+            warnings.warn("ignoring incomplete record at the end of "
+                          "journal file")
+            break
+
+        if record[0] == "blob":
+            blobs[record[1]] = record[2]
+            continue
+        if record[0] == "base":
+            session, numbers = record[1:]
+            session = _decoded_session(session, blobs)
+            if numbers is None:
+                plot = _load_plot(session, persist, class_)
+                continue
+            plot = _load_multiplot(dict(session, items=[]), persist, class_)
+            for number, subsession in zip(numbers, session["items"]):
+                if number not in subplots:
+                    subplots[number] = _load_plot(subsession, persist)
+                plot.append(subplots[number])
+            continue
+        if plot is None:
+            raise FileFormatError("journal does not start with the plot")
+
+        target = plot if record[1] == 0 else subplots.get(record[1])
+        if target is None:
+            continue
+        if record[0] == "op":
+            name, args, kwargs = record[2:]
+            args = tuple(decoded(arg) for arg in args)
+            kwargs = dict((key, decoded(value))
+                          for key, value in kwargs.iteritems())
+            getattr(target, name)(*args, **kwargs)
+        elif record[0] == "set":
+            setattr(target, record[2], _decoded_data(record[3], blobs))
+
+    if plot is None:
+        raise FileFormatError("journal does not start with the plot")
+    return plot
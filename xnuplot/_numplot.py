@@ -21,6 +21,7 @@
 from . import PlotData
 from ._plot import Plot as _Plot, SPlot as _SPlot
 import numpy
+import re
 
 def array(arr, options=None, coord_options=None, using=None):
     """Return a binary array plot data item for a NumPy array."""
@@ -51,7 +52,7 @@ def matrix(arr, xcoords, ycoords, options=None):
 
 def _array_or_record(arr, array_or_record, options,
                      coord_options=None, using=None):
-    a = numpy.require(arr, requirements="C")
+    a = numpy.asanyarray(arr)
 
     # TODO To support structured arrays (arr.dtype.fields is not None), we
     # would allow ndim to be 1 iff arr is a structured array, use the full
@@ -64,6 +65,8 @@ def _array_or_record(arr, array_or_record, options,
     count = a.shape[-1]
 
     dataspec = "{0}=({1})".format(array_or_record, gnuplot_shape)
+    # The data is written straight from the array's buffer, so it is only
+    # copied if it must be converted (at most once, for both type and order).
     a, format = _gnuplot_array_and_format(a, count)
     byteorder = _gnuplot_byteorder(a.dtype)
     endian = (None if byteorder == "default" else "endian=" + byteorder)
@@ -89,15 +92,18 @@ def _array_or_record(arr, array_or_record, options,
     return PlotData(a, options)
 
 def _gnuplot_array_and_format(a, count=1):
-    # Get the corresponding Gnuplot format, converting a if necessary.
+    # Get the corresponding Gnuplot format, converting a to a C-contiguous
+    # array of a Gnuplot type if necessary.
+    dtype = a.dtype
     try:
-        typespec = _gnuplot_type_for_dtype(a.dtype)
+        typespec = _gnuplot_type_for_dtype(dtype)
     except TypeError:
-        if a.dtype.type == numpy.bool_:
-            a = a.astype(numpy.uint8)
+        if dtype.type == numpy.bool_:
+            dtype = numpy.dtype(numpy.uint8)
         else:
-            a = a.astype(numpy.float32)
-        typespec = _gnuplot_type_for_dtype(a.dtype)
+            dtype = numpy.dtype(numpy.float32)
+        typespec = _gnuplot_type_for_dtype(dtype)
+    a = numpy.require(a, dtype=dtype, requirements="C")
     if count > 1:
         format = "format='%{0}{1}'".format(count, typespec)
     else:
@@ -126,3 +132,79 @@ def _gnuplot_byteorder(numpy_dtype):
     elif e == "<": return "little"
     else: raise TypeError("cannot get byte order of NumPy array")
 
+_pnm_header_pattern = re.compile(r"(P[456])((?:\s+(?:#[^\n]*\n)*\s*\d+){2,3})"
+                                 r"\s")
+
+def _decode_pnm(data):
+    # Decode a binary PBM (P4), PGM (P5), or PPM (P6) image, as written by
+    # Gnuplot's pbm terminal, into an array: (height, width) bool for PBM
+    # (True is black), (height, width) for PGM, (height, width, 3) for PPM.
+    match = _pnm_header_pattern.match(data)
+    if not match:
+        raise ValueError("not a binary PBM/PGM/PPM image")
+    magic = match.group(1)
+    fields = [int(f) for f in re.sub(r"#[^\n]*\n", " ",
+                                     match.group(2)).split()]
+    width, height = fields[:2]
+    pixels = buffer(data, match.end())
+    if magic == "P4":
+        row_bytes = (width + 7) // 8
+        packed = numpy.frombuffer(pixels, dtype=numpy.uint8,
+                                  count=row_bytes * height)
+        bits = numpy.unpackbits(packed.reshape(height, row_bytes), axis=1)
+        return bits[:, :width].astype(bool)
+    if len(fields) < 3:
+        raise ValueError("PGM/PPM image without maximum value")
+    dtype = numpy.dtype(numpy.uint8 if fields[2] < 256 else ">u2")
+    shape = (height, width, 3) if magic == "P6" else (height, width)
+    count = int(numpy.prod(shape))
+    return numpy.frombuffer(pixels, dtype=dtype, count=count).reshape(shape)
+
+def table(gp, *items, **kwargs):
+    """Return the points that gp.plot() would draw, as NumPy arrays.
+
+    The items are as for plot() (see Gnuplot.tabulate()). Returns a list
+    with a 2-D float array for each data set in the table (usually one for
+    each item; one for each contour level when splot-ing contours), with a
+    row for each point and a column for each coordinate. The in-range flag
+    written by Gnuplot is dropped.
+
+    Keyword Arguments:
+    splot - Use `splot' instead of `plot'.
+    blocks - Instead of an array, return a list of arrays for each data set,
+             split where Gnuplot separates blocks of points (by one blank
+             line), such as the scans of a surface or the separate pieces of
+             a contour line.
+    """
+    blocks = kwargs.pop("blocks", False)
+    return _parse_table(gp.tabulate(*items, **kwargs), blocks)
+
+_table_comment_pattern = re.compile(r"^[ \t]*#[^\n]*(?:\n|$)", re.M)
+_table_flag_pattern = re.compile(r"[ \t]+[iou][ \t]*$", re.M)
+_table_sets_pattern = re.compile(r"\n(?:[ \t]*\n){2,}")
+_table_blocks_pattern = re.compile(r"\n[ \t]*\n")
+
+def _parse_table(text, blocks=False):
+    # Parse the output of `set table'. Each data set is converted by a single
+    # call to numpy.fromstring(), after removing comments and flags.
+    text = _table_comment_pattern.sub("", text)
+    text = _table_flag_pattern.sub("", text)
+    datasets = []
+    for dataset in _table_sets_pattern.split("\n" + text + "\n"):
+        dataset = dataset.strip("\n")
+        if not dataset.strip():
+            continue
+        columns = len(dataset.split("\n", 1)[0].split())
+        values = numpy.fromstring(dataset, sep=" ")
+        # Blank lines within the data set are just whitespace.
+        rows = dataset.count("\n") + 1 - len(re.findall(r"^[ \t]*$",
+                                                        dataset, re.M))
+        if values.size != rows * columns:
+            raise ValueError("cannot parse Gnuplot table")
+        values = values.reshape(rows, columns)
+        if blocks:
+            lengths = [block.strip("\n").count("\n") + 1 for block in
+                       _table_blocks_pattern.split(dataset)]
+            values = numpy.split(values, numpy.cumsum(lengths)[:-1])
+        datasets.append(values)
+    return datasets
@@ -0,0 +1,637 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Outbound data: named pipes (written by a pool of reusable writer threads) and
+# temporary files, through which data is passed to Gnuplot.
+#
+# The data is written straight from the caller's buffers, through memoryview
+# slices, so that large arrays are never copied. Data can also be a list of
+# buffers (written in order, with writev() where available) or an open file
+# (copied within the kernel where possible).
+
+import collections
+import errno
+import fcntl
+import os
+import select
+import shlex
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+def _file_source(data):
+    # If data is an open file (anything with a working fileno()), return its
+    # descriptor; otherwise None.
+    try:
+        return data.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+
+def _byte_view(data):
+    # A flat memoryview of the bytes of a string or buffer-protocol object,
+    # without copying.
+    view = memoryview(data)
+    if view.ndim == 1 and view.itemsize == 1:
+        return view
+    if hasattr(view, "cast"):
+        return view.cast("B")
+    # The old-style buffer is flat (but requires contiguous data).
+    return memoryview(buffer(data))
+
+def _segments(data):
+    # The data as a list of byte memoryviews. data can be a string or
+    # buffer-protocol object, or a list or tuple of them (to be sent one
+    # after the other).
+    if isinstance(data, (list, tuple)):
+        views = [_byte_view(segment) for segment in data]
+    else:
+        views = [_byte_view(data)]
+    return [view for view in views if len(view)]
+
+def _nbytes(data):
+    # The size, in bytes, of a string, buffer-protocol object, list of them,
+    # or open file (from its current position).
+    if isinstance(data, basestring):
+        return len(data)
+    if isinstance(data, (list, tuple)):
+        return sum(_nbytes(segment) for segment in data)
+    fd = _file_source(data)
+    if fd is not None:
+        return os.fstat(fd).st_size - data.tell()
+    if hasattr(data, "nbytes"):
+        return data.nbytes
+    return len(_byte_view(data))
+
+def _libc_functions():
+    # writev(), sendfile(), copy_file_range(), and posix_fallocate() from the
+    # C library, with the signatures of their counterparts in the os module
+    # (which Python 2 lacks), as a dict of those available.
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except (ImportError, OSError, TypeError):
+        return {}
+    functions = {}
+
+    def checked(result):
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+    class Py_buffer(ctypes.Structure):
+        _fields_ = [("buf", ctypes.c_void_p), ("obj", ctypes.c_void_p),
+                    ("len", ctypes.c_ssize_t),
+                    ("itemsize", ctypes.c_ssize_t),
+                    ("readonly", ctypes.c_int), ("ndim", ctypes.c_int),
+                    ("format", ctypes.c_char_p),
+                    ("shape", ctypes.c_void_p), ("strides", ctypes.c_void_p),
+                    ("suboffsets", ctypes.c_void_p),
+                    ("smalltable", ctypes.c_ssize_t * 2),
+                    ("internal", ctypes.c_void_p)]
+
+    class iovec(ctypes.Structure):
+        _fields_ = [("iov_base", ctypes.c_void_p),
+                    ("iov_len", ctypes.c_size_t)]
+
+    try:
+        c_writev = libc.writev
+        get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+        release_buffer = ctypes.pythonapi.PyBuffer_Release
+    except AttributeError:
+        pass
+    else:
+        c_writev.argtypes = [ctypes.c_int, ctypes.POINTER(iovec),
+                             ctypes.c_int]
+        c_writev.restype = ctypes.c_ssize_t
+        get_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(Py_buffer),
+                               ctypes.c_int]
+        get_buffer.restype = ctypes.c_int
+        release_buffer.argtypes = [ctypes.POINTER(Py_buffer)]
+        release_buffer.restype = None
+        def writev(fd, buffers):
+            # The buffers are written in place; their (contiguous) memory is
+            # pinned by getting it through the buffer protocol.
+            views = (Py_buffer * len(buffers))()
+            iov = (iovec * len(buffers))()
+            pinned = 0
+            try:
+                for i, buffer in enumerate(buffers):
+                    get_buffer(buffer, views[i], 0) # (PyBUF_SIMPLE)
+                    pinned += 1
+                    iov[i].iov_base = views[i].buf
+                    iov[i].iov_len = views[i].len
+                return checked(c_writev(fd, iov, len(buffers)))
+            finally:
+                for i in xrange(pinned):
+                    release_buffer(views[i])
+        functions["writev"] = writev
+
+    offset_pointer = ctypes.POINTER(ctypes.c_int64)
+    try:
+        c_sendfile = libc.sendfile64
+    except AttributeError:
+        pass
+    else:
+        c_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, offset_pointer,
+                               ctypes.c_size_t]
+        c_sendfile.restype = ctypes.c_ssize_t
+        def sendfile(out_fd, in_fd, offset, count):
+            return checked(c_sendfile(out_fd, in_fd,
+                                      ctypes.byref(ctypes.c_int64(offset)),
+                                      count))
+        functions["sendfile"] = sendfile
+
+    try:
+        c_copy_file_range = libc.copy_file_range
+    except AttributeError:
+        pass
+    else:
+        c_copy_file_range.argtypes = [ctypes.c_int, offset_pointer,
+                                      ctypes.c_int, offset_pointer,
+                                      ctypes.c_size_t, ctypes.c_uint]
+        c_copy_file_range.restype = ctypes.c_ssize_t
+        def copy_file_range(src, dst, count, offset_src):
+            # (Written at, and advancing, the position of dst.)
+            return checked(c_copy_file_range(
+                    src, ctypes.byref(ctypes.c_int64(offset_src)), dst, None,
+                    count, 0))
+        functions["copy_file_range"] = copy_file_range
+
+    try:
+        c_fallocate = libc.posix_fallocate64
+    except AttributeError:
+        pass
+    else:
+        c_fallocate.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        c_fallocate.restype = ctypes.c_int
+        def posix_fallocate(fd, offset, length):
+            # (Returns the error number rather than setting errno.)
+            error = c_fallocate(fd, offset, length)
+            if error:
+                raise OSError(error, os.strerror(error))
+        functions["posix_fallocate"] = posix_fallocate
+    return functions
+
+_libc = None # From _libc_functions(), when first needed.
+
+def _os_function(name):
+    # The named function of the os module, or, where the os module lacks it
+    # (as in Python 2), that from the C library; None if neither has it.
+    # (ctypes and the C library are only loaded when first needed, since
+    # finding the library is slow.)
+    global _libc
+    function = getattr(os, name, None)
+    if function is None:
+        if _libc is None:
+            _libc = _libc_functions()
+        function = _libc.get(name)
+    return function
+
+_iov_max = 64 # Conservative; IOV_MAX is at least 16 and usually 1024.
+
+def _write_segments(fd, segments, max_length):
+    # Write (some of) the segments with a single system call, and remove what
+    # was written from the list. Returns the number of bytes written.
+    writev = _os_function("writev") if len(segments) > 1 else None
+    if writev is not None:
+        iov = []
+        length = 0
+        for segment in segments[:_iov_max]:
+            iov.append(segment[:max_length - length])
+            length += len(iov[-1])
+            if length >= max_length:
+                break
+        n = writev(fd, iov)
+    else:
+        n = os.write(fd, segments[0][:max_length])
+    written = n
+    while n:
+        if n < len(segments[0]):
+            segments[0] = segments[0][n:]
+            break
+        n -= len(segments.pop(0))
+    return written
+
+def _copy_range(in_fd, out_fd, offset, length, to_file=False):
+    # Copy (some of) length bytes at offset in file in_fd to out_fd, within
+    # the kernel if possible. Returns the number of bytes copied.
+    copy_file_range = _os_function("copy_file_range") if to_file else None
+    if copy_file_range is not None:
+        try:
+            return copy_file_range(in_fd, out_fd, length, offset)
+        except OSError, e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL):
+                raise
+    sendfile = _os_function("sendfile")
+    if sendfile is not None:
+        try:
+            return sendfile(out_fd, in_fd, offset, length)
+        except OSError, e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL):
+                raise
+    position = os.lseek(in_fd, 0, os.SEEK_CUR)
+    try:
+        os.lseek(in_fd, offset, os.SEEK_SET)
+        return os.write(out_fd, os.read(in_fd, length))
+    finally:
+        os.lseek(in_fd, position, os.SEEK_SET)
+
+def _write_data(fd, data, write_length=1048576):
+    # Write all of data to a blocking file descriptor.
+    in_fd = _file_source(data)
+    if in_fd is not None:
+        offset = data.tell()
+        end = offset + _nbytes(data)
+        while offset < end:
+            n = _copy_range(in_fd, fd, offset, min(end - offset, write_length),
+                            to_file=True)
+            if not n:
+                break # The file was truncated.
+            offset += n
+        return
+    segments = _segments(data)
+    while segments:
+        _write_segments(fd, segments, write_length)
+
+def _debug_dump(data, what, path):
+    print >>sys.stderr, "<<wrote {0} bytes to {1} {2}>>".format(_nbytes(data),
+                                                               what, path)
+
+def _debug_hexdump(data):
+    import subprocess
+    dump = subprocess.Popen(shlex.split("od -A x -t x2"),
+                            stdin=subprocess.PIPE,
+                            stdout=sys.stderr,
+                            stderr=sys.stderr)
+    try:
+        _write_data(dump.stdin.fileno(), data, write_length=65536)
+    finally:
+        dump.stdin.close()
+        dump.wait()
+
+
+class _FifoRecycler(object):
+    # Named pipes in a directory, reused once the command that used them has
+    # finished (at which point Gnuplot can no longer have them open).
+    def __init__(self, dir):
+        self.dir = dir
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        path = tempfile.mktemp(prefix="fifo.", dir=self.dir)
+        # Make the named pipe synchronously, so that it's guaranteed to be
+        # ready for immediate use by the reader.
+        os.mkfifo(path)
+        return path
+
+    def release(self, path):
+        with self._lock:
+            if os.path.exists(path):
+                self._free.append(path)
+
+
+class _WriterPool(object):
+    # A bounded set of reusable threads that write data to named pipes, one
+    # pipe at a time.
+    #
+    # A writer blocks in open() until Gnuplot opens the pipe for reading (or
+    # until the pipe is cancelled, which unblocks it; see
+    # _OutboundNamedPipe.cancel()). Each pipe is given a thread of its own,
+    # up to max_workers of them, so that a pipe rarely waits for a thread
+    # held by another; threads are reused, and up to max_idle of them are
+    # kept waiting for work. A monitor thread, running while there is
+    # anything to watch, cancels the pipes whose deadline passes while their
+    # writer is blocked in open(), and, while all the workers are busy,
+    # serves the queued pipes itself by polling them with nonblocking
+    # open()s (since Gnuplot may be waiting for one of those before it opens
+    # any of the pipes that the workers hold).
+
+    monitor_interval = 0.1 # Seconds between checks of the deadlines.
+    poll_interval = 0.005 # Seconds between polls of the queued pipes.
+
+    def __init__(self, max_workers=32, max_idle=4):
+        self.max_workers = max_workers
+        self.max_idle = max_idle
+        self.in_flight = 0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._workers = 0
+        self._idle = 0
+        self._opening = set() # Pipes (with deadlines) blocked in open().
+        self._monitoring = False
+
+    def submit(self, pipe):
+        with self._cond:
+            self._queue.append(pipe)
+            self.in_flight += 1
+            if self._idle >= len(self._queue):
+                self._cond.notify()
+            elif self._workers < self.max_workers:
+                self._workers += 1
+                self._start_thread(self._run, "xnuplot writer")
+            else:
+                self._start_monitor()
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+
+    def _start_monitor(self):
+        # (With self._cond held.)
+        if not self._monitoring:
+            self._monitoring = True
+            self._start_thread(self._monitor, "xnuplot writer monitor")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    if self._idle >= self.max_idle:
+                        self._workers -= 1
+                        return
+                    self._idle += 1
+                    self._cond.wait()
+                    self._idle -= 1
+                pipe = self._queue.popleft()
+            try:
+                pipe._run(self)
+            except:
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self.in_flight -= 1
+
+    def opening(self, pipe, blocked):
+        # Called by the pipe's writer before and after it blocks in open().
+        if pipe.deadline is None:
+            return
+        with self._cond:
+            if blocked:
+                self._opening.add(pipe)
+                self._start_monitor()
+            else:
+                self._opening.discard(pipe)
+
+    def _monitor(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                expired = [pipe for pipe in self._opening
+                           if pipe.deadline <= now]
+                self._opening.difference_update(expired)
+                polled = (list(self._queue)
+                          if self._workers >= self.max_workers else [])
+                if not (self._opening or polled or expired):
+                    self._monitoring = False
+                    return
+            for pipe in expired:
+                pipe.cancel()
+            for pipe in polled:
+                self._poll(pipe)
+            time.sleep(self.poll_interval if polled else
+                       self.monitor_interval)
+
+    def _poll(self, pipe):
+        # Serve the queued pipe if Gnuplot has opened it (or if it has been
+        # abandoned), unless a worker has taken it in the meantime.
+        with self._cond:
+            if pipe not in self._queue:
+                return
+            fd = pipe._open()
+            if fd is None and not pipe.done.is_set():
+                return
+            self._queue.remove(pipe)
+        try:
+            if fd is not None:
+                try:
+                    pipe._write(fd)
+                finally:
+                    os.close(fd)
+                    pipe._finish()
+        except:
+            traceback.print_exc()
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+
+_writer_pool = _WriterPool()
+
+
+class _OutboundNamedPipe(object):
+    # Named pipe for sending data, written by the writer pool. The pipe is
+    # abandoned if Gnuplot has not opened it when the command has finished
+    # (see cleanup()), or has not read it when the deadline (a time.time()
+    # value) passes.
+
+    write_length = 65536
+
+    def __init__(self, data, fifos, deadline=None, debug=False):
+        self.data = data
+        self.debug = debug
+        self.deadline = deadline
+        self.path = fifos.acquire()
+        self.created = time.time()
+        self.open_wait = None # Time taken by Gnuplot to open the pipe.
+        self._fifos = fifos
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._opening = False # A writer is blocked in open().
+        self._unblock_fd = None # Opened by cancel() to unblock the writer.
+        self._finished = False
+        self._cleaned_up = False
+        self.done = threading.Event()
+        self._start()
+
+    def _start(self):
+        _writer_pool.submit(self)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._opening and self._unblock_fd is None:
+                # Open the pipe for reading ourselves, so that the writer's
+                # open() returns (and the writer sees the cancellation).
+                try:
+                    self._unblock_fd = os.open(self.path,
+                                               os.O_RDONLY | os.O_NONBLOCK)
+                except OSError:
+                    pass # Removed with the tempdir; nothing to unblock.
+
+    def cleanup(self):
+        # Called when the command has finished. If Gnuplot has not opened the
+        # pipe by now, it never will.
+        self.cancel()
+        with self._lock:
+            self._cleaned_up = True
+            recycle = self._finished
+        if recycle:
+            self._fifos.release(self.path)
+
+    def _finish(self):
+        with self._lock:
+            self._finished = True
+            recycle = self._cleaned_up
+            if self._unblock_fd is not None:
+                os.close(self._unblock_fd)
+                self._unblock_fd = None
+        self.done.set()
+        if recycle:
+            self._fifos.release(self.path)
+
+    def _expired(self):
+        return self._cancelled or (self.deadline is not None and
+                                   time.time() > self.deadline)
+
+    def _run(self, pool):
+        # Open the pipe (waiting for Gnuplot) and write the data, in a writer
+        # thread of the pool (which cancels the pipe if the deadline passes
+        # while open() blocks).
+        try:
+            with self._lock:
+                if self._expired():
+                    return
+                self._opening = True
+            pool.opening(self, True)
+            try:
+                fd = os.open(self.path, os.O_WRONLY)
+            except OSError, e:
+                if e.errno != errno.ENOENT: # Removed with the tempdir.
+                    raise
+                return
+            finally:
+                pool.opening(self, False)
+                with self._lock:
+                    self._opening = False
+            try:
+                if not self._expired():
+                    self._opened(fd)
+                    # Written without blocking, so that the deadline and
+                    # cancellation are noticed.
+                    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+                    self._write(fd)
+            finally:
+                os.close(fd)
+        finally:
+            self._finish()
+
+    def _open(self):
+        # Open the pipe without blocking (for writers other than the pool's
+        # workers). Returns None if Gnuplot has not opened the pipe yet, or
+        # if the pipe has been abandoned (in which case it is finished).
+        if self._expired():
+            self._finish()
+            return None
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError, e:
+            if e.errno == errno.ENXIO: # No reader yet.
+                return None
+            if e.errno != errno.ENOENT: # Removed with the tempdir.
+                raise
+            self._finish()
+            return None
+        self._opened(fd)
+        return fd
+
+    def _opened(self, fd):
+        # Prepare to write to the pipe, now that Gnuplot has opened it.
+        self.open_wait = time.time() - self.created
+        self._in_fd = _file_source(self.data)
+        if self._in_fd is not None:
+            self._offset = self.data.tell()
+            self._remaining = _nbytes(self.data)
+        else:
+            self._segments = _segments(self.data)
+            self._remaining = sum(len(segment) for segment in self._segments)
+
+    def _write_some(self, fd):
+        # Write what the pipe can take without blocking. Returns True when
+        # there is nothing more to write (because all has been written, or
+        # because the pipe has been abandoned).
+        if self._expired():
+            return True
+        try:
+            if self._in_fd is not None:
+                n = _copy_range(self._in_fd, fd, self._offset,
+                                min(self._remaining, self.write_length))
+                if not n:
+                    return True # The file was truncated.
+                self._offset += n
+            else:
+                n = _write_segments(fd, self._segments, self.write_length)
+            self._remaining -= n
+        except OSError, e:
+            if e.errno == errno.EPIPE:
+                # Gnuplot stopped reading (e.g. because of an error).
+                return True
+            if e.errno != errno.EAGAIN:
+                raise
+        if self._remaining > 0:
+            return False
+        if self.debug:
+            _debug_dump(self.data, "pipe", self.path)
+        if self.debug >= 2:
+            _debug_hexdump(self.data)
+        return True
+
+    def _write(self, fd):
+        while True:
+            ready = select.select([], [fd], [], 0.05)[1]
+            if not ready:
+                if self._expired():
+                    return
+                continue
+            if self._write_some(fd):
+                return
+
+
+class _OutboundTempFile(object):
+    # Temporary file with same interface as _OutboundNamedPipe.
+    def __init__(self, data, dir=None, debug=False):
+        self.data = data
+        self.debug = debug
+        fd, self.path = tempfile.mkstemp(prefix="file.", dir=dir)
+        try:
+            _write_data(fd, self.data)
+        finally:
+            os.close(fd)
+        if self.debug:
+            _debug_dump(self.data, "tempfile", self.path)
+        if self.debug >= 2:
+            _debug_hexdump(self.data)
+
+    def cancel(self):
+        pass
+
+    def cleanup(self):
+        if self.path:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.path = None
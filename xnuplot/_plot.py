@@ -18,9 +18,17 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-from ._gnuplot import Gnuplot, PlotData, GnuplotError
+from ._gnuplot import RawGnuplot, Gnuplot, PlotData, GnuplotError
+from ._session import (_read_session, _write_session, _SESSION_MAGIC,
+                       _JOURNAL_MAGIC)
+from ._settings import _Settings
+from ._stats import _Measurement
 import collections
-import cPickle as pickle
+import contextlib
+import re
+import threading
+import time
+import warnings
 
 _MAGIC = "xnuplot-saved-session"
 _PLOT_FILE_VERSION = 0
@@ -35,6 +43,13 @@ class _ObservedList(list):
     # is true.
     autorefresh = True
     _block_refresh = False
+    _journals = () # The attached Journal objects (see _journal).
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        # Held while the list is modified (and refreshed), so that a refresh
+        # done later (see _refresh_deferred()) cannot interleave with it.
+        self._refresh_lock = threading.RLock()
 
     def clear(self):
         self[:] = []
@@ -58,24 +73,40 @@ class _ObservedList(list):
         pass
 
     def _perform_autorefresh(self):
-        if self.autorefresh:
+        if self.autorefresh and not self._refresh_deferred():
             self.refresh()
 
+    def _refresh_deferred(self):
+        # Return true if the refresh due now is to be done later instead.
+        return False
+
     # Replace all list-modifying methods with wrapped versions that call
     # self.refresh() when self.autorefresh is true.
+    #
+    # If the list has a notify_change() method, it is called after each
+    # modification with the lists of the items removed and added. For this,
+    # change (see _changes below) is called before the modification, as
+    # change(self, *args), and returns (args, removed, added); args are the
+    # arguments to use instead (iterables are turned into lists, so that
+    # they can be read twice).
+    #
+    # Each modification (as well as each call of the other methods wrapped
+    # here, such as property setters and __call__()) is also recorded in the
+    # journals attached to the list, if any.
     @staticmethod
-    def _with_autorefresh(func):
+    def _with_autorefresh(func, change=None):
         def call_and_refresh(self, *args, **kwargs):
-            if hasattr(self, "notify_change"):
-                old_contents = list(self)
-            result = func(self, *args, **kwargs)
-            if hasattr(self, "notify_change"):
-                new_contents = list(self)
-                if ([id(o) for o in new_contents] !=
-                    [id(o) for o in old_contents]):
-                    self.notify_change(old_contents, new_contents)
-            self._perform_autorefresh()
-            return result
+            with self._refresh_lock:
+                notify = change is not None and hasattr(self, "notify_change")
+                if change is not None and (notify or self._journals):
+                    args, removed, added = change(self, *args)
+                with _recorded(self._journals, self, func.__name__, args,
+                               kwargs):
+                    result = func(self, *args, **kwargs)
+                    if notify and (removed or added):
+                        self.notify_change(removed, added)
+                self._perform_autorefresh()
+                return result
         return call_and_refresh
     _modifying_methods = ["append", "extend",
                           "insert", "pop",
@@ -85,52 +116,357 @@ class _ObservedList(list):
                           "__setslice__", "__delslice__",
                           "__iadd__", "__imul__"]
 
+@contextlib.contextmanager
+def _recorded(journals, seq, name, args, kwargs):
+    # Record the call seq.name(*args, **kwargs), made within the block, in
+    # each of the journals (if the call succeeds).
+    if not journals:
+        yield
+        return
+    with journals[0]._recording(seq, name, args, kwargs):
+        with _recorded(journals[1:], seq, name, args, kwargs):
+            yield
+
+def _item_or_nothing(seq, index):
+    # The item to be removed, or nothing if the modification is going to
+    # fail (with its usual exception).
+    try:
+        return [seq[index]]
+    except (IndexError, TypeError):
+        return []
+
+def _pop_change(seq, *args):
+    return args, _item_or_nothing(seq, args[0] if args else -1), []
+
+def _remove_change(seq, item):
+    try:
+        return (item,), [seq[seq.index(item)]], []
+    except ValueError:
+        return (item,), [], []
+
+def _extend_change(seq, items):
+    items = list(items)
+    return (items,), [], items
+
+def _setitem_change(seq, index, value):
+    if isinstance(index, slice):
+        value = list(value)
+        return (index, value), seq[index], value
+    return (index, value), _item_or_nothing(seq, index), [value]
+
+def _delitem_change(seq, index):
+    if isinstance(index, slice):
+        return (index,), seq[index], []
+    return (index,), _item_or_nothing(seq, index), []
+
+def _setslice_change(seq, i, j, items):
+    items = list(items)
+    return (i, j, items), seq[i:j], items
+
+def _imul_change(seq, n):
+    if n <= 0:
+        return (n,), list(seq), []
+    return (n,), [], list(seq) * (n - 1)
+
+# For each modifying method (except reverse() and sort(), which add or
+# remove nothing), the change function for _with_autorefresh().
+_changes = {
+    "append": lambda seq, item: ((item,), [], [item]),
+    "extend": _extend_change,
+    "insert": lambda seq, index, item: ((index, item), [], [item]),
+    "pop": _pop_change,
+    "remove": _remove_change,
+    "__setitem__": _setitem_change,
+    "__delitem__": _delitem_change,
+    "__setslice__": _setslice_change,
+    "__delslice__": lambda seq, i, j: ((i, j), seq[i:j], []),
+    "__iadd__": _extend_change,
+    "__imul__": _imul_change,
+}
+
 for name in _ObservedList._modifying_methods:
     # This cannot be done within the class definition, because there is no way
     # to access the class object. (Actually, vars()[name] appears to work, but
     # the documentation recommends against such usage.)
     setattr(_ObservedList,
             name,
-            _ObservedList._with_autorefresh(getattr(list, name)))
+            _ObservedList._with_autorefresh(getattr(list, name),
+                                            _changes.get(name)))
+
+
+# Commands that do not change what `save' writes, with the length of their
+# shortest abbreviation accepted here.
+_readonly_commands = [("print", 2), ("show", 2), ("plot", 1), ("splot", 2),
+                      ("replot", 3), ("clear", 3), ("save", 2), ("pwd", 3),
+                      ("help", 1), ("history", 4), ("refresh", 4)]
+_readonly_words = frozenset(name[:length] for name, minimum
+                            in _readonly_commands
+                            for length in xrange(minimum, len(name) + 1))
+_first_word_pattern = re.compile(r"\s*([a-z]+)\b")
+# An assignment (possibly within an expression), as opposed to a comparison.
+_assignment_pattern = re.compile(r"(^|[^=!<>])=($|[^=])")
+
+def _changes_environment(command):
+    # Whether the command (or commands) could change Gnuplot's settings,
+    # functions, or variables. Anything not known to be harmless counts.
+    for statement in re.split(r"[\n;]", command):
+        if not statement.strip() or statement.lstrip().startswith("#"):
+            continue
+        match = _first_word_pattern.match(statement)
+        if not match or match.group(1) not in _readonly_words:
+            return True
+        if _assignment_pattern.search(statement):
+            return True
+    return False
+
+# The parts of `save' output that set the origin and the size (but not the
+# aspect ratio) of the plot.
+_origin_pattern = re.compile(r"\s*set\s+origin\b")
+_size_pattern = re.compile(r"\s*set\s+size\b(?P<options>.*?)"
+                           r"(\s*[-+.\deE]+\s*,\s*[-+.\deE]+)?\s*$")
+
+def _without_origin_and_size(script):
+    # Return the lines of the script, without `set origin' and with only the
+    # options (such as `ratio') of `set size'.
+    lines = []
+    for line in script.split("\n"):
+        if _origin_pattern.match(line):
+            continue
+        match = _size_pattern.match(line)
+        if match:
+            options = match.group("options").strip()
+            if not options:
+                continue
+            line = "set size " + options
+        lines.append(line)
+    return lines
 
 
 class _BasePlot(Gnuplot, _ObservedList):
+    # Minimum time (in seconds) between automatic refreshes; modifications
+    # made in the meantime are drawn by a single refresh when it has elapsed.
+    refresh_interval = 0.0
+    _environment = None # The cached environment_script().
+
     def __init__(self, autorefresh=True, description=None, **kwargs):
         _ObservedList.__init__(self)
+        self._transaction_depth = 0
+        self._refresh_pending = False # Deferred by _refresh_deferred().
+        self._refresh_scheduled = False
+        self._last_refresh = 0.0
         Gnuplot.__init__(self, **kwargs)
         self.autorefresh = autorefresh
         self.description = description
 
     __call__ = _ObservedList._with_autorefresh(Gnuplot.__call__)
+    call_lines = _ObservedList._with_autorefresh(Gnuplot.call_lines)
 
     def __repr__(self):
         classname = self.__class__.__name__
         return "<{0} {1}>".format(classname, _ObservedList.__repr__(self))
 
+    def refresh(self):
+        if self._block_refresh:
+            return
+        with self._refresh_lock:
+            self._refresh_pending = False
+            self._last_refresh = time.time()
+            measurement = _Measurement()
+            try:
+                _ObservedList.refresh(self)
+            finally:
+                self._record(measurement.record("refresh", self.description))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """A `with' statement context manager that coalesces refreshes.
+
+        Modifications made within the block do not refresh the plot (or its
+        parent multiplots); if any of them would have, a single refresh is
+        done at the end of the (outermost) block. Other threads cannot
+        modify the plot during the block.
+        """
+        with self._refresh_lock:
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+            if not self._transaction_depth and self._refresh_pending:
+                self._refresh_pending = False
+                self._perform_autorefresh()
+
+    def _refresh_deferred(self):
+        with self._refresh_lock:
+            if self._transaction_depth:
+                self._refresh_pending = True
+                return True
+            if not self.refresh_interval:
+                return False
+            delay = self._last_refresh + self.refresh_interval - time.time()
+            if delay <= 0:
+                return False
+            self._refresh_pending = True
+            if not self._refresh_scheduled:
+                self._refresh_scheduled = True
+                self._call_later(delay, self._refresh_when_due)
+            return True
+
+    def _call_later(self, delay, callback):
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+
+    def _refresh_when_due(self):
+        # Called (from a timer thread) when refresh_interval has elapsed.
+        with self._refresh_lock:
+            self._refresh_scheduled = False
+            if not self._refresh_pending or not self.isalive():
+                return
+            self._refresh_pending = False
+            try:
+                self._perform_autorefresh()
+            except Exception, e:
+                warnings.warn("automatic refresh failed: {0}".format(e))
+
+    def _reset_session(self):
+        blocking_refresh = self._block_refresh
+        self._block_refresh = True
+        try:
+            del self[:]
+            self.description = None
+            Gnuplot._reset_session(self)
+        finally:
+            self._block_refresh = blocking_refresh
+
+    def _command_issued(self, command):
+        if self._environment is not None and _changes_environment(command):
+            self._environment = None
+
+    def invalidate_environment(self):
+        """Forget the cached result of environment_script().
+
+        Only needed if Gnuplot's settings have been changed other than by
+        commands sent through this object.
+        """
+        self._environment = None
+
+    def interact(self):
+        try:
+            return Gnuplot.interact(self)
+        finally:
+            # Anything could have been typed.
+            self.invalidate_environment()
+
     def environment_script(self):
+        """Return a script that restores Gnuplot's settings (from `save').
+
+        The script is cached until a command that could change the settings
+        (such as `set', `unset', `reset', `load', or an assignment) is sent.
+        """
+        if self._spawn_args is not None:
+            # Gnuplot has not been started (see lazy), so its settings are
+            # the defaults, and there is no need to start it now.
+            return ""
+        if self._environment is not None:
+            return self._environment
         try:
             blocking_refresh = self._block_refresh
             self._block_refresh = True
-            script = self("save '-'").split("\n")
+            # (Not self(), which is non-blocking in AsyncPlot.)
+            script = RawGnuplot.__call__(self, "save '-'").split("\n")
             script = [line for line in script if len(line) and
                       not line.lstrip().startswith("#") and
                       not line.startswith("plot ") and
                       not line.startswith("splot ") and
                       not line.startswith("GNUTERM =")]
             script = "\n".join(script)
+            self._environment = script
             return script
         finally:
             self._block_refresh = blocking_refresh
 
+    def render(self, terminal=None, size=None, options=None,
+               as_array=False):
+        """Draw the plot with the given terminal and return the image.
+
+        The image is read from Gnuplot through a named pipe, so no file is
+        written. The current terminal is restored afterwards. If an output
+        (a file or a pipe) has been set, the plot is drawn by a copy (see
+        clone()) in a new Gnuplot, so that the output is left open.
+
+        Keyword Arguments:
+        terminal - The terminal (with any options), such as "pngcairo" (the
+                   default, or "png" if probe() found that Gnuplot lacks
+                   pngcairo) or "svg enhanced".
+        size - The `size' terminal option: a (width, height) tuple (in the
+               units of the terminal, e.g. pixels), or a string.
+        options - Further terminal options, as a string.
+        as_array - Return a NumPy array instead of a string of bytes: of
+                   shape (height, width, 3) for color images, (height,
+                   width) for gray or monochrome ones (the array is
+                   read-only). The terminal must be pbm, which is the default
+                   in this case ("pbm color").
+        """
+        return self._render(lambda plot: plot._perform_refresh(), terminal,
+                            size, options, as_array)
+
+    def _render(self, draw, terminal, size, options, as_array):
+        # Do the work for render(), with draw(plot) drawing the plot (self,
+        # or a copy of it).
+        if terminal is None:
+            terminal = ("pbm color" if as_array else "pngcairo")
+            self._spawn() # (Gnuplot is needed anyway.)
+            if (not as_array and self.capabilities is not None and
+                "pngcairo" not in self.capabilities.terminals):
+                terminal = "png"
+        if as_array and terminal.split()[0] != "pbm":
+            raise ValueError("as_array requires the pbm terminal")
+        spec = [terminal]
+        if size is not None:
+            if not isinstance(size, basestring):
+                size = "{0},{1}".format(*size)
+            spec.append("size " + size)
+        if options:
+            spec.append(options)
+
+        with self._refresh_lock:
+            saved = self._terminal_and_output()
+            if saved[1]:
+                # Setting the output to the pipe would close the file (or
+                # pipe) that is the current output, and setting it back would
+                # truncate it.
+                copy = self.clone(autorefresh=False)
+                try:
+                    return copy._render(draw, terminal, size, options,
+                                        as_array)
+                finally:
+                    copy.close()
+            blocking_refresh = self._block_refresh
+            self._block_refresh = True
+            try:
+                with self._output_captured(" ".join(spec), saved) as output:
+                    draw(self)
+                image = output.result(self.timeout)
+            finally:
+                self._block_refresh = blocking_refresh
+        if not image:
+            raise GnuplotError("terminal produced no output", terminal)
+        if as_array:
+            from ._numplot import _decode_pnm
+            return _decode_pnm(image)
+        return image
+
     def save(self, file):
-        data = self._data_dict() # _data_dict() defined by subclasses.
+        with self._refresh_lock:
+            data = self._data_dict() # _data_dict() defined by subclasses.
         data["magic"] = _MAGIC
 
         if hasattr(file, "write"):
-            pickle.dump(data, file)
+            _write_session(file, data)
         else:
             with open(file, "wb") as f:
-                pickle.dump(data, f)
+                _write_session(f, data)
 
 
 class Plot(_BasePlot):
@@ -158,15 +494,22 @@ class Plot(_BasePlot):
         kwargs["autorefresh"] = False
         kwargs.setdefault("description", self.description)
         copy = self.__class__(**kwargs)
-        copy.source(self.environment_script())
-        copy.size = self.size
-        copy.origin = self.origin
-        copy[:] = self
+        copy._take_contents(self)
         copy.autorefresh = autorefresh
         if autorefresh:
             copy.refresh()
         return copy
 
+    def _take_contents(self, plot):
+        # Make this plot a copy of another, sharing the plot items (but with
+        # autorefresh left alone).
+        script = plot.environment_script()
+        if script:
+            self.source(script)
+        self.size = plot.size
+        self.origin = plot.origin
+        self[:] = plot
+
     @property
     def size(self):
         return self._size
@@ -183,12 +526,23 @@ class Plot(_BasePlot):
     def origin(self, origin):
         self._origin = origin
 
+    def _reset_session(self):
+        _BasePlot._reset_session(self)
+        self.parents = []
+        self._size = None
+        self._origin = None
+
     def _perform_autorefresh(self):
         # Do not trigger parent autorefresh when just refreshing self.
         if self._block_refresh:
             return
 
-        _ObservedList._perform_autorefresh(self)
+        # If deferred, the parents are notified when the refresh is done.
+        if self._refresh_deferred():
+            return
+
+        if self.autorefresh:
+            self.refresh()
 
         for parent in self.parents:
             parent._perform_autorefresh()
@@ -299,90 +653,122 @@ class Multiplot(_BasePlot):
 
     __call__ = _ObservedList._with_autorefresh(Gnuplot.__call__)
 
+    def __init__(self, autorefresh=True, description=None, **kwargs):
+        self._subplot_counts = {} # id(subplot) -> number of occurrences
+        _BasePlot.__init__(self, autorefresh, description, **kwargs)
+
     def clone(self, recursive=False, **kwargs):
         autorefresh = kwargs.get("autorefresh", self.autorefresh)
         kwargs["autorefresh"] = False
         kwargs.setdefault("description", self.description)
         copy = self.__class__(**kwargs)
-        copy.source(self.environment_script())
+        copy._take_contents(self)
         if recursive:
             copy[:] = [subplot.clone() for subplot in self]
-        else:
-            copy[:] = self
         copy.autorefresh = autorefresh
         if autorefresh:
             copy.refresh()
         return copy
 
+    def _take_contents(self, multiplot):
+        # Make this multiplot a copy of another, sharing the subplots.
+        script = multiplot.environment_script()
+        if script:
+            self.source(script)
+        self[:] = multiplot
+
     def _multiplot_command(self):
         return "set multiplot"
 
-    def _get_origin_and_size(self):
-        message = self("show origin").strip()
-        remainder, ori_y = message.split(",")
-        ori_x = remainder.strip().split()[-1]
-        origin = tuple(float(o.strip()) for o in (ori_x, ori_y))
-
-        message = self("show size").strip()
-        message1, message2 = (m.strip() for m in message.split("\n"))
-        remainder, siz_y = message1.split(",")
-        siz_x = remainder.strip().split()[-1]
-        size = tuple(float(s.strip()) for s in (siz_x, siz_y))
-
-        return (origin, size)
-
-    def _set_origin_and_size(self, origin_size):
-        self("set origin %e, %e" % origin_size[0])
-        self("set size %e, %e" % origin_size[1])
+    def _multiplot_script(self, saved_script):
+        # Return the script that draws the whole multiplot and then restores
+        # saved_script, and the data for its placeholders. Only the settings
+        # that differ from those of the previous subplot are sent.
+        lines = [self._multiplot_command()]
+        data_dict = {}
+        restored = _Settings(saved_script)
+        settings = restored.copy()
+        # Changed by the layout (before each subplot).
+        settings.discard("origin", "size")
+        for i, plot in enumerate(self):
+            if len(plot) == 0:
+                # There is no clean way to insert an empty plot into a
+                # multiplot.
+                continue
+
+            # For GridMultiplot to work, any `set size' or `set origin' in
+            # plot.environment_script() must not override the layout.
+            # However, we do not want to drop the `set size ratio' setting.
+            plot_lines = _without_origin_and_size(plot.environment_script())
+
+            # But if the plot has size and/or origin, then that overrides
+            # anything set by the multiplot.
+            if plot.size:
+                plot_lines.append("set size %e, %e" % plot.size)
+            if plot.origin:
+                plot_lines.append("set origin %e, %e" % plot.origin)
+
+            plot_settings = _Settings("\n".join(plot_lines))
+            lines.extend(settings.delta(plot_settings))
+            settings.update(plot_settings)
+
+            prefix = "plot{0:03d}_item".format(i)
+            command, plot_data = self._plot_command(plot._plotcmd, *plot,
+                                                    prefix=prefix)
+            lines.append(command)
+            data_dict.update(plot_data)
+            # Gnuplot resets the size and origin after each plot of a
+            # layout, so any override must be sent again for the next one
+            # (and the saved settings restored at the end).
+            settings.discard("origin", "size")
+        lines.append("unset multiplot")
+        lines.extend(settings.delta(restored))
+        return "\n".join(lines), data_dict
 
     def _perform_refresh(self):
         if not self.isalive():
             return
 
-        if len(self):
-            saved_script = self.environment_script()
-            saved_prompt = self.gp_prompt
-            self.gp_prompt = "multiplot> "
-            self(self._multiplot_command())
-            try:
-                for plot in self:
-                    if len(plot) == 0:
-                        # There is no clean way to insert an empty plot into
-                        # a multiplot.
-                        continue
-
-                    # For GridMultiplot to work, we need to override any
-                    # `set size' in plot.environment_script(). However, we
-                    # do not want to override the `set size ratio' setting.
-                    saved_origin_size = self._get_origin_and_size()
-                    self.source(plot.environment_script())
-                    self._set_origin_and_size(saved_origin_size)
-
-                    # But if the plot has size and/or origin, then that
-                    # overrides anything set by the multiplot.
-                    if plot.size:
-                        self("set size %e, %e" % plot.size)
-                    if plot.origin:
-                        self("set origin %e, %e" % plot.origin)
-
-                    plotmethod = plot._plotmethod.im_func
-                    plotmethod(self, *plot)
-            finally:
-                self.gp_prompt = saved_prompt
-                self("unset multiplot")
-                self.source(saved_script)
-        else:
+        if not len(self):
             self("clear")
+            return
 
-    def notify_change(self, old, new):
-        new_ids = [id(p) for p in new]
-        old_ids = [id(p) for p in old]
-        for plot in old:
-            if id(plot) not in new_ids:
-                plot.parents = [p for p in plot.parents if p is not self]
-        for plot in new:
-            if id(plot) not in old_ids:
+        # The multiplot, followed by the restoration of our own settings, is
+        # sent as a single script, so that the refresh takes one round trip.
+        saved_script = self.environment_script()
+        with self._cache_in_use():
+            script, data_dict = self._multiplot_script(saved_script)
+            self._load_multiplot_script(script, data_dict, saved_script)
+
+    def _load_multiplot_script(self, script, data_dict, saved_script):
+        # Send a script that draws a multiplot and then restores
+        # saved_script (the settings before the script).
+        saved_prompt = self.gp_prompt
+        # An error stops the script, leaving Gnuplot in multiplot mode.
+        self.gp_prompt = [saved_prompt, "multiplot> "]
+        try:
+            output, completed = self._load_script(script, **data_dict)
+            if not completed:
+                self("unset multiplot")
+                self.source(saved_script)
+        finally:
+            self.gp_prompt = saved_prompt
+        self._environment = saved_script
+        self._check_plot_result("multiplot", output)
+
+    def notify_change(self, removed, added):
+        # Keep the subplots' parents up to date. A subplot can appear more
+        # than once, so the occurrences of each are counted.
+        counts = self._subplot_counts
+        for plot in added:
+            if not counts.get(id(plot)):
                 plot.parents.append(self)
+            counts[id(plot)] = counts.get(id(plot), 0) + 1
+        for plot in removed:
+            counts[id(plot)] -= 1
+            if not counts[id(plot)]:
+                del counts[id(plot)]
+                plot.parents = [p for p in plot.parents if p is not self]
 
     def _data_dict(self):
         subplots = []
@@ -422,6 +808,16 @@ class GridMultiplot(Multiplot):
         kwargs["offset"] = self.offset
         return Multiplot.clone(self, recursive, **kwargs)
 
+    def _take_contents(self, multiplot):
+        Multiplot._take_contents(self, multiplot)
+        self.rows = multiplot.rows
+        self.cols = multiplot.cols
+        self.rowsfirst = multiplot.rowsfirst
+        self.upwards = multiplot.upwards
+        self.title = multiplot.title
+        self.scale = multiplot.scale
+        self.offset = multiplot.offset
+
     @property
     def rows(self):
         return self._rows
@@ -490,6 +886,33 @@ class GridMultiplot(Multiplot):
         args = " ".join(args)
         return "set multiplot layout %d, %d %s" % (self.rows, self.cols, args)
 
+    def _draw_images(self, images):
+        # Draw the images (arrays of shape (height, width, 3), of the same
+        # size), in the grid cells of the nonempty subplots, in place of the
+        # subplots (see render_grid()).
+        from ._numplot import array
+        height, width = images[0].shape[:2]
+        saved_script = self.environment_script()
+        # The images fill the cells (but Gnuplot scales them if they do not
+        # fit exactly, e.g. to make room for the title).
+        lines = ["reset", "unset border", "unset tics", "unset key",
+                 "set lmargin 0", "set rmargin 0",
+                 "set tmargin 0", "set bmargin 0",
+                 "set xrange [-0.5:%g]" % (width - 0.5),
+                 "set yrange [-0.5:%g]" % (height - 0.5),
+                 self._multiplot_command()]
+        data_dict = {}
+        with self._cache_in_use():
+            for i, image in enumerate(images):
+                item = array(image, "flipy with rgbimage notitle")
+                command, image_data = self._plot_command(
+                        "plot", item, prefix="image{0:03d}_".format(i))
+                lines.append(command)
+                data_dict.update(image_data)
+            lines.extend(("unset multiplot", "reset", saved_script))
+            self._load_multiplot_script("\n".join(lines), data_dict,
+                                        saved_script)
+
     def _data_dict(self):
         data = Multiplot._data_dict(self)
 
@@ -510,20 +933,28 @@ class GridMultiplot(Multiplot):
 
 def load(file, persist=False, autorefresh=True, class_=None):
     if hasattr(file, "read"):
-        data = pickle.load(file)
+        return _load_file(file, persist, autorefresh, class_)
+    with open(file, "rb") as f:
+        return _load_file(f, persist, autorefresh, class_)
+
+def _load_file(file, persist, autorefresh, class_):
+    magic = file.read(len(_SESSION_MAGIC))
+    if magic == _JOURNAL_MAGIC:
+        # (Imported here because _journal imports this module.)
+        from ._journal import _replay
+        plot = _replay(file, persist, class_)
     else:
-        with open(file) as f:
-            data = pickle.load(f)
-
-    try:
-        assert data["magic"] == _MAGIC
-    except:
-        raise FormatError("does not appear to be an xnuplot session file")
+        data = _read_session(file, magic)
+        try:
+            assert data["magic"] == _MAGIC
+        except:
+            raise FileFormatError("does not appear to be an xnuplot session "
+                                  "file")
 
-    if data["plot"] in ("plot", "splot"):
-        plot = _load_plot(data, persist, class_)
-    else:
-        plot = _load_multiplot(data, persist, class_)
+        if data["plot"] in ("plot", "splot"):
+            plot = _load_plot(data, persist, class_)
+        else:
+            plot = _load_multiplot(data, persist, class_)
 
     plot.autorefresh = autorefresh
     if autorefresh:
@@ -533,7 +964,7 @@ def load(file, persist=False, autorefresh=True, class_=None):
 
 def _load_plot(data, persist=False, class_=None):
     if data["version"] > _LOADABLE_FILE_VERSION:
-        raise FormatError("file saved by a newer version of xnuplot")
+        raise FileFormatError("file saved by a newer version of xnuplot")
 
     kwargs = dict(persist=persist, autorefresh=False,
                   description=data.get("description"))
@@ -543,7 +974,7 @@ def _load_plot(data, persist=False, class_=None):
     elif data["plot"] == "splot":
         fileclass = SPlot
     else:
-        raise FormatError("unknown plot type: {0}".format(data["plot"]))
+        raise FileFormatError("unknown plot type: {0}".format(data["plot"]))
 
     if class_ is None:
         class_ = fileclass
@@ -571,7 +1002,7 @@ def _load_plot(data, persist=False, class_=None):
 
 def _load_multiplot(data, persist=False, class_=None):
     if data["version"] > _LOADABLE_FILE_VERSION:
-        raise FormatError("file saved by a newer version of xnuplot")
+        raise FileFormatError("file saved by a newer version of xnuplot")
 
     kwargs = dict(persist=persist, autorefresh=False,
                   description=data.get("description"))
@@ -583,7 +1014,7 @@ def _load_multiplot(data, persist=False, class_=None):
         kwargs["rows"] = data["grid_rows"]
         kwargs["cols"] = data["grid_cols"]
     else:
-        raise FormatError("unknown plot type: {0}".format(data["plot"]))
+        raise FileFormatError("unknown plot type: {0}".format(data["plot"]))
 
     if class_ is None:
         class_ = fileclass
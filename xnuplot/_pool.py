@@ -0,0 +1,247 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from ._gnuplot import Gnuplot, RawGnuplot, CommunicationError, GnuplotError
+import contextlib
+import sys
+import threading
+import time
+
+def _close_all(instances):
+    # (Called without holding the pool's lock, since closing waits for
+    # Gnuplot to exit.)
+    for gp in instances:
+        gp.close()
+
+class GnuplotPool(object):
+    """A pool of warm Gnuplot processes that can be reused.
+
+    Starting Gnuplot (and waiting for its first prompt) is expensive compared
+    to drawing a simple plot. A GnuplotPool keeps a number of idle Gnuplot
+    instances and lends them out, resetting each one (`unset multiplot',
+    `reset', and removal of temporary files) when it is returned.
+
+    Example:
+    pool = GnuplotPool(min_size=2, max_size=8)
+    with pool.gnuplot() as gp:
+        gp("set terminal png")
+        gp("set output 'sine.png'")
+        gp.plot("sin(x)")
+
+    Methods:
+    __init__() - constructor
+    gnuplot() - context manager that lends out an instance
+    acquire() - borrow an instance
+    release() - return a borrowed instance
+    evict_idle() - close instances that have been idle for too long
+    close() - close all instances
+
+    Attributes:
+    min_size - number of instances kept even when idle
+    max_size - maximum number of instances (None for no limit)
+    idle_timeout - seconds after which idle instances beyond min_size are
+                   closed (None to keep them indefinitely)
+    """
+
+    def __init__(self, min_size=1, max_size=None, idle_timeout=60.0,
+                 class_=Gnuplot, **kwargs):
+        """Return a new pool, starting min_size Gnuplot instances.
+
+        Keyword Arguments:
+        min_size - The number of instances to start now and to keep even
+                   when idle.
+        max_size - The maximum number of instances, idle or lent out. If
+                   reached, acquire() waits for an instance to be returned.
+        idle_timeout - Idle instances in excess of min_size are closed after
+                       this many seconds.
+        class_ - The class of the instances: Gnuplot (the default) or another
+                 subclass of RawGnuplot, such as Plot.
+        kwargs - Arguments used to construct the instances.
+        """
+        if max_size is not None and max_size < min_size:
+            raise ValueError("max_size must not be less than min_size")
+        if not issubclass(class_, RawGnuplot):
+            raise TypeError("pool class must be a subclass of RawGnuplot")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._class = class_
+        self._kwargs = kwargs
+        self._cond = threading.Condition()
+        self._idle = [] # (instance, time returned), most recent last.
+        self._size = 0 # Number of instances, idle or lent out.
+        self._closed = False
+
+        try:
+            for i in xrange(min_size):
+                with self._cond:
+                    self._size += 1
+                self._idle.append((self._spawn(), time.time()))
+        except:
+            # Do not leave the instances already started running.
+            error = sys.exc_info()
+            self.close()
+            raise error[0], error[1], error[2]
+
+    def __enter__(self):
+        return self
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @property
+    def size(self):
+        "The number of instances in the pool, whether idle or lent out."
+        return self._size
+
+    @property
+    def idle(self):
+        "The number of idle instances."
+        return len(self._idle)
+
+    @contextlib.contextmanager
+    def gnuplot(self, timeout=None):
+        """A `with' statement context manager that lends out an instance.
+
+        The instance is returned to the pool at the end of the `with' block.
+        """
+        gp = self.acquire(timeout)
+        try:
+            yield gp
+        finally:
+            self.release(gp)
+
+    def acquire(self, timeout=None):
+        """Borrow an instance from the pool.
+
+        If max_size instances are already lent out, wait (for at most timeout
+        seconds, if given) for one to be returned. The instance must be
+        returned with release().
+        """
+        deadline = (time.time() + timeout if timeout is not None else None)
+        evicted = []
+        try:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise CommunicationError("pool has been closed")
+                    evicted.extend(self._evict_idle())
+                    if self._idle:
+                        gp, returned = self._idle.pop()
+                        if gp.isalive():
+                            return gp
+                        self._size -= 1
+                        evicted.append(gp)
+                        continue
+                    if self.max_size is None or self._size < self.max_size:
+                        self._size += 1
+                        break
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise CommunicationError("timeout")
+                        self._cond.wait(remaining)
+        finally:
+            _close_all(evicted)
+        # Start the new instance without holding the lock.
+        return self._spawn()
+
+    def release(self, gp):
+        """Return an instance to the pool, resetting its state.
+
+        Instances whose Gnuplot process has exited, or that cannot be reset,
+        are closed instead of being kept.
+        """
+        keep = False
+        if gp.isalive() and not self._closed:
+            try:
+                gp._reset_session()
+                RawGnuplot.__call__(gp, "set terminal pop")
+                RawGnuplot.__call__(gp, "set terminal push")
+                if hasattr(gp, "autorefresh"):
+                    gp.autorefresh = self._kwargs.get("autorefresh", True)
+                keep = gp.isalive()
+            except (CommunicationError, GnuplotError):
+                pass
+        with self._cond:
+            if keep and not self._closed:
+                self._idle.append((gp, time.time()))
+                evicted = []
+            else:
+                self._size -= 1
+                evicted = [gp]
+            evicted.extend(self._evict_idle())
+            self._cond.notify()
+        _close_all(evicted)
+
+    def evict_idle(self):
+        """Close instances that have been idle for longer than idle_timeout.
+
+        At least min_size instances are kept. This is done automatically
+        whenever an instance is acquired or released.
+        """
+        with self._cond:
+            evicted = self._evict_idle()
+        _close_all(evicted)
+
+    def _evict_idle(self):
+        # Remove the instances to be evicted from the pool (with the lock
+        # held), and return them, to be closed by the caller once it has
+        # released the lock.
+        evicted = []
+        if self.idle_timeout is None:
+            return evicted
+        cutoff = time.time() - self.idle_timeout
+        # The least recently returned instances are at the front.
+        while (self._idle and self._size > self.min_size and
+               self._idle[0][1] < cutoff):
+            gp, returned = self._idle.pop(0)
+            self._size -= 1
+            evicted.append(gp)
+        return evicted
+
+    def close(self):
+        """Close all idle instances and stop lending out new ones.
+
+        Instances that are currently lent out are closed when released.
+        """
+        with self._cond:
+            self._closed = True
+            evicted = [gp for gp, returned in self._idle]
+            self._size -= len(evicted)
+            self._idle = []
+            self._cond.notify_all()
+        _close_all(evicted)
+
+    def _spawn(self):
+        gp = None
+        try:
+            gp = self._class(**self._kwargs)
+            # Remember the initial terminal, to be restored in release().
+            RawGnuplot.__call__(gp, "set terminal push")
+            return gp
+        except:
+            if gp is not None:
+                gp.close()
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
@@ -0,0 +1,242 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# What a Gnuplot binary can do, found out by running it once and remembered
+# (in memory and on disk) for as long as the binary is unchanged.
+
+from ._transport import (_PtyTransport, _PipeTransport, _find_executable,
+                         _TransportEOF, _TransportTimeout)
+import collections
+import errno
+import fcntl
+import os
+import shlex
+import tempfile
+import threading
+
+# The capabilities of a Gnuplot binary, as returned by probe().
+#
+# path - the absolute path of the binary
+# version - GPVAL_VERSION as a float (e.g. 5.4), or None if unknown
+# patchlevel - GPVAL_PATCHLEVEL, as a string
+# terminals - list of the names of the available terminals
+# readline - how Gnuplot echoes commands on a terminal: "exact" (builtin
+#            readline, or none), "gnu" (GNU readline), "bsd" (BSD libedit),
+#            or "unknown"
+# echo_error - None if xnuplot can skip the echo (see
+#              _PtyTransport.test_echo()); otherwise an error message
+# datablocks - whether datablocks (`$name << EOD') are supported
+# binary - whether binary data files are supported
+# max_line_length - the longest command line (among those tried) that could
+#                   be written to the pseudoterminal at once (without
+#                   blocking) and that Gnuplot read correctly; used as the
+#                   chunk length of _PtyTransport.send()
+# pipe - whether Gnuplot works with the pipe transport (which requires stdbuf)
+Capabilities = collections.namedtuple("Capabilities",
+                                      "path version patchlevel terminals "
+                                      "readline echo_error datablocks binary "
+                                      "max_line_length pipe")
+
+_CACHE_FORMAT = 3
+
+def _cache_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.join(os.path.expanduser("~"),
+                                             ".cache"))
+    return os.path.join(cache_home, "xnuplot", "capabilities.json")
+
+_memo = {} # key -> Capabilities
+_lock = threading.Lock()
+
+def probe(command=None, refresh=False):
+    """Return the Capabilities of the Gnuplot invoked by command.
+
+    command defaults as for RawGnuplot. The result is cached, in memory and
+    in ~/.cache/xnuplot (or $XDG_CACHE_HOME/xnuplot), keyed by the path,
+    modification time, and size of the binary (and any arguments), so
+    Gnuplot is run only the first time a given binary is probed (or if
+    refresh is true).
+    """
+    if not command:
+        command = os.environ.get("XNUPLOT_GNUPLOT", "gnuplot")
+    args = shlex.split(command)
+    path = _find_executable(args[0]) if "/" not in args[0] else args[0]
+    if path is None:
+        raise EnvironmentError(errno.ENOENT, "Gnuplot not found", args[0])
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    key = " ".join([path, repr(st.st_mtime), str(st.st_size)] + args[1:])
+    with _lock:
+        if not refresh:
+            if key in _memo:
+                return _memo[key]
+            capabilities = _load(key)
+            if capabilities is not None:
+                _memo[key] = capabilities
+                return capabilities
+        capabilities = _run_probe(command, path)
+        _memo[key] = capabilities
+        _store(key, capabilities)
+        return capabilities
+
+def _load(key):
+    import json
+    try:
+        with open(_cache_path()) as f:
+            cache = json.load(f)
+        if cache.get("format") != _CACHE_FORMAT:
+            return None
+        fields = cache["binaries"].get(key)
+        return Capabilities(**fields) if fields is not None else None
+    except (EnvironmentError, ValueError, KeyError, TypeError):
+        return None
+
+def _store(key, capabilities):
+    # The cache is only an optimization: failure to write it is ignored.
+    import json
+    path = _cache_path()
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if cache.get("format") != _CACHE_FORMAT:
+            raise ValueError()
+    except (EnvironmentError, ValueError):
+        cache = {"format": _CACHE_FORMAT, "binaries": {}}
+    cache["binaries"][key] = capabilities._asdict()
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, temppath = tempfile.mkstemp(prefix="tmp.",
+                                        dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        # Concurrent probes (from other processes) may race; the rename
+        # makes sure the file is always complete.
+        os.rename(temppath, path)
+    except EnvironmentError:
+        pass
+
+# Much longer lines risk the hang described in _PtyTransport.send().
+_probe_line_lengths = (1024, 4096, 16384)
+
+def _run_probe(command, path):
+    prompt = "gnuplot> "
+    try:
+        transport = _PtyTransport(command, prompt)
+    except (_TransportEOF, _TransportTimeout):
+        raise EnvironmentError("Gnuplot did not show a prompt")
+    try:
+        transport.timeout = 10
+        def call(line):
+            transport.send(line)
+            return transport.receive(prompt).strip()
+
+        try:
+            version = float(call("print GPVAL_VERSION"))
+        except ValueError:
+            version = None
+        patchlevel = call("print GPVAL_PATCHLEVEL")
+        terminals = call("print GPVAL_TERMINALS").split()
+        options = call("print GPVAL_COMPILE_OPTIONS").split()
+
+        echo_error = transport.test_echo(prompt)
+        readline = _echo_style(transport, prompt)
+
+        max_line_length = 0
+        for length in _probe_line_lengths:
+            text = "x" * length
+            line = 'print "{0}"'.format(text)
+            if not _written_at_once(transport, line):
+                break
+            if transport.receive(prompt).strip() != text:
+                break
+            max_line_length = len(line)
+    except (_TransportEOF, _TransportTimeout):
+        raise EnvironmentError("Gnuplot did not respond to the probe")
+    finally:
+        transport.close()
+
+    return Capabilities(path=path, version=version, patchlevel=patchlevel,
+                        terminals=terminals, readline=readline,
+                        echo_error=echo_error,
+                        # Datablocks were introduced in Gnuplot 5.0.
+                        datablocks=version is not None and version >= 5.0,
+                        binary="-BINARY_DATA" not in options,
+                        max_line_length=max_line_length,
+                        pipe=_works_with_pipe(command, version))
+
+def _echo_style(transport, prompt):
+    # Classify the characters inserted into the echo of a wrapped line (see
+    # _PtyTransport.test_echo()).
+    proc = transport.proc
+    rows, cols = proc.getwinsize()
+    line = "#" * (cols * 3)
+    proc.sendline(line)
+    proc.expect_exact(prompt)
+    echo = proc.before[:-2]
+    if echo == line:
+        return "exact"
+    breaks = set(filter(None, echo.split("#")))
+    return {" \r": "gnu", " \b": "bsd"}.get(breaks.pop() if len(breaks) == 1
+                                            else None, "unknown")
+
+def _written_at_once(transport, line):
+    # Send the line, and return whether it was written to the pty by a
+    # single write. Writing too much at once can hang (see
+    # _PtyTransport.send()), so the write is nonblocking; if it is cut
+    # short, the rest of the line is sent in chunks, as usual.
+    line += "\n"
+    fd = transport.proc.child_fd
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    try:
+        written = os.write(fd, line)
+    except OSError, e:
+        if e.errno != errno.EAGAIN:
+            raise
+        written = 0
+    finally:
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags)
+    if written < len(line):
+        transport.send(line[written:-1])
+        return False
+    transport.receive("\r\n") # Skip over the echo, as send() does.
+    return True
+
+def _works_with_pipe(command, version):
+    try:
+        transport = _PipeTransport(command)
+    except (_TransportEOF, _TransportTimeout, EnvironmentError):
+        return False
+    try:
+        transport.timeout = 10
+        transport.send("print GPVAL_VERSION")
+        reply = transport.receive().strip()
+        return _float_or_none(reply) == version
+    except (_TransportEOF, _TransportTimeout):
+        return False
+    finally:
+        transport.close()
+
+def _float_or_none(s):
+    try:
+        return float(s)
+    except ValueError:
+        return None
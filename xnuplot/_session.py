@@ -0,0 +1,169 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# The session file format (see save() and load()).
+#
+# The file starts with _SESSION_MAGIC, followed by the length of the metadata
+# (8 bytes, little-endian) and the metadata: the pickled session dict (see
+# _data_dict()), in which the data of large plot items is replaced with
+# _Block references. The data blocks follow, uncompressed, each starting at
+# a multiple of _ALIGNMENT from the start of the first. When loaded, the file
+# is memory-mapped and the blocks become read-only views of the mapping, so
+# that no data is read until it is sent to Gnuplot, and then without copying.
+#
+# Files written by earlier versions, which are just the pickled session
+# dict, can also be read.
+
+from ._outbound import _file_source, _nbytes, _segments, _write_data
+import collections
+import cPickle as pickle
+import shutil
+import struct
+import sys
+
+_SESSION_MAGIC = "\x89xnuplot session\r\n\x1a\n"
+# (Of the same length; see _journal.)
+_JOURNAL_MAGIC = "\x89xnuplot journal\r\n\x1a\n"
+_ALIGNMENT = 64
+# Strings shorter than this are kept in the metadata.
+_INLINE_LIMIT = 65536
+
+# offset - from the start of the first block
+# nbytes - the length of the block
+# dtype, shape - for NumPy arrays, the dtype (as a string) and shape;
+#                otherwise None
+_Block = collections.namedtuple("_Block", "offset nbytes dtype shape")
+
+def _map_data(session, func):
+    # Return a copy of the session dict with func applied to the data of
+    # each plot item.
+    session = dict(session)
+    if session["plot"] in ("plot", "splot"):
+        session["items"] = [item if isinstance(item, basestring)
+                            else (func(item[0]),) + tuple(item[1:])
+                            for item in session["items"]]
+    else:
+        session["items"] = [_map_data(subplot, func)
+                            for subplot in session["items"]]
+    return session
+
+def _is_array(data):
+    # A NumPy array (but not a scalar), recognized without importing NumPy.
+    return hasattr(data, "dtype") and getattr(data, "ndim", 0) >= 1
+
+def _is_bulk(data):
+    # Whether data is an array, buffer, or open file (as opposed to a string
+    # or another object, which is left to pickle).
+    if _is_array(data) or _file_source(data) is not None:
+        return True
+    types = (buffer, memoryview, bytearray)
+    mmap = sys.modules.get("mmap") # (Not imported, so data is not one.)
+    if mmap is not None:
+        types += (mmap.mmap,)
+    return isinstance(data, types)
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+def _write_session(file, session):
+    blocks = [] # (data, _Block)
+    position = [0]
+    def externalize(data):
+        if isinstance(data, (list, tuple)):
+            return type(data)(externalize(segment) for segment in data)
+        if isinstance(data, str):
+            if len(data) < _INLINE_LIMIT:
+                return data
+        elif not _is_bulk(data):
+            return data # Left to pickle.
+        dtype = shape = None
+        if _is_array(data):
+            dtype, shape = data.dtype.str, data.shape
+        block = _Block(_aligned(position[0]), _nbytes(data), dtype, shape)
+        position[0] = block.offset + block.nbytes
+        blocks.append((data, block))
+        return block
+
+    metadata = pickle.dumps(_map_data(session, externalize),
+                            pickle.HIGHEST_PROTOCOL)
+    header = _SESSION_MAGIC + struct.pack("<Q", len(metadata)) + metadata
+    file.write(header)
+    start = _aligned(len(header))
+    position = len(header)
+    fd = _file_source(file)
+    if fd is not None:
+        # Write the blocks straight from their buffers.
+        file.flush()
+        write = lambda data: _write_data(fd, data)
+    else:
+        def write(data):
+            if _file_source(data) is not None:
+                saved_position = data.tell()
+                try:
+                    shutil.copyfileobj(data, file)
+                finally:
+                    data.seek(saved_position)
+            else:
+                for segment in _segments(data):
+                    file.write(segment.tobytes())
+    for data, block in blocks:
+        write("\0" * (start + block.offset - position))
+        write(data)
+        position = start + block.offset + block.nbytes
+    if fd is not None:
+        try:
+            # So that the file object knows where we are.
+            file.seek(0, 2)
+        except IOError:
+            pass # Not seekable, so nothing to know.
+
+def _read_session(file, magic):
+    # Return the session dict. magic is what has been read from the start of
+    # the file (len(_SESSION_MAGIC) bytes).
+    try:
+        base = file.tell() - len(magic)
+    except (AttributeError, EnvironmentError):
+        base = 0
+    if magic != _SESSION_MAGIC:
+        return pickle.loads(magic + file.read())
+    length, = struct.unpack("<Q", file.read(8))
+    metadata = pickle.loads(file.read(length))
+    start = base + _aligned(len(_SESSION_MAGIC) + 8 + length)
+
+    import mmap
+    try:
+        contents = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError):
+        # Not a real file: read the blocks into memory.
+        contents = file.read()
+        start -= base + len(_SESSION_MAGIC) + 8 + length
+    def internalize(data):
+        if isinstance(data, (list, tuple)) and not isinstance(data, _Block):
+            return type(data)(internalize(segment) for segment in data)
+        if not isinstance(data, _Block):
+            return data
+        if data.dtype is not None:
+            import numpy
+            dtype = numpy.dtype(data.dtype)
+            return numpy.frombuffer(contents, dtype,
+                                    data.nbytes // dtype.itemsize,
+                                    start + data.offset).reshape(data.shape)
+        return buffer(contents, start + data.offset, data.nbytes)
+    return _map_data(metadata, internalize)
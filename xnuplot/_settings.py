@@ -0,0 +1,101 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Gnuplot's settings, as written by `save' (see environment_script()), held
+# on our side so that going from one set of settings to another takes only
+# the lines that differ.
+#
+# `save' writes every setting in full, so each setting can be replayed on
+# its own. The lines are grouped by what they set: the option of `set' or
+# `unset' (e.g. `xrange', or `style line', whose group holds the `unset
+# style line' followed by each `set style line N'), or the name of a variable
+# or function. Replaying the differing groups has the same result as
+# replaying the whole script (which leaves alone anything the script does
+# not mention, as do we).
+
+import collections
+import re
+
+_definition_pattern = re.compile(r"\s*([A-Za-z_]\w*)\s*(\([^)]*\))?\s*=(?!=)")
+
+def _setting_key(line):
+    # Return what the line sets, or None if unknown.
+    words = line.split()
+    if words[0] in ("set", "unset") and len(words) > 1:
+        if words[1] == "style" and len(words) > 2:
+            return "style " + words[2]
+        return words[1]
+    match = _definition_pattern.match(line)
+    if match:
+        return match.group(1) + ("()" if match.group(2) else "")
+    return None
+
+# Settings that change how other settings are interpreted (or reset them),
+# so that the latter are replayed whenever the former are.
+_dependents = {
+        "colorsequence": ("linetype",),
+        "timefmt": tuple(axis + "range" for axis in
+                         ("x", "x2", "y", "y2", "z", "cb", "t", "u", "v")),
+}
+for _axis in ("x", "x2", "y", "y2", "z", "cb"):
+    _dependents[_axis + "data"] = (_axis + "range",)
+
+class _Settings(object):
+    # Lines that are not understood are kept in their place, and always
+    # replayed.
+
+    def __init__(self, script=""):
+        self._groups = collections.OrderedDict() # key -> list of lines
+        unknown = 0
+        for line in script.split("\n"):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            key = _setting_key(line)
+            if key is None:
+                key = (None, unknown)
+                unknown += 1
+            self._groups.setdefault(key, []).append(line)
+
+    def copy(self):
+        copy = _Settings()
+        copy._groups = collections.OrderedDict(self._groups)
+        return copy
+
+    def discard(self, *keys):
+        # Forget the settings, e.g. when they have been changed by other
+        # means, so that they are replayed by the next delta().
+        for key in keys:
+            self._groups.pop(key, None)
+
+    def delta(self, other):
+        # Return the lines that change these settings into other.
+        changed = set(key for key, lines in other._groups.iteritems()
+                      if isinstance(key, tuple) or
+                      self._groups.get(key) != lines)
+        for key in list(changed):
+            changed.update(_dependents.get(key, ()))
+        return [line for key, lines in other._groups.iteritems()
+                if key in changed for line in lines]
+
+    def update(self, other):
+        # Record that the lines of other have been replayed.
+        for key, lines in other._groups.iteritems():
+            if not isinstance(key, tuple):
+                self._groups[key] = lines
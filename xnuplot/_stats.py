@@ -0,0 +1,181 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import collections
+import time
+
+# A record of one command (kind == "command") or plot refresh (kind ==
+# "refresh"), as passed to RawGnuplot.stats_hook. Times are in seconds.
+#
+# kind - "command" or "refresh"
+# command - the command (for a refresh, the plot's description)
+# start - the time.time() at which the command was issued
+# send - time spent sending the command (and data definitions)
+# echo - time spent skipping the echo of the command (pty transport only)
+# wait - time spent waiting for Gnuplot to finish (the prompt or sentinel)
+# total - wall time of the whole command (or refresh)
+# data_bytes - dict mapping placeholder names to the number of bytes sent
+# fifo_waits - dict mapping placeholder names (of named pipes) to the time
+#              Gnuplot took to open the pipe
+CommandRecord = collections.namedtuple("CommandRecord",
+                                       "kind command start send echo wait "
+                                       "total data_bytes fifo_waits")
+
+
+class _Measurement(object):
+    # Accumulates the times and data sizes of one command while it runs.
+    def __init__(self):
+        self.start = time.time()
+        self.send = 0.0
+        self.echo = 0.0
+        self.wait = 0.0
+        self.data_bytes = {}
+        self.fifo_waits = {}
+
+    def record(self, kind, command):
+        return CommandRecord(kind, command, self.start, self.send, self.echo,
+                             self.wait, time.time() - self.start,
+                             self.data_bytes, self.fifo_waits)
+
+
+class Histogram(object):
+    """A histogram with logarithmically spaced bins.
+
+    Bin i counts the values v with smallest * 2**(i-1) <= v < smallest * 2**i
+    (bin 0 counts all values below smallest).
+
+    Attributes:
+    smallest - upper edge of the first bin
+    counts - the list of counts per bin
+    """
+
+    def __init__(self, smallest):
+        self.smallest = smallest
+        self.counts = []
+
+    def add(self, value):
+        index = 0
+        edge = self.smallest
+        while value >= edge:
+            index += 1
+            edge *= 2
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+
+    def edges(self):
+        "Return the list of the upper edges of the bins."
+        return [self.smallest * 2 ** i for i in xrange(len(self.counts))]
+
+    def __str__(self):
+        lines = []
+        for edge, count in zip(self.edges(), self.counts):
+            if count:
+                lines.append("  < {0:<12.6g} {1:d}".format(edge, count))
+        return "\n".join(lines)
+
+
+class Stats(object):
+    """Performance statistics of a RawGnuplot instance.
+
+    Every RawGnuplot has a Stats object as its stats attribute. Totals are in
+    seconds (times) and bytes.
+
+    Attributes:
+    commands - number of commands issued
+    total_time - wall time of all commands
+    send_time - time spent sending commands
+    echo_time - time spent skipping command echoes (pty transport only)
+    wait_time - time spent waiting for Gnuplot to finish commands
+    data_items - number of data placeholders sent
+    bytes_sent - bytes of data sent through placeholders
+    fifo_wait_time - time Gnuplot took to open named pipes
+    refreshes - number of plot refreshes (Plot and its subclasses)
+    refresh_time - wall time of all refreshes
+    histograms - dict of Histogram objects, keyed by "command" (total time
+                 per command), "wait", "fifo_wait", "refresh", and "bytes"
+                 (bytes per data item)
+
+    Methods:
+    reset() - set everything to zero
+    summary() - return a readable summary
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        "Set all statistics to zero."
+        self.commands = 0
+        self.total_time = 0.0
+        self.send_time = 0.0
+        self.echo_time = 0.0
+        self.wait_time = 0.0
+        self.data_items = 0
+        self.bytes_sent = 0
+        self.fifo_wait_time = 0.0
+        self.refreshes = 0
+        self.refresh_time = 0.0
+        self.histograms = {"command": Histogram(0.0001),
+                           "wait": Histogram(0.0001),
+                           "fifo_wait": Histogram(0.0001),
+                           "refresh": Histogram(0.001),
+                           "bytes": Histogram(64)}
+
+    def add(self, record):
+        # Add a CommandRecord.
+        if record.kind == "refresh":
+            self.refreshes += 1
+            self.refresh_time += record.total
+            self.histograms["refresh"].add(record.total)
+            return
+        self.commands += 1
+        self.total_time += record.total
+        self.send_time += record.send
+        self.echo_time += record.echo
+        self.wait_time += record.wait
+        self.histograms["command"].add(record.total)
+        self.histograms["wait"].add(record.wait)
+        for nbytes in record.data_bytes.itervalues():
+            self.data_items += 1
+            self.bytes_sent += nbytes
+            self.histograms["bytes"].add(nbytes)
+        for seconds in record.fifo_waits.itervalues():
+            self.fifo_wait_time += seconds
+            self.histograms["fifo_wait"].add(seconds)
+
+    def summary(self):
+        "Return a readable summary of the statistics."
+        lines = ["{0:d} commands in {1:.6f} s (send {2:.6f} s, echo {3:.6f} s,"
+                 " wait {4:.6f} s)".format(self.commands, self.total_time,
+                                           self.send_time, self.echo_time,
+                                           self.wait_time),
+                 "{0:d} data items, {1:d} bytes; pipes waited {2:.6f} s for "
+                 "Gnuplot to open them".format(self.data_items,
+                                              self.bytes_sent,
+                                              self.fifo_wait_time),
+                 "{0:d} refreshes in {1:.6f} s".format(self.refreshes,
+                                                      self.refresh_time)]
+        for name in ("command", "wait", "fifo_wait", "refresh", "bytes"):
+            histogram = str(self.histograms[name])
+            if histogram:
+                lines.append(name + ":")
+                lines.append(histogram)
+        return "\n".join(lines)
@@ -0,0 +1,382 @@
+# Copyright (c) 2011-2012 Mark A. Tsuchida
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Transports carry commands to, and output from, the Gnuplot subprocess. A
+# transport sends one command line at a time (send()) and returns the output
+# of the commands, in order, one command at a time (receive()). RawGnuplot
+# takes care of everything else.
+
+import errno
+import fcntl
+import itertools
+import os
+import select
+import shlex
+import time
+
+# pexpect (for the pty transport) and subprocess (for the pipe transport) are
+# imported when a transport of that kind is first created.
+pexpect = None
+subprocess = None
+
+class _TransportEOF(Exception):
+    # Raised when the Gnuplot subprocess exited (or closed its output).
+    pass
+
+class _TransportTimeout(Exception):
+    # Raised when Gnuplot did not respond within the timeout.
+    pass
+
+def _find_executable(name):
+    for dir in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        path = os.path.join(dir, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+class _PtyTransport(object):
+    # Communication with Gnuplot through a pseudoterminal, using pexpect.
+    # Supports interact().
+
+    name = "pty"
+    typeahead = False # Whether commands may be sent before earlier replies.
+    last_echo_time = 0.0 # Time send() spent skipping the echo.
+    # The command that prints our markers ("printerr", or "print" for a
+    # Gnuplot that lacks it), or None if not yet known (see RawGnuplot).
+    print_command = None
+
+    def __init__(self, command, prompt, send_chunk_length=512):
+        global pexpect
+        if pexpect is None:
+            import pexpect
+        self.send_chunk_length = send_chunk_length
+        self.proc = pexpect.spawn(command)
+        self.proc.delaybeforesend = 0
+        try:
+            self.proc.expect_exact(prompt)
+        except pexpect.EOF:
+            self.close()
+            raise _TransportEOF("Gnuplot died before showing prompt")
+        except pexpect.TIMEOUT:
+            self.close()
+            raise _TransportTimeout("timeout")
+
+    def close(self):
+        self.proc.close(force=True)
+
+    def isalive(self):
+        return self.proc.isalive()
+
+    @property
+    def timeout(self):
+        return self.proc.timeout
+
+    @timeout.setter
+    def timeout(self, seconds):
+        self.proc.timeout = seconds
+
+    @property
+    def logfile(self):
+        return self.proc.logfile_read
+
+    @logfile.setter
+    def logfile(self, file):
+        self.proc.logfile_read = file
+
+    def send(self, line, extra_newline=False):
+        # The os.write() call used by pexpect seems to hang when the string
+        # sent is too long, at least on Mac OS X and Gnuplot built with GNU
+        # readline. Merely sending the line in small chunks does not prevent
+        # the hangs; it is necessary to read the echo after each chunk is sent.
+        # (Thus, it appears that Gnuplot or libreadline blocks on the echo
+        # write.) To work around this issue, we send the line in small chunks
+        # and make pexpect read and buffer the echo after each send.
+        chunk_length = self.send_chunk_length
+        n_nonend_chunks = len(line) // chunk_length
+        echo_time = 0.0
+        for i in xrange(n_nonend_chunks):
+            start = i * chunk_length
+            stop = start + chunk_length
+            self.proc.send(line[start:stop])
+            # Cause pexpect to read in the echo.
+            echo_start = time.time()
+            self.proc.expect(pexpect.TIMEOUT, timeout=0)
+            echo_time += time.time() - echo_start
+        start = n_nonend_chunks * chunk_length
+        self.proc.sendline(line[start:])
+        echo_start = time.time()
+        try:
+            # Skip over the echoed command (see test_echo()).
+            self.proc.expect_exact("\r\n")
+        except pexpect.EOF:
+            raise _TransportEOF()
+        except pexpect.TIMEOUT:
+            raise _TransportTimeout()
+        finally:
+            self.last_echo_time = echo_time + time.time() - echo_start
+        if extra_newline:
+            # The reply to the blank line is received as a separate command.
+            self.proc.sendline("")
+
+    def receive(self, prompt):
+        try:
+            self.proc.expect_exact(prompt)
+        except pexpect.EOF:
+            raise _TransportEOF()
+        except pexpect.TIMEOUT:
+            raise _TransportTimeout()
+        return self.proc.before.replace("\r\n", "\n")
+
+    def interact(self):
+        # Send a blank command so that the prompt is printed.
+        self.proc.sendline("")
+        self.proc.interact()
+
+    def test_echo(self, prompt):
+        # Determine how Gnuplot echoes the command. If Gnuplot is built without
+        # readline support, it will simply let the tty do the echo. However, if
+        # built with readline support (builtin, GNU readline, or BSD libedit),
+        # then it will turn off the tty echo and echo each input character on
+        # its own. Thus, we expect to receive an echo regardless of what
+        # proc.getecho() reports.
+        #
+        # To further complicate matters, GNU readline and BSD libedit insert
+        # control characters into the echoed text, in an attempt to move the
+        # cursor to the beginning of the next line whenever a character is
+        # entered in what would be the rightmost column of a real terminal.
+        # This causes us to see the sequence " \r" (GNU) or " \b" (BSD) every
+        # 80 characters (or whatever the width of the tty), at least with the
+        # versions I've tested (Gnuplot's builtin readline does not insert any
+        # extra characters). The exact behavior may also depend on the
+        # particular terminal in use.
+        #
+        # Fortunately, we can still just skip over to the first "\r\n" in
+        # all of the known cases. We just make sure here that these assumptions
+        # hold. Returns an error message, or None if all is well.
+
+        unknown_behavior_msg = ("Gnuplot is echoing commands in an unexpected "
+                                "fashion. Xnuplot does not (yet) know how to "
+                                "handle this. Please file a bug report. ")
+        # First, test a single-character command line.
+        self.proc.sendline("#")
+        self.proc.expect_exact(prompt)
+        echo = self.proc.before
+        if echo != "#\r\n":
+            return (unknown_behavior_msg +
+                    "(\"#\" -> \"{0}\")".format(repr(echo)))
+        # Second, test a command line long enough to be wrapped.
+        rows, cols = self.proc.getwinsize()
+        test_cmd = "#" * (cols * 3)
+        self.proc.sendline(test_cmd)
+        self.proc.expect_exact(prompt)
+        echo = self.proc.before[:-2] # Remove trailing "\r\n".
+        if echo == test_cmd:
+            # Okay: exact echo.
+            return None
+        breaks = filter(None, echo.split("#"))
+        for b in breaks[1:]:
+            if b != breaks[0]:
+                return unknown_behavior_msg + "(nonuniform linebreaks)"
+        if "\r\n" in breaks[0]:
+            return unknown_behavior_msg + "(extra CRLFs inserted)"
+        # Okay: whatever is inserted into the echo, it does not contain the
+        # "\r\n" sequence.
+        return None
+
+
+class _PipeTransport(object):
+    # Communication with Gnuplot through a plain pair of pipes. There is no
+    # tty, hence no prompt and no echo, and commands can be of any length.
+    # The output of each command is framed by a sentinel that we ask Gnuplot
+    # to print after the command. The sentinels are printed with `printerr',
+    # which, unlike `print', is not redirected by `set print' (only Gnuplots
+    # too old to have `printerr' get `print').
+
+    name = "pipe"
+    typeahead = True
+    last_echo_time = 0.0 # There is no echo.
+    read_length = 65536
+
+    def __init__(self, command, prompt=None, send_chunk_length=None):
+        global subprocess
+        if subprocess is None:
+            import subprocess
+        args = shlex.split(command)
+        # Gnuplot writes some output (e.g. that of `save '-'') to stdout,
+        # which is block-buffered when it is a pipe, while the sentinels go
+        # to stderr. Unless stdout is made line-buffered, the output can
+        # arrive after the sentinel, and be taken for that of the next
+        # command; so without stdbuf (from GNU coreutils; missing e.g. on
+        # Mac OS X and the BSDs), the transport cannot be used.
+        stdbuf = _find_executable("stdbuf")
+        if not stdbuf:
+            raise EnvironmentError(errno.ENOENT, "the pipe transport "
+                                   "requires stdbuf", "stdbuf")
+        args = [stdbuf, "-oL"] + args
+        self.proc = subprocess.Popen(args, bufsize=0, close_fds=True,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT)
+        self._in_fd = self.proc.stdin.fileno()
+        self._out_fd = self.proc.stdout.fileno()
+        for fd in (self._in_fd, self._out_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.timeout = 30
+        self.logfile = None
+        self._sync_ids = itertools.count(1)
+        self._pending = [] # Sentinels we are still waiting for, in order.
+        self._outbuf = ""
+        self._inbuf = ""
+
+        # There is no prompt to wait for, so wait for a sentinel instead
+        # (printed with `print', which nothing has redirected yet), finding
+        # out on the way whether Gnuplot knows `printerr'.
+        self.print_command = "print"
+        self._outbuf += 'printerr "XNUPLOT_PRINTERR"\n'
+        self._send_sentinel()
+        try:
+            output = self.receive()
+        except:
+            self.close()
+            raise
+        if "XNUPLOT_PRINTERR\n" in output:
+            self.print_command = "printerr"
+
+    def close(self):
+        # Gnuplot quits when its input is closed; force it if it won't.
+        try:
+            self.proc.stdin.close()
+        except EnvironmentError:
+            pass
+        for i in xrange(20):
+            if self.proc.poll() is not None:
+                return
+            time.sleep(0.05)
+        self.proc.terminate()
+        self.proc.wait()
+
+    def isalive(self):
+        return self.proc.poll() is None
+
+    def send(self, line, extra_newline=False):
+        self.enqueue(line)
+        if extra_newline:
+            self.enqueue("")
+        self._pump(0)
+
+    def enqueue(self, line):
+        # Like send(), but only buffer the line, to be written by _pump() or
+        # writable().
+        self._outbuf += line + "\n"
+        self._send_sentinel()
+
+    def _send_sentinel(self):
+        sentinel = "XNUPLOT_SYNC_{0:d}".format(next(self._sync_ids))
+        self._outbuf += '{0} "{1}"\n'.format(self.print_command, sentinel)
+        self._pending.append(sentinel + "\n")
+
+    def receive(self, prompt=None):
+        deadline = (time.time() + self.timeout
+                    if self.timeout is not None else None)
+        while True:
+            output = self.poll_receive()
+            if output is not None:
+                return output
+            if deadline is None:
+                self._pump(None)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise _TransportTimeout()
+                self._pump(remaining)
+
+    def poll_receive(self):
+        # Return the output of the next command if it has been read in, or
+        # None. Does not block.
+        sentinel = self._pending[0]
+        index = self._inbuf.find(sentinel)
+        if index < 0:
+            return None
+        self._pending.pop(0)
+        output = self._inbuf[:index]
+        self._inbuf = self._inbuf[index + len(sentinel):]
+        return output
+
+    # For use with an event loop: write when writable() (if wants_write()),
+    # and read when readable(); both return without blocking.
+    @property
+    def write_fd(self):
+        return self._in_fd
+
+    @property
+    def read_fd(self):
+        return self._out_fd
+
+    def wants_write(self):
+        return bool(self._outbuf)
+
+    def writable(self):
+        try:
+            n = os.write(self._in_fd, self._outbuf[:self.read_length])
+            self._outbuf = self._outbuf[n:]
+        except OSError, e:
+            if e.errno == errno.EPIPE:
+                raise _TransportEOF()
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def readable(self):
+        try:
+            data = os.read(self._out_fd, self.read_length)
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+            return
+        if not data:
+            raise _TransportEOF()
+        if self.logfile:
+            self.logfile.write(data)
+            self.logfile.flush()
+        self._inbuf += data
+
+    def _pump(self, timeout):
+        # Write pending commands and read available output, waiting for at
+        # most timeout seconds (indefinitely if None) for something to happen.
+        writers = [self._in_fd] if self._outbuf else []
+        try:
+            readable, writable, _ = select.select([self._out_fd], writers, [],
+                                                  timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        if writable:
+            self.writable()
+        if readable:
+            self.readable()
+
+    def test_echo(self, prompt=None):
+        # There is no echo to test.
+        return None
+
+
+_transports = {"pty": _PtyTransport, "pipe": _PipeTransport}